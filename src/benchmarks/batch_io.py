@@ -0,0 +1,122 @@
+"""
+Compara datagramas por segundo leidos y mandados:
+- de a uno sobre un socket con timeout, como lo hacia SocketTP (poll + recvfrom/sendmsg por datagrama),
+- con un loop no bloqueante de recvfrom/sendmsg (lo que usa BatchIO sin recvmmsg),
+- con BatchIO (recvmmsg/sendmmsg, una syscall por batch).
+Cada ronda llena el buffer del socket receptor con una ventana completa y mide
+solo la lectura o el envio.
+
+Uso (desde src/): python3 -m benchmarks.batch_io
+"""
+import argparse
+import time
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF
+from lib.batch_io import BatchIO
+from lib.socket_tp import SocketTP
+from lib.utils import Packet
+
+DATAGRAM_SIZE = SocketTP.PACKET_DATA_SIZE + Packet.HEADER_SIZE
+
+
+def make_sockets():
+    receiver = socket(AF_INET, SOCK_DGRAM)
+    receiver.setsockopt(SOL_SOCKET, SO_RCVBUF, 8 * 1024 * 1024)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.setblocking(False)
+    sender = socket(AF_INET, SOCK_DGRAM)
+    sender.bind(("127.0.0.1", 0))
+    return sender, receiver
+
+
+def window_messages(addr, count: int, size: int) -> list:
+    payload = memoryview(bytes(size))
+    return [(addr, Packet.header(seq_number=i * size), payload) for i in range(count)]
+
+
+def drain(receiver: socket) -> int:
+    received = 0
+    while True:
+        try:
+            receiver.recvfrom(DATAGRAM_SIZE)
+            received += 1
+        except BlockingIOError:
+            return received
+
+
+def recv_timeout(receiver: socket, count: int) -> int:
+    receiver.settimeout(SocketTP.SOCKET_TIMEOUT)
+    for _ in range(count):
+        receiver.recvfrom(DATAGRAM_SIZE)
+    receiver.setblocking(False)
+    return count
+
+
+def recv_batch(receiver: socket, batch_io: BatchIO) -> int:
+    received = 0
+    while datagrams := batch_io.recv(receiver):
+        received += len(datagrams)
+    return received
+
+
+def send_timeout(sender: socket, messages: list) -> int:
+    for addr, header, payload in messages:
+        sender.sendmsg([header, payload], [], 0, addr)
+    return len(messages)
+
+
+def measure_recv(function, sender, receiver, messages, rounds: int) -> float:
+    batch_io = BatchIO(DATAGRAM_SIZE)
+    total = 0
+    elapsed = 0
+    for _ in range(rounds):
+        batch_io.send(sender, messages)
+        time.sleep(0.01) # que lleguen todos al buffer antes de medir
+        start = time.perf_counter()
+        total += function(receiver)
+        elapsed += time.perf_counter() - start
+    return total / elapsed
+
+
+def measure_send(function, sender, receiver, messages, rounds: int) -> float:
+    total = 0
+    elapsed = 0
+    for _ in range(rounds):
+        start = time.perf_counter()
+        total += function(sender, messages)
+        elapsed += time.perf_counter() - start
+        drain(receiver)
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Datagrams per second with one syscall per datagram vs recvmmsg/sendmmsg batches.')
+    parser.add_argument('-r', '--rounds', type=int, default=200, help='windows per measurement')
+    parser.add_argument('-w', '--window', type=int, default=SocketTP.MAX_WINDOW // SocketTP.PACKET_DATA_SIZE, help='datagrams per window')
+    parser.add_argument('-s', '--size', type=int, default=SocketTP.PACKET_DATA_SIZE, help='payload size in bytes')
+    args = parser.parse_args()
+
+    sender, receiver = make_sockets()
+    sender.settimeout(SocketTP.SOCKET_TIMEOUT) # como queda el socket de SocketTP con el thread de recepcion
+    messages = window_messages(receiver.getsockname(), args.window, args.size)
+    batch_io = BatchIO(DATAGRAM_SIZE)
+    if not batch_io.native:
+        print("recvmmsg/sendmmsg no disponibles, BatchIO usa el loop de Python")
+    loop_io = BatchIO(DATAGRAM_SIZE)
+    loop_io.native = False
+
+    results = [
+        ("recv", measure_recv(lambda sock: recv_timeout(sock, len(messages)), sender, receiver, messages, args.rounds),
+                 measure_recv(lambda sock: recv_batch(sock, loop_io), sender, receiver, messages, args.rounds),
+                 measure_recv(lambda sock: recv_batch(sock, batch_io), sender, receiver, messages, args.rounds)),
+        ("send", measure_send(send_timeout, sender, receiver, messages, args.rounds),
+                 measure_send(loop_io.send, sender, receiver, messages, args.rounds),
+                 measure_send(batch_io.send, sender, receiver, messages, args.rounds)),
+    ]
+
+    print(f"{'operation':<10} {'previous dgram/s':>17} {'drain loop':>12} {'batch dgram/s':>14} {'speedup':>8}")
+    for name, current, loop, batch in results:
+        print(f"{name:<10} {current:17,.0f} {loop:12,.0f} {batch:14,.0f} {batch / current:7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
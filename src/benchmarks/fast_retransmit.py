@@ -0,0 +1,140 @@
+"""
+Compara cuanto tarda una subida con perdidas aisladas con fast retransmit
+(DUPLICATE_ACK_THRESHOLD ACKs duplicados) y sin el (solo timeouts). Un proxy UDP
+entre el cliente y el servidor descarta la primera transmision de uno de cada N
+segmentos de datos, asi las dos corridas pierden exactamente los mismos segmentos.
+
+Uso (desde src/): python3 -m benchmarks.fast_retransmit
+"""
+import argparse
+import os
+import time
+import logging
+from socket import socket, AF_INET, SOCK_DGRAM
+from threading import Thread
+from lib.constants import ErrorRecoveryMode
+from lib.socket_tp import SocketTP
+from lib.utils import Packet
+
+logging.getLogger("socket").setLevel(logging.ERROR)
+
+
+class DropProxy:
+    """
+    Reenvia datagramas entre un cliente y un servidor SocketTP descartando la primera
+    transmision de los segmentos de datos numero drop_every - 1, 2 * drop_every - 1, etc.
+    """
+    def __init__(self, server_addr, drop_every: int):
+        self.client_side = socket(AF_INET, SOCK_DGRAM)
+        self.client_side.bind(("127.0.0.1", 0))
+        self.client_side.settimeout(0.2)
+        self.server_side = socket(AF_INET, SOCK_DGRAM)
+        self.server_side.bind(("127.0.0.1", 0))
+        self.server_side.settimeout(0.2)
+        self.server_addr = server_addr
+        self.client_addr = None
+        self.drop_every = drop_every
+        self.dropped = set()
+        self.running = True
+        self.threads = [Thread(target=self._client_to_server), Thread(target=self._server_to_client)]
+        for thread in self.threads:
+            thread.start()
+
+    @property
+    def addr(self):
+        return self.client_side.getsockname()
+
+    def _should_drop(self, data: bytes) -> bool:
+        packet = Packet.from_bytes(data)
+        if packet.flags or not packet.data or packet.seq_number in self.dropped:
+            return False
+        if (packet.seq_number // SocketTP.PACKET_DATA_SIZE) % self.drop_every != self.drop_every - 1:
+            return False
+        self.dropped.add(packet.seq_number)
+        return True
+
+    def _client_to_server(self):
+        while self.running:
+            try:
+                data, self.client_addr = self.client_side.recvfrom(SocketTP.PACKET_DATA_SIZE + Packet.MAX_HEADER_SIZE)
+            except OSError:
+                continue
+            if not self._should_drop(data):
+                self.server_side.sendto(data, self.server_addr)
+
+    def _server_to_client(self):
+        while self.running:
+            try:
+                # la conexion aceptada contesta desde otro puerto, seguimos mandando ahi
+                data, self.server_addr = self.server_side.recvfrom(SocketTP.PACKET_DATA_SIZE + Packet.MAX_HEADER_SIZE)
+            except OSError:
+                continue
+            self.client_side.sendto(data, self.client_addr)
+
+    def close(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.client_side.close()
+        self.server_side.close()
+
+
+def upload(mode: ErrorRecoveryMode, data: bytes, drop_every: int, threshold: int) -> tuple:
+    """
+    Sube data a traves de un DropProxy. Devuelve (segundos de sendall, segmentos
+    descartados, stats() del cliente, lo que recibio el servidor).
+    """
+    SocketTP.DUPLICATE_ACK_THRESHOLD = threshold
+    server = SocketTP()
+    server.bind("127.0.0.1", 0)
+    server.listen()
+    proxy = DropProxy(server.socket.getsockname(), drop_every)
+    received = {}
+
+    def serve():
+        connection = server.accept()
+        received["data"] = connection.recv(len(data))
+        received["connection"] = connection
+    server_thread = Thread(target=serve)
+    server_thread.start()
+
+    client = SocketTP()
+    host, port = proxy.addr
+    client.connect(host, port, mode)
+    start = time.perf_counter()
+    client.sendall(data)
+    elapsed = time.perf_counter() - start
+    server_thread.join()
+    stats = client.stats()
+
+    closers = [Thread(target=client.close), Thread(target=received["connection"].close)]
+    for closer in closers:
+        closer.start()
+    for closer in closers:
+        closer.join()
+    server.end_connection = True
+    server.close()
+    proxy.close()
+    return elapsed, len(proxy.dropped), stats, received["data"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload time with isolated losses, with and without fast retransmit.')
+    parser.add_argument('-s', '--size', type=int, default=2_000_000, help='bytes to upload')
+    parser.add_argument('-d', '--drop-every', type=int, default=50, help='drop the first transmission of one data segment every N')
+    args = parser.parse_args()
+
+    data = os.urandom(args.size)
+    threshold = SocketTP.DUPLICATE_ACK_THRESHOLD
+    print(f"{'mode':<18} {'recovery':<16} {'lost':>5} {'timeouts':>9} {'fast rtx':>9} {'time':>8}")
+    for mode in (ErrorRecoveryMode.GO_BACK_N, ErrorRecoveryMode.SELECTIVE_REPEAT):
+        for name, value in (("timeout only", 0), (f"{threshold} dup ACKs", threshold)):
+            elapsed, lost, stats, received = upload(mode, data, args.drop_every, value)
+            if received != data:
+                raise Exception("los datos recibidos no coinciden")
+            print(f"{mode.name:<18} {name:<16} {lost:5} {stats['timeouts']:9} {stats['fast_retransmits']:9} {elapsed:7.2f}s")
+    SocketTP.DUPLICATE_ACK_THRESHOLD = threshold
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compara el costo por paquete del camino de recepcion (_process_packet de un segmento
+de datos y su ACK) y del de envio (_process_ack y el _pump del segmento siguiente):
+- como antes: los logger.debug con f-strings se arman siempre, aunque DEBUG este apagado,
+- ahora: con DEBUG apagado no se arma ningun string,
+- con la traza binaria (PacketTrace) prendida,
+- con DEBUG prendido y los logs de texto yendo a un stream que los descarta.
+No hay perdidas: se mide solo el trabajo de cada paquete, sin esperar a la red.
+
+Uso (desde src/): python3 -m benchmarks.hot_path_logging
+"""
+import argparse
+import io
+import logging
+import time
+from lib.constants import ErrorRecoveryMode
+from lib.packet_trace import PacketTrace
+from lib.socket_tp import SocketTP
+from lib.utils import Packet
+from benchmarks.batch_io import make_sockets, drain
+
+logger = logging.getLogger("socket")
+PEER = ("127.0.0.1", 9)
+
+# (nombre, f-strings armados, traza binaria, nivel del logger "socket")
+VARIANTS = [
+    ("before", True, False, logging.INFO),
+    ("now", False, False, logging.INFO),
+    ("binary trace", False, True, logging.INFO),
+    ("text DEBUG", True, False, logging.DEBUG),
+]
+
+
+def configure(socket: SocketTP, debug: bool, trace: bool):
+    socket.debug = debug
+    socket.trace = PacketTrace() if trace else None
+
+
+def receive_rate(count: int, debug: bool, trace: bool) -> float:
+    socket = SocketTP()
+    socket.dest_addr = PEER
+    socket._set_error_recovery_mode(ErrorRecoveryMode.GO_BACK_N)
+    configure(socket, debug, trace)
+    socket.on_data = lambda data: None
+    socket.outbox = [] # los ACK se juntan aca en lugar de mandarse
+    payload = bytes(SocketTP.PACKET_DATA_SIZE)
+    frames = [Packet(data=payload, seq_number=i * SocketTP.PACKET_DATA_SIZE).to_bytes() for i in range(count)]
+
+    start = time.perf_counter()
+    for frame in frames:
+        socket._process_packet(PEER, Packet.from_bytes(frame))
+        if len(socket.outbox) > 1024:
+            socket.outbox.clear()
+    elapsed = time.perf_counter() - start
+    socket.socket.close()
+    return count / elapsed
+
+
+def send_rate(count: int, debug: bool, trace: bool) -> float:
+    sender, receiver = make_sockets()
+    socket = SocketTP(sender)
+    socket.dest_addr = receiver.getsockname()
+    socket._set_error_recovery_mode(ErrorRecoveryMode.GO_BACK_N)
+    configure(socket, debug, trace)
+    # cada ACK confirma un segmento y deja lugar para mandar exactamente uno mas
+    segments = count + SocketTP.MAX_WINDOW // SocketTP.PACKET_DATA_SIZE
+    socket.send(bytes(segments * SocketTP.PACKET_DATA_SIZE))
+    acks = [Packet.ack_frame(i * SocketTP.PACKET_DATA_SIZE, SocketTP.MAX_WINDOW) for i in range(1, count + 1)]
+
+    elapsed = 0
+    for first in range(0, count, 256):
+        start = time.perf_counter()
+        for frame in acks[first: first + 256]:
+            socket._process_ack(socket.dest_addr, Packet.from_bytes(frame))
+        elapsed += time.perf_counter() - start
+        drain(receiver)
+    socket.end_connection = True
+    socket.state.close()
+    sender.close()
+    receiver.close()
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per packet cost of the send and receive paths with and without hot path logging.')
+    parser.add_argument('-c', '--count', type=int, default=100000, help='packets per measurement')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='measurements per variant, the best one is reported')
+    args = parser.parse_args()
+
+    # los logs de texto van a memoria, medimos armarlos y no la terminal
+    handler = logging.StreamHandler(io.StringIO())
+    logger.handlers = [handler]
+    logger.propagate = False
+    level = logger.level
+
+    print(f"{'variant':<14} {'recv pkt/s':>12} {'ns/pkt':>8} {'send pkt/s':>12} {'ns/pkt':>8}")
+    for name, debug, trace, variant_level in VARIANTS:
+        logger.setLevel(variant_level)
+        received = max(receive_rate(args.count, debug, trace) for _ in range(args.repeat))
+        sent = max(send_rate(args.count, debug, trace) for _ in range(args.repeat))
+        handler.stream.seek(0)
+        handler.stream.truncate()
+        print(f"{name:<14} {received:12,.0f} {1e9 / received:8,.0f} {sent:12,.0f} {1e9 / sent:8,.0f}")
+    logger.setLevel(level)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Proxy UDP que emula un enlace con problemas entre un cliente y un servidor SocketTP
+en localhost, como netem pero sin root: perdida, demora, jitter, reordenamiento y
+duplicacion, en los dos sentidos. Con la misma semilla descarta y demora siempre los
+mismos datagramas. Lo usa benchmarks.suite.
+"""
+import heapq
+import random
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF
+from threading import Thread, Condition
+from time import monotonic
+from lib.socket_tp import SocketTP
+from lib.utils import Packet
+
+DATAGRAM_SIZE = SocketTP.PACKET_DATA_SIZE + Packet.MAX_HEADER_SIZE
+
+
+class Impairment:
+    """
+    Que le pasa a cada datagrama, igual en los dos sentidos. Los tiempos en segundos.
+    """
+    def __init__(self, loss: float = 0, delay: float = 0, jitter: float = 0, reorder: float = 0, reorder_delay: float = 0.005,
+                 duplicate: float = 0, seed: int = 0):
+        self.loss = loss # probabilidad de descartar cada datagrama
+        self.delay = delay
+        self.jitter = jitter # se suma a delay, uniforme en [-jitter, jitter], sin cambiar el orden
+        self.reorder = reorder # probabilidad de demorar un datagrama reorder_delay mas, los siguientes lo pasan
+        self.reorder_delay = reorder_delay
+        self.duplicate = duplicate # probabilidad de mandar un datagrama dos veces
+        self.seed = seed
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class ImpairmentProxy:
+    """
+    El cliente se conecta a addr; lo que manda cada lado se reenvia al otro despues
+    de pasar por la emulacion. Un thread por sentido lee y otro manda lo que ya toca,
+    en orden de llegada programada.
+    """
+    def __init__(self, server_addr, impairment: Impairment):
+        self.impairment = impairment
+        # uno por sentido: lo que se decide en cada uno no depende de como se intercalen los threads
+        self.randoms = {"to_server": random.Random(impairment.seed), "to_client": random.Random(impairment.seed + 1)}
+        # como en un enlace real el jitter no reordena: nadie sale antes que el anterior de su sentido
+        self.last_due = {"to_server": 0, "to_client": 0}
+        self.client_side = self._socket()
+        self.server_side = self._socket()
+        self.server_addr = server_addr
+        self.client_addr = None
+        self.pending = [] # (momento de salida, orden, socket, datos, destino)
+        self.scheduled = Condition()
+        self.order = 0
+        self.running = True
+        self.stats = {
+            "to_server": {"datagrams": 0, "bytes": 0, "dropped": 0, "duplicated": 0, "reordered": 0},
+            "to_client": {"datagrams": 0, "bytes": 0, "dropped": 0, "duplicated": 0, "reordered": 0},
+            "data_segments": 0, # segmentos de datos del cliente, con retransmisiones
+            "unique_data_segments": 0,
+        }
+        self.seen = set()
+        self.threads = [Thread(target=self._client_to_server), Thread(target=self._server_to_client), Thread(target=self._deliver)]
+        for thread in self.threads:
+            thread.start()
+
+    @staticmethod
+    def _socket() -> socket:
+        sock = socket(AF_INET, SOCK_DGRAM)
+        sock.setsockopt(SOL_SOCKET, SO_RCVBUF, 4 * 1024 * 1024)
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(0.2)
+        return sock
+
+    @property
+    def addr(self):
+        return self.client_side.getsockname()
+
+    def _client_to_server(self):
+        while self.running:
+            try:
+                data, self.client_addr = self.client_side.recvfrom(DATAGRAM_SIZE)
+            except OSError:
+                continue
+            self._count_data(data)
+            self._schedule("to_server", self.server_side, data, lambda: self.server_addr)
+
+    def _server_to_client(self):
+        while self.running:
+            try:
+                # la conexion aceptada contesta desde otro puerto, seguimos mandando ahi
+                data, self.server_addr = self.server_side.recvfrom(DATAGRAM_SIZE)
+            except OSError:
+                continue
+            self._schedule("to_client", self.client_side, data, lambda: self.client_addr)
+
+    def _count_data(self, data: bytes):
+        packet = Packet.from_bytes(data)
+        if packet.ack or packet.syn or packet.fin or not packet.data:
+            return
+        self.stats["data_segments"] += 1
+        if packet.seq_number not in self.seen:
+            self.seen.add(packet.seq_number)
+            self.stats["unique_data_segments"] += 1
+
+    def _schedule(self, direction: str, sock: socket, data: bytes, destination):
+        impairment = self.impairment
+        stats = self.stats[direction]
+        rand = self.randoms[direction]
+        stats["datagrams"] += 1
+        stats["bytes"] += len(data)
+        if rand.random() < impairment.loss:
+            stats["dropped"] += 1
+            return
+        copies = 1
+        if rand.random() < impairment.duplicate:
+            stats["duplicated"] += 1
+            copies = 2
+        due = monotonic() + max(0, impairment.delay + rand.uniform(-impairment.jitter, impairment.jitter))
+        if rand.random() < impairment.reorder:
+            stats["reordered"] += 1
+            due += impairment.reorder_delay
+        else:
+            due = self.last_due[direction] = max(due, self.last_due[direction])
+        with self.scheduled:
+            for _ in range(copies):
+                self.order += 1
+                heapq.heappush(self.pending, (due, self.order, sock, data, destination))
+            self.scheduled.notify()
+
+    def _deliver(self):
+        while self.running:
+            with self.scheduled:
+                if not self.pending:
+                    self.scheduled.wait(0.2)
+                    continue
+                wait = self.pending[0][0] - monotonic()
+                if wait > 0:
+                    self.scheduled.wait(wait)
+                    continue
+                _, _, sock, data, destination = heapq.heappop(self.pending)
+            try:
+                sock.sendto(data, destination())
+            except OSError:
+                # el otro extremo ya cerro, es una perdida mas
+                pass
+
+    def close(self) -> dict:
+        self.running = False
+        with self.scheduled:
+            self.scheduled.notify()
+        for thread in self.threads:
+            thread.join()
+        self.client_side.close()
+        self.server_side.close()
+        return self.stats
+
+
+def run_proxy(server_addr, impairment: dict, connection):
+    """
+    Corre el proxy en su propio proceso, asi su CPU no se mezcla con la de SocketTP:
+    manda por connection la direccion para el cliente, espera cualquier mensaje para
+    terminar y contesta con las estadisticas.
+    """
+    proxy = ImpairmentProxy(server_addr, Impairment(**impairment))
+    connection.send(proxy.addr)
+    connection.recv()
+    connection.send(proxy.close())
@@ -0,0 +1,68 @@
+"""
+Compara paquetes por segundo codificados y decodificados con el codec
+anterior de Packet (int.to_bytes y un byte por flag) y el actual (struct).
+
+Uso (desde src/): python3 -m benchmarks.packet_codec
+"""
+import argparse
+import time
+from lib.utils import Packet
+
+
+class LegacyPacket:
+    # codec anterior, copiado tal cual para poder compararlo
+    HEADER_SIZE = 11
+
+    def __init__(self, data: bytes = b'', seq_number: int = 0, ack: bool = False, syn: bool = False, fin: bool = False):
+        self.data = data
+        self.seq_number = seq_number
+        self.ack = ack
+        self.syn = syn
+        self.fin = fin
+
+    def to_bytes(self) -> bytes:
+        return self.seq_number.to_bytes(8, "big") + self.ack.to_bytes(1, "big") + self.syn.to_bytes(1, "big") + self.fin.to_bytes(1, "big") + self.data
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'LegacyPacket':
+        seq_number = int.from_bytes(data[:8], "big")
+        ack = bool(data[8])
+        syn = bool(data[9])
+        fin = bool(data[10])
+        data = data[11:]
+        return LegacyPacket(data=data, seq_number=seq_number, ack=ack, syn=syn, fin=fin)
+
+
+def rate(function, count: int) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        function(i)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Packet encode/decode packets per second, legacy vs current codec.')
+    parser.add_argument('-c', '--count', type=int, default=200000, help='packets per measurement')
+    parser.add_argument('-s', '--size', type=int, default=1400, help='payload size in bytes')
+    args = parser.parse_args()
+
+    payload = bytes(args.size)
+    legacy_frame = LegacyPacket(data=payload, seq_number=1).to_bytes()
+    frame = Packet(data=payload, seq_number=1).to_bytes()
+
+    results = [
+        ("encode data", rate(lambda i: LegacyPacket(data=payload, seq_number=i).to_bytes(), args.count),
+                        rate(lambda i: Packet(data=payload, seq_number=i).to_bytes(), args.count)),
+        ("encode ack", rate(lambda i: LegacyPacket(ack=True, seq_number=i).to_bytes(), args.count),
+                       rate(lambda i: Packet.ack_frame(i), args.count)),
+        ("decode data", rate(lambda i: LegacyPacket.from_bytes(legacy_frame), args.count),
+                        rate(lambda i: Packet.from_bytes(frame), args.count)),
+    ]
+
+    print(f"{'operation':<12} {'legacy pkt/s':>14} {'current pkt/s':>14} {'speedup':>8}")
+    for name, legacy, current in results:
+        print(f"{name:<12} {legacy:14,.0f} {current:14,.0f} {current / legacy:7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
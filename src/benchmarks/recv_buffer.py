@@ -0,0 +1,124 @@
+"""
+Mide el tiempo de CPU por MB del camino de recepcion (entregar cada segmento en
+orden y sacarlo con recv) a medida que crece el tamanio de la transferencia:
+- recv: ahora, el payload se copia al buffer circular de SocketTP y recv_into lo saca
+  de a pedazos grandes,
+- queue: antes, cada segmento iba como Packet a un queue.Queue y recv_into lo sacaba
+  de a uno (un objeto, el lock de la cola y un notify por segmento),
+- queue all y legacy: las medidas originales, con la cola cargada con toda la
+  transferencia antes de medir y un solo recv de todo, con recv_into y concatenando
+  bytes por cada segmento (crece cuadratico con el tamanio). No cuentan la entrega,
+  recv y queue si.
+Los segmentos se entregan directo, asi solo se mide la recepcion y no la red. Para
+recv y queue se entregan de a una ventana de recepcion (lo que entra en el buffer
+circular) y despues se leen.
+
+Uso (desde src/): python3 -m benchmarks.recv_buffer
+"""
+import argparse
+import queue
+import time
+from lib.socket_tp import SocketTP
+from lib.utils import Packet
+
+MB = 1024 * 1024
+
+
+class QueueReceiver:
+    """
+    Camino de recepcion anterior: un Packet por segmento en un queue.Queue.
+    """
+    def __init__(self):
+        self.packet_queue = queue.Queue()
+        self.recv_leftover = memoryview(b'')
+
+    def _deliver(self, packet: Packet):
+        self.packet_queue.put(packet)
+
+    def recv_into(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        size = len(view)
+        filled = min(len(self.recv_leftover), size)
+        view[:filled] = self.recv_leftover[:filled]
+        self.recv_leftover = self.recv_leftover[filled:]
+        while filled < size:
+            data = memoryview(self.packet_queue.get(timeout=SocketTP.CONNECTION_TIMEOUT).data)
+            length = min(len(data), size - filled)
+            view[filled: filled + length] = data[:length]
+            filled += length
+            if length < len(data):
+                self.recv_leftover = data[length:]
+        return filled
+
+
+def legacy_recv(receiver: QueueReceiver, size: int) -> bytes:
+    # implementacion anterior a recv_into: concatena bytes por cada segmento
+    buffer = b''
+    while len(buffer) < size:
+        buffer += receiver.packet_queue.get_nowait().data
+    return buffer
+
+
+def queue_recv(receiver: QueueReceiver, size: int) -> bytes:
+    buffer = bytearray(size)
+    receiver.recv_into(buffer)
+    return buffer
+
+
+def build_packets(size: int) -> list:
+    payload = bytes(SocketTP.PACKET_DATA_SIZE)
+    return [Packet(data=payload[:min(len(payload), size - seq)], seq_number=seq)
+            for seq in range(0, size, SocketTP.PACKET_DATA_SIZE)]
+
+
+def whole_cpu_per_mb(recv, size: int) -> float:
+    # como la medida original: toda la transferencia en la cola y un solo recv
+    receiver = QueueReceiver()
+    for packet in build_packets(size):
+        receiver._deliver(packet)
+    start = time.process_time()
+    recv(receiver, size)
+    return (time.process_time() - start) * 1000 / (size / MB)
+
+
+def cpu_per_mb(receiver, recv_into, size: int) -> float:
+    packets = build_packets(size)
+    # de a una ventana entera de segmentos, como mucho lo que entra en el buffer de recepcion
+    per_window = SocketTP.MAX_WINDOW // SocketTP.PACKET_DATA_SIZE
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    filled = 0
+    start = time.process_time()
+    for first in range(0, len(packets), per_window):
+        window = packets[first: first + per_window]
+        for packet in window:
+            receiver._deliver(packet)
+        length = sum(len(packet.data) for packet in window)
+        recv_into(receiver, view[filled: filled + length])
+        filled += length
+    return (time.process_time() - start) * 1000 / (size / MB)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Receive path CPU time per MB.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[1, 4, 16, 64], help='transfer sizes in MB')
+    parser.add_argument('-l', '--legacy-max', type=int, default=8, help='largest size in MB to run the legacy recv with')
+    args = parser.parse_args()
+
+    socket = SocketTP() # no se conecta, solo usamos su buffer de recepcion
+    try:
+        print(f"{'size MB':>8} {'recv ms/MB':>12} {'queue ms/MB':>13} {'queue all ms/MB':>17} {'legacy ms/MB':>14}")
+        for size_mb in args.sizes:
+            size = size_mb * MB
+            new = cpu_per_mb(socket, lambda s, view: s.recv_into(view), size)
+            before = cpu_per_mb(QueueReceiver(), lambda s, view: s.recv_into(view), size)
+            whole = whole_cpu_per_mb(queue_recv, size)
+            legacy = whole_cpu_per_mb(legacy_recv, size) if size_mb <= args.legacy_max else None
+            legacy_text = f"{legacy:14.2f}" if legacy is not None else f"{'-':>14}"
+            print(f"{size_mb:8d} {new:12.2f} {before:13.2f} {whole:17.2f} {legacy_text}")
+    finally:
+        socket.socket.close()
+
+
+if __name__ == '__main__':
+    main()
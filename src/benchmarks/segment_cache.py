@@ -0,0 +1,68 @@
+"""
+Compara segmentos por segundo que arma y manda el camino de envio de SocketTP:
+- como antes: se corta cada segmento del chunk y se arma un header nuevo por segmento (BatchIO.send),
+- con los segmentos ya cortados de la cache y el header escrito en su lugar (BatchIO.send_segments).
+Cada ronda manda una ventana completa de un archivo en memoria a un socket que solo
+descarta lo que llega; se mide solo el armado y el envio.
+
+Uso (desde src/): python3 -m benchmarks.segment_cache
+"""
+import argparse
+import time
+from lib.batch_io import BatchIO
+from lib.socket_tp import SocketTP
+from lib.utils import Packet
+from benchmarks.batch_io import DATAGRAM_SIZE, make_sockets, drain
+
+
+def send_sliced(batch_io: BatchIO, sender, addr, view: memoryview, start: int, count: int) -> int:
+    batch = []
+    for i in range(count):
+        offset = start + i * SocketTP.PACKET_DATA_SIZE
+        segment = view[offset: offset + SocketTP.PACKET_DATA_SIZE]
+        batch.append((addr, Packet.header(seq_number=offset), segment))
+    return batch_io.send(sender, batch)
+
+
+def send_cached(batch_io: BatchIO, sender, addr, segments: list, start: int, count: int) -> int:
+    first = start // SocketTP.PACKET_DATA_SIZE
+    batch = [((start + i * SocketTP.PACKET_DATA_SIZE,), segments[first + i]) for i in range(count)]
+    return batch_io.send_segments(sender, addr, Packet.DATA_HEADER, batch)
+
+
+def measure(function, sender, receiver, size: int, count: int) -> float:
+    total = 0
+    elapsed = 0
+    window = count * SocketTP.PACKET_DATA_SIZE
+    for start in range(0, size - window + 1, window):
+        begin = time.perf_counter()
+        total += function(start, count)
+        elapsed += time.perf_counter() - begin
+        drain(receiver)
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Segments per second sent slicing each segment vs from pre-segmented cache entries.')
+    parser.add_argument('-s', '--size', type=int, default=64 * 1024 * 1024, help='file size in bytes')
+    parser.add_argument('-w', '--window', type=int, default=SocketTP.MAX_WINDOW // SocketTP.PACKET_DATA_SIZE, help='segments per window')
+    args = parser.parse_args()
+
+    sender, receiver = make_sockets()
+    sender.settimeout(SocketTP.SOCKET_TIMEOUT)
+    addr = receiver.getsockname()
+    view = memoryview(bytes(args.size))
+    segments = [view[i: i + SocketTP.PACKET_DATA_SIZE] for i in range(0, args.size, SocketTP.PACKET_DATA_SIZE)]
+    batch_io = BatchIO(DATAGRAM_SIZE)
+    if not batch_io.native:
+        print("recvmmsg/sendmmsg no disponibles, BatchIO usa el loop de Python")
+
+    sliced = measure(lambda start, count: send_sliced(batch_io, sender, addr, view, start, count), sender, receiver, args.size, args.window)
+    cached = measure(lambda start, count: send_cached(batch_io, sender, addr, segments, start, count), sender, receiver, args.size, args.window)
+
+    print(f"{'sliced seg/s':>14} {'cached seg/s':>14} {'speedup':>8}")
+    print(f"{sliced:14,.0f} {cached:14,.0f} {cached / sliced:7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
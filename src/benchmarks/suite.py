@@ -0,0 +1,188 @@
+"""
+Suite de benchmarks reproducible: sube datos con SocketTP entre un cliente y un
+servidor en localhost a traves de un proxy que emula perdida, demora, jitter,
+reordenamiento y duplicacion (benchmarks.impairment), sin Mininet ni root.
+Recorre tamanios, modos y tasas de perdida y escribe por corrida en JSON:
+- goodput: bytes del archivo por segundo,
+- throughput: bytes que mando el cliente (headers y retransmisiones incluidos) por segundo,
+- retransmission_ratio: segmentos de datos retransmitidos sobre el total mandado,
+- cpu_ms_per_mb: CPU del cliente y el servidor (el proxy corre en otro proceso) por MB.
+Con --baseline compara el goodput con un JSON anterior y sale con error si alguna
+combinacion cayo mas de --tolerance, para usarlo en CI.
+
+Uso (desde src/): python3 -m benchmarks.suite -o results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import multiprocessing
+from threading import Thread
+from lib.constants import ERROR_RECOVERY_PROTOCOL_MAPPING, CONGESTION_CONTROL_MAPPING
+from lib.socket_tp import SocketTP
+from benchmarks.impairment import Impairment, run_proxy
+
+logging.getLogger("socket").setLevel(logging.CRITICAL)
+
+MB = 1024 * 1024
+
+
+def transfer(data: bytes, mode, congestion, impairment: Impairment) -> dict:
+    server = SocketTP()
+    server.bind("127.0.0.1", 0)
+    server.listen()
+    # spawn: el proceso del proxy no hereda los threads de SocketTP que ya estan corriendo
+    context = multiprocessing.get_context("spawn")
+    proxy_connection, child_connection = context.Pipe()
+    proxy = context.Process(target=run_proxy, args=(server.socket.getsockname(), impairment.to_dict(), child_connection))
+    proxy.start()
+    host, port = proxy_connection.recv()
+
+    received = {}
+
+    def serve():
+        try:
+            connection = server.accept()
+            received["connection"] = connection
+            buffer = bytearray(len(data))
+            connection.recv_into(buffer)
+            received["data"] = buffer
+        except Exception as e:
+            received["error"] = str(e)
+    server_thread = Thread(target=serve)
+    server_thread.start()
+
+    client = SocketTP()
+    result = {"ok": False}
+    try:
+        client.connect(host, port, mode, congestion)
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        client.sendall(data)
+        server_thread.join()
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        result.update(ok=received.get("data") == data, elapsed_s=elapsed, cpu_s=cpu, **{
+            key: value for key, value in client.stats().items() if key in ("timeouts", "fast_retransmits", "rtt", "rto")})
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        closers = [Thread(target=client.close)]
+        if "connection" in received:
+            closers.append(Thread(target=received["connection"].close))
+        for closer in closers:
+            closer.start()
+        for closer in closers:
+            closer.join()
+        server.end_connection = True
+        server.close()
+        server_thread.join()
+        proxy_connection.send("stop")
+        proxy_stats = proxy_connection.recv()
+        proxy.join()
+
+    if "error" in received:
+        result["error"] = received["error"]
+    result["proxy"] = proxy_stats
+    if "elapsed_s" in result:
+        segments = proxy_stats["data_segments"]
+        result["goodput_mbps"] = len(data) * 8 / result["elapsed_s"] / 1e6
+        result["throughput_mbps"] = proxy_stats["to_server"]["bytes"] * 8 / result["elapsed_s"] / 1e6
+        result["retransmission_ratio"] = (segments - proxy_stats["unique_data_segments"]) / segments if segments else 0
+        result["cpu_ms_per_mb"] = result["cpu_s"] * 1000 / (len(data) / MB)
+    return result
+
+
+def run_suite(args) -> list:
+    results = []
+    for size in args.sizes:
+        data = os.urandom(int(size * MB))
+        for mode_name in args.modes:
+            for loss in args.loss:
+                for repeat in range(args.repeat):
+                    impairment = Impairment(loss, args.delay, args.jitter, args.reorder, args.reorder_delay, args.duplicate, args.seed + repeat)
+                    result = transfer(data, ERROR_RECOVERY_PROTOCOL_MAPPING[mode_name], CONGESTION_CONTROL_MAPPING[args.congestion], impairment)
+                    result.update(size_mb=size, mode=mode_name, loss=loss, repeat=repeat)
+                    results.append(result)
+                    print(summary(result), file=sys.stderr)
+    return results
+
+
+def summary(result: dict) -> str:
+    name = f"{result['mode']:<17} {result['size_mb']:>6g} MB loss {result['loss']:<5g}"
+    if not result["ok"]:
+        return f"{name} FAILED {result.get('error', 'datos distintos')}"
+    return (f"{name} goodput {result['goodput_mbps']:7.2f} Mbps  retx {result['retransmission_ratio']:6.2%}  "
+            f"cpu {result['cpu_ms_per_mb']:7.1f} ms/MB  {result['elapsed_s']:6.2f}s")
+
+
+def goodputs(results: list) -> dict:
+    # goodput medio de cada combinacion, una corrida fallida cuenta como 0
+    totals = {}
+    for result in results:
+        key = f"{result['mode']} {result['size_mb']:g}MB loss={result['loss']:g}"
+        totals.setdefault(key, []).append(result.get("goodput_mbps", 0) if result["ok"] else 0)
+    return {key: sum(values) / len(values) for key, values in totals.items()}
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    with open(baseline_path) as file:
+        baseline = goodputs(json.load(file)["results"])
+    regressions = []
+    for key, goodput in goodputs(results).items():
+        if key in baseline and goodput < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {goodput:.2f} Mbps, antes {baseline[key]:.2f} Mbps")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SocketTP throughput/latency sweep through a loopback impairment proxy, JSON output.')
+    parser.add_argument('-s', '--sizes', type=float, nargs='+', default=[1.0, 8.0], help='transfer sizes in MB')
+    parser.add_argument('-m', '--modes', nargs='+', default=list(ERROR_RECOVERY_PROTOCOL_MAPPING.keys()), choices=ERROR_RECOVERY_PROTOCOL_MAPPING.keys(), help='error recovery modes')
+    parser.add_argument('-l', '--loss', type=float, nargs='+', default=[0, 0.01, 0.05], help='loss probabilities, in each direction')
+    parser.add_argument('-c', '--congestion', default="AIMD", choices=CONGESTION_CONTROL_MAPPING.keys(), help='congestion control algorithm')
+    parser.add_argument('--delay', type=float, default=0.001, help='one way delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0, help='uniform jitter in seconds added to the delay')
+    parser.add_argument('--reorder', type=float, default=0, help='probability of holding a datagram back so the next ones overtake it')
+    parser.add_argument('--reorder-delay', type=float, default=0.005, help='extra delay in seconds of reordered datagrams')
+    parser.add_argument('--duplicate', type=float, default=0, help='probability of duplicating a datagram')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='runs per combination, each one with the next seed')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the impairment proxy')
+    parser.add_argument('-o', '--output', help='JSON file for the results, stdout if missing')
+    parser.add_argument('--baseline', help='previous JSON results to compare the goodput with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='goodput drop vs the baseline reported as a regression')
+    args = parser.parse_args()
+
+    results = run_suite(args)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,49 @@
 import argparse
+import sys
 from datetime import datetime
 import logging
 import logging.config
 import time
-from lib.socket_tp import SocketTP
-from lib.constants import ERROR_RECOVERY_PROTOCOL_MAPPING, DEFAULT_HOST, DEFAULT_PORT, ClientMode
+from lib.constants import ERROR_RECOVERY_PROTOCOL_MAPPING, CONGESTION_CONTROL_MAPPING, ACK_MODE_MAPPING, COMPRESSION_MAPPING, DEFAULT_HOST, DEFAULT_PORT
+from lib.ack_policy import AckPolicy
 from lib.validations import download_validations
-from lib.file_transfer import recv_file
+from lib.parallel_transfer import parallel_download
 
 logging.config.fileConfig("./lib/logging.conf")
 
 logger = logging.getLogger(__name__)
 
 
+def download_file(args) -> bool:
+    start_time = time.time()
+    start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    logger.info(f"=== INICIO DE DESCARGA === [{start_datetime}]")
+
+    downloaded, stats = parallel_download(
+        args.host,
+        args.port,
+        args.dst,
+        args.name,
+        args.streams,
+        ERROR_RECOVERY_PROTOCOL_MAPPING[args.protocol],
+        CONGESTION_CONTROL_MAPPING[args.congestion],
+        AckPolicy(ACK_MODE_MAPPING[args.ack]),
+        COMPRESSION_MAPPING[args.compression],
+        args.checksum,
+        args.trace,
+        args.resume,
+    )
+
+    elapsed_time = time.time() - start_time
+    end_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    logger.info(f"=== FIN DE DESCARGA === [{end_datetime}]")
+    logger.info(f"Tiempo transcurrido: {elapsed_time:.2f} segundos.")
+    for stream, stream_stats in enumerate(stats):
+        logger.info(f"Estadísticas conexión {stream}: {stream_stats}")
+    return downloaded
+
+
 def main():
     parser = argparse.ArgumentParser(description='Downloads a file from the server to the client.')
     parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity')
@@ -22,6 +53,13 @@ def main():
     parser.add_argument('-d', '--dst', type=str, required=True, help='destination file path')
     parser.add_argument('-n', '--name', type=str, required=True, help='file name')
     parser.add_argument('-r', '--protocol', type=str, help='error recovery protocol', choices=ERROR_RECOVERY_PROTOCOL_MAPPING.keys(), default="GO_BACK_N")
+    parser.add_argument('-c', '--congestion', type=str, help='congestion control algorithm', choices=CONGESTION_CONTROL_MAPPING.keys(), default="AIMD")
+    parser.add_argument('-a', '--ack', type=str, help='ack policy proposed to the server', choices=ACK_MODE_MAPPING.keys(), default="IMMEDIATE")
+    parser.add_argument('-z', '--compression', type=str, help='compression proposed to the server, files that are already compressed are sent as is', choices=COMPRESSION_MAPPING.keys(), default="NONE")
+    parser.add_argument('-k', '--checksum', action='store_true', help='CRC32 on every data segment and on the whole file, corrupted transfers are not saved')
+    parser.add_argument('--trace', type=str, help='write a binary trace of every packet event to this file (see show-trace.py), with -j one file per connection: TRACE.0, TRACE.1, ...')
+    parser.add_argument('-j', '--streams', type=int, default=1, help='parallel connections, each one carries a byte range of the file')
+    parser.add_argument('-R', '--resume', action='store_true', help='resumable transfer: an interrupted one keeps the partial file and the next run sends only what is missing (always on with -j > 1)')
     
     args = parser.parse_args()
     download_validations(args)
@@ -33,31 +71,9 @@ def main():
         logger.setLevel(logging.ERROR)
     
     logger.info(f"Descargando el archivo '{args.name}' de {args.host}:{args.port} a '{args.dst}'")
-    
-    with SocketTP() as s:
-        s.connect(
-            args.host,
-            args.port,
-            ERROR_RECOVERY_PROTOCOL_MAPPING[args.protocol],
-        )
-
-        s.sendall(ClientMode.DOWNLOAD.value.to_bytes(4, "big"))
-
-        name_b = args.name.encode("utf-8")
-        s.sendall(len(name_b).to_bytes(4, "big"))
-        s.sendall(name_b)
-
-        start_time = time.time()
-        start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        logger.info(f"=== INICIO DE DESCARGA === [{start_datetime}]")
-        
-        recv_file(s, args.dst, args.name)
-        
-        elapsed_time = time.time() - start_time
-        end_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        logger.info(f"=== FIN DE DESCARGA === [{end_datetime}]")
-        logger.info(f"Tiempo transcurrido: {elapsed_time:.2f} segundos. Cerrando socket.")
+    if not download_file(args):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
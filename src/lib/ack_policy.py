@@ -0,0 +1,49 @@
+import struct
+from .constants import AckMode, ErrorRecoveryMode, DELAYED_ACK_SEGMENTS, DELAYED_ACK_TIMEOUT
+
+
+class AckPolicy:
+    """
+    Cuando confirma el receptor los segmentos que le llegan en orden. Los que llegan
+    fuera de orden, repetidos o que completan un hueco se confirman siempre en el
+    momento, el emisor necesita esos ACK para recuperarse rapido.
+
+    Se negocia en el handshake: el cliente la propone en el SYN y el servidor contesta
+    en el SYN-ACK la que usan los dos extremos.
+    """
+    FORMAT = struct.Struct("!BBH") # modo, segmentos por ACK, timeout en ms
+    MAX_SEGMENTS = 16
+    MAX_TIMEOUT = 0.01 # mas que esto y el emisor empieza a tener timeouts falsos
+
+    def __init__(self, mode: AckMode = AckMode.IMMEDIATE, segments: int = DELAYED_ACK_SEGMENTS, timeout: float = DELAYED_ACK_TIMEOUT):
+        self.mode = mode
+        self.segments = segments if mode == AckMode.DELAYED else 1
+        self.timeout = timeout if mode == AckMode.DELAYED else 0
+
+    @property
+    def delayed(self) -> bool:
+        return self.mode == AckMode.DELAYED
+
+    def negotiate(self, error_recovery_mode: ErrorRecoveryMode) -> 'AckPolicy':
+        """
+        Politica que acepta el servidor para lo que propuso el cliente.
+        """
+        if not self.delayed or error_recovery_mode == ErrorRecoveryMode.STOP_AND_WAIT:
+            # con un solo segmento en vuelo demorar el ACK solo agrega espera
+            return AckPolicy()
+        return AckPolicy(AckMode.DELAYED,
+                         max(1, min(self.segments, self.MAX_SEGMENTS)),
+                         max(0.001, min(self.timeout, self.MAX_TIMEOUT)))
+
+    def to_bytes(self) -> bytes:
+        return self.FORMAT.pack(self.mode.value, self.segments, round(self.timeout * 1000))
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'AckPolicy':
+        mode, segments, timeout_ms = AckPolicy.FORMAT.unpack_from(data)
+        return AckPolicy(AckMode(mode), segments, timeout_ms / 1000)
+
+    def __str__(self) -> str:
+        if not self.delayed:
+            return self.mode.name
+        return f"{self.mode.name}(segments={self.segments}, timeout={self.timeout * 1000:.0f}ms)"
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+from time import monotonic
+from .constants import ErrorRecoveryMode, CongestionControl
+from .ack_policy import AckPolicy
+from .socket_tp import SocketTP
+from .utils import Packet, FIN_FRAME, validate_type, build_syn_payload
+
+logger = logging.getLogger("socket")
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, owner: 'AsyncSocketTP'):
+        self.owner = owner
+
+    def datagram_received(self, data: bytes, addr):
+        self.owner._datagram_received(data, addr)
+
+    def error_received(self, exc: Exception):
+        # ICMP de un destino que no esta escuchando, igual que en _process_incoming lo ignoramos
+        pass
+
+
+class AsyncSocketTP:
+    """
+    SocketTP para asyncio (lado cliente). Usa el mismo motor que SocketTP (ventana,
+    timers y retransmisiones) pero los paquetes llegan por un datagram transport del
+    event loop: no hay thread de recepcion ni llamadas bloqueantes, asi que un mismo
+    loop puede llevar muchas transferencias a la vez.
+
+        async with AsyncSocketTP() as socket:
+            await socket.connect(host, port)
+            await socket.send(data)
+            async for chunk in socket:
+                ...
+    """
+    CONNECTION_TIMEOUT = SocketTP.CONNECTION_TIMEOUT
+    SOCKET_TIMEOUT = SocketTP.SOCKET_TIMEOUT
+    MAX_WINDOW = SocketTP.MAX_WINDOW
+
+    def __init__(self):
+        self.socket_tp = SocketTP()
+        self.socket_tp.on_acked = self._on_acked
+        self.socket_tp.on_fin = self._on_fin
+        self.transport = None
+        self.connected = None # future que se resuelve con el SYN-ACK
+        self.ack_advanced = asyncio.Event()
+        self.readable = asyncio.Event()
+        self.recv_leftover = memoryview(b'')
+        self.fin_acked = False
+        self.closed = False
+
+    async def __aenter__(self) -> 'AsyncSocketTP':
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def __aiter__(self) -> 'AsyncSocketTP':
+        return self
+
+    async def __anext__(self) -> memoryview:
+        chunk = await self.recv_chunk()
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+    @property
+    def mode(self) -> ErrorRecoveryMode:
+        return self.socket_tp.mode
+
+    def stats(self) -> dict:
+        return self.socket_tp.stats()
+
+    async def connect(self, host: str, port: int, mode: ErrorRecoveryMode = ErrorRecoveryMode.GO_BACK_N, congestion: CongestionControl = CongestionControl.AIMD, ack_policy: AckPolicy = None):
+        validate_type("host", host, str)
+        validate_type("port", port, int)
+        validate_type("mode", mode, ErrorRecoveryMode)
+        validate_type("congestion", congestion, CongestionControl)
+        ack_policy = ack_policy or AckPolicy()
+        validate_type("ack_policy", ack_policy, AckPolicy)
+
+        logger.debug(f"Attempting to establish a connection with {host}:{port}")
+
+        loop = asyncio.get_running_loop()
+        self.socket_tp._set_error_recovery_mode(mode, congestion)
+        # el transport lee del socket, el motor de SocketTP sigue mandando directo (sendmsg sin copias)
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: _DatagramProtocol(self), sock=self.socket_tp.socket)
+        self.connected = loop.create_future()
+
+        syn = Packet(syn=True, data=build_syn_payload(mode, congestion, ack_policy)).to_bytes()
+        time_limit = loop.time() + self.CONNECTION_TIMEOUT
+        while not self.connected.done():
+            if loop.time() > time_limit:
+                raise Exception("TIME OUT")
+            self.socket_tp.socket.sendto(syn, (host, port))
+            await asyncio.wait([self.connected], timeout=self.SOCKET_TIMEOUT)
+        self.socket_tp.established = monotonic()
+
+        logger.debug(f"Connection established successfully with {host}:{port}")
+
+    def _datagram_received(self, data: bytes, addr):
+        try:
+            packet = Packet.from_bytes(data)
+        except Exception:
+            return
+
+        socket_tp = self.socket_tp
+        if socket_tp.end_connection:
+            self._process_closing(addr, packet)
+            return
+
+        socket_tp._process_packet(addr, packet)
+        if socket_tp.dest_addr and not self.connected.done():
+            self.connected.set_result(None)
+        if socket_tp.receive_buffer.size:
+            self.readable.set()
+
+    def _process_closing(self, addr, packet: Packet):
+        socket_tp = self.socket_tp
+        if addr != socket_tp.dest_addr:
+            return
+        if packet.fin:
+            socket_tp._process_fin()
+        elif packet.ack:
+            self.fin_acked = True
+            logger.debug(f"{addr} - ACK - RECEIVED")
+        elif not packet.syn:
+            # datos que se retransmitieron porque se perdio nuestro ACK, los volvemos a confirmar
+            socket_tp._process_data(addr, packet)
+
+    def _on_acked(self):
+        self.ack_advanced.set()
+
+    def _on_fin(self):
+        # despierta a quien este esperando datos, ya no van a llegar mas
+        self.readable.set()
+
+    async def send(self, data: bytes):
+        """
+        Manda data y vuelve cuando el otro extremo confirmo todo, como SocketTP.sendall.
+        Conviene pasar pedazos de varias ventanas: la ventana se vacia entre llamadas.
+        """
+        socket_tp = self.socket_tp
+        end = socket_tp.send(data)
+        while socket_tp.state.ack < end:
+            if socket_tp.end_connection:
+                raise Exception("CONNECTION CLOSED")
+            self.ack_advanced.clear()
+            try:
+                await asyncio.wait_for(self.ack_advanced.wait(), self.CONNECTION_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Si no cambio el ack por CONNECTION_TIMEOUT segundos asumimos q murio el receiver
+                raise Exception("TIME OUT")
+
+    async def recv_chunk(self) -> memoryview:
+        """
+        Devuelve todos los datos recibidos en orden que todavia no se leyeron. Devuelve
+        un memoryview vacio cuando el otro extremo cerro la conexion y no queda nada por leer.
+        """
+        if self.recv_leftover:
+            chunk, self.recv_leftover = self.recv_leftover, memoryview(b'')
+            return chunk
+
+        socket_tp = self.socket_tp
+        while not socket_tp.receive_buffer.size:
+            if socket_tp.fin_received or self.closed:
+                return memoryview(b'')
+            self.readable.clear()
+            try:
+                await asyncio.wait_for(self.readable.wait(), self.CONNECTION_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise Exception("TIME OUT")
+        # al sacarlos del buffer se libera su lugar en la ventana que anunciamos
+        chunk = socket_tp.receive_buffer.read()
+        socket_tp._window_update()
+        return memoryview(chunk)
+
+    async def recv(self, size: int) -> bytes:
+        """
+        Igual que SocketTP.recv: espera a tener exactamente size bytes.
+        """
+        validate_type("size", size, int)
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        filled = 0
+        while filled < size:
+            chunk = await self.recv_chunk()
+            if not chunk:
+                raise Exception("CONNECTION CLOSED")
+            length = min(len(chunk), size - filled)
+            view[filled: filled + length] = chunk[:length]
+            filled += length
+            if length < len(chunk):
+                self.recv_leftover = chunk[length:]
+        return bytes(buffer)
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        socket_tp = self.socket_tp
+        socket_tp.end_connection = True
+        socket_tp.ended = monotonic()
+        socket_tp.state.close()
+        socket_tp.retransmission_queue.clear()
+        self.readable.set()
+
+        if socket_tp.dest_addr:
+            interval = max(socket_tp.state.estimated_round_trip_time * 2, 0.2)
+            for _ in range(socket_tp.CLOSING_LOOP_LIMIT):
+                if self.fin_acked and socket_tp.fin_received:
+                    break
+                if not self.fin_acked:
+                    socket_tp.socket.sendto(FIN_FRAME, socket_tp.dest_addr)
+                    logger.debug(f"{socket_tp.dest_addr} - FIN - SENT")
+                await asyncio.sleep(interval)
+            # TIME WAIT: seguimos confirmando FINs tardios
+            await asyncio.sleep(interval * socket_tp.TIME_WAIT_FACTOR)
+
+        socket_tp.closed = True
+        if self.transport:
+            self.transport.close()
+        else:
+            socket_tp.socket.close()
@@ -0,0 +1,317 @@
+import ctypes
+import ctypes.util
+import errno
+import logging
+import select
+import selectors
+import struct
+from socket import socket, inet_aton, inet_ntoa, htons, AF_INET
+from threading import Lock
+
+logger = logging.getLogger("socket")
+
+try:
+    # el valor cambia entre sistemas (en BSD y macOS 0x40 es MSG_WAITALL), solo lo usa recvmmsg
+    from socket import MSG_DONTWAIT
+except ImportError:
+    MSG_DONTWAIT = 0
+_POINTER = struct.Struct("P")
+_SIZE = struct.Struct("N")
+
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort), ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_ubyte * 4), ("sin_zero", ctypes.c_ubyte * 8)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IoVec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError, TypeError):
+        # no es Linux (o libc no tiene recvmmsg/sendmmsg), usamos los loops de Python
+        return None
+
+
+_libc = _load_libc()
+
+
+def _raw(array) -> memoryview:
+    # vista de bytes sobre un array de ctypes, para leer y escribir campos sin pasar por ctypes
+    return memoryview((ctypes.c_char * ctypes.sizeof(array)).from_address(ctypes.addressof(array))).cast("B")
+
+
+class _Slots:
+    """
+    Buffers y headers de ctypes para batch_size datagramas, se reusan entre llamadas.
+    Los campos que cambian en cada llamada se leen y escriben con struct sobre la
+    memoria cruda, acceder por ctypes campo a campo cuesta mas que la syscall que ahorramos.
+    """
+    NAME_SIZE = ctypes.sizeof(_SockAddrIn)
+    IOVEC_SIZE = ctypes.sizeof(_IoVec)
+    MESSAGE_SIZE = ctypes.sizeof(_MMsgHdr)
+    IOV_LEN_OFFSET = _IoVec.iov_len.offset
+    MSG_NAME_OFFSET = _MsgHdr.msg_name.offset
+    MSG_LEN_OFFSET = _MMsgHdr.msg_len.offset
+
+    def __init__(self, batch_size: int, datagram_size: int):
+        self.buffers = [bytearray(datagram_size) for _ in range(batch_size)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.names = (_SockAddrIn * batch_size)()
+        self.iovecs = (_IoVec * batch_size)()
+        self.messages = (_MMsgHdr * batch_size)()
+        for i, buffer in enumerate(self.buffers):
+            self.iovecs[i].iov_base = ctypes.addressof((ctypes.c_char * datagram_size).from_buffer(buffer))
+            self.iovecs[i].iov_len = datagram_size
+            header = self.messages[i].msg_hdr
+            header.msg_name = ctypes.addressof(self.names[i])
+            # siempre IPv4, el kernel vuelve a escribir el mismo largo
+            header.msg_namelen = self.NAME_SIZE
+            header.msg_iov = ctypes.pointer(self.iovecs[i])
+            header.msg_iovlen = 1
+        self.raw_names = _raw(self.names)
+        self.raw_iovecs = _raw(self.iovecs)
+        self.raw_messages = _raw(self.messages)
+        # msg_len de cada mensaje, salteando el resto del mmsghdr
+        self.msg_lens = struct.Struct(f"{self.MSG_LEN_OFFSET}xI{self.MESSAGE_SIZE - self.MSG_LEN_OFFSET - 4}x")
+
+
+class BatchIO:
+    """
+    Lee y manda varios datagramas por syscall con recvmmsg/sendmmsg (Linux, via ctypes).
+    Donde no estan disponibles hace lo mismo con un loop de recvfrom/sendmsg, con la
+    misma interfaz. Solo IPv4, como el resto del protocolo.
+
+    recv() se usa desde un solo thread (el que recibe). send() se puede llamar desde
+    varios (timer_service, recepcion), los buffers de envio estan protegidos por un lock.
+    """
+    BATCH_SIZE = 64 # datagramas por recvmmsg
+    SEND_BATCH_SIZE = 256 # una ventana completa (MAX_WINDOW / PACKET_DATA_SIZE) en un solo sendmmsg
+
+    def __init__(self, datagram_size: int, batch_size: int = BATCH_SIZE, send_batch_size: int = SEND_BATCH_SIZE):
+        self.datagram_size = datagram_size
+        self.batch_size = batch_size
+        self.send_batch_size = send_batch_size
+        self.native = _libc is not None
+        self.recv_slots = None # se crean al primer uso, no todos los sockets reciben o mandan en batch
+        self.send_slots = None
+        self.send_lock = Lock()
+        self.addresses = {} # (host, port) -> (_SockAddrIn ya armado, su direccion de memoria)
+        self.senders = {} # puerto y direccion crudos -> (host, port)
+
+    def recv(self, sock: socket) -> list:
+        """
+        Devuelve los datagramas que ya estan en el socket como [(data, addr)], sin
+        bloquear: [] si no hay ninguno. Hay que esperar antes con wait_readable.
+        """
+        if not self.native:
+            return self._recv_loop(sock)
+
+        if not self.recv_slots:
+            self.recv_slots = _Slots(self.batch_size, self.datagram_size)
+        slots = self.recv_slots
+
+        received = _libc.recvmmsg(sock.fileno(), slots.messages, self.batch_size, MSG_DONTWAIT, None)
+        if received < 0:
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNREFUSED):
+                return []
+            raise OSError(error, f"recvmmsg: {errno.errorcode.get(error, error)}")
+
+        # largos y direcciones de todo el batch de una vez, campo a campo es mas lento que la syscall
+        lengths = slots.msg_lens.iter_unpack(slots.raw_messages[:received * _Slots.MESSAGE_SIZE])
+        names = slots.raw_names[:received * _Slots.NAME_SIZE].tobytes()
+        senders = self.senders
+        datagrams = []
+        for offset, view, (length,) in zip(range(0, len(names), _Slots.NAME_SIZE), slots.views, lengths):
+            # puerto y direccion, tal cual vienen en el sockaddr_in
+            name = names[offset + 2: offset + 8]
+            addr = senders.get(name)
+            if addr is None:
+                addr = senders[name] = (inet_ntoa(name[2:]), int.from_bytes(name[:2], "big"))
+            # copiamos los datos fuera del buffer, se reusa en la proxima llamada
+            datagrams.append((view[:length].tobytes(), addr))
+        return datagrams
+
+    def _recv_loop(self, sock: socket) -> list:
+        datagrams = []
+        while len(datagrams) < self.batch_size:
+            # con timeout, recvfrom espera a que haya algo antes de mirar los flags: sin MSG_DONTWAIT
+            # (que no existe en todos lados) solo leemos si ya hay un datagrama esperando
+            if not self.wait_readable(sock, 0):
+                break
+            try:
+                datagrams.append(sock.recvfrom(self.datagram_size))
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+        return datagrams
+
+    def send(self, sock: socket, messages: list) -> int:
+        """
+        Manda messages, una lista de (addr, header, payload), con la menor cantidad
+        de syscalls posible. Devuelve cuantos se mandaron: en un socket no bloqueante
+        con el buffer lleno el resto se descarta, como una perdida.
+        """
+        if not messages:
+            return 0
+        if not self.native:
+            return self._send_loop(sock, messages)
+
+        with self.send_lock:
+            if not self.send_slots:
+                self.send_slots = _Slots(self.send_batch_size, self.datagram_size)
+            sent = 0
+            for start in range(0, len(messages), self.send_batch_size):
+                batch = messages[start: start + self.send_batch_size]
+                sent += self._send_batch(sock, batch)
+                if sent < start + len(batch):
+                    break
+            return sent
+
+    def send_segments(self, sock: socket, addr, header: struct.Struct, segments: list) -> int:
+        """
+        Como send, para segmentos de datos a un mismo destino: segments es una lista de
+        (campos, payload) y el header de cada uno se escribe con header.pack_into(buffer, 0, *campos)
+        directo en el buffer de envio, sin armar un bytes por segmento.
+        """
+        if not segments:
+            return 0
+        if not self.native:
+            return self._send_loop(sock, [(addr, header.pack(*fields), payload) for fields, payload in segments])
+
+        with self.send_lock:
+            if not self.send_slots:
+                self.send_slots = _Slots(self.send_batch_size, self.datagram_size)
+            slots = self.send_slots
+            address = self._address(addr)
+            header_size = header.size
+            sent = 0
+            for start in range(0, len(segments), self.send_batch_size):
+                batch = segments[start: start + self.send_batch_size]
+                for i, (fields, payload) in enumerate(batch):
+                    length = header_size + len(payload)
+                    view = slots.views[i]
+                    header.pack_into(view, 0, *fields)
+                    view[header_size: length] = payload
+                    _SIZE.pack_into(slots.raw_iovecs, i * _Slots.IOVEC_SIZE + _Slots.IOV_LEN_OFFSET, length)
+                    _POINTER.pack_into(slots.raw_messages, i * _Slots.MESSAGE_SIZE + _Slots.MSG_NAME_OFFSET, address)
+                sent += self._send_slots(sock, len(batch))
+                if sent < start + len(batch):
+                    break
+            return sent
+
+    def _send_batch(self, sock: socket, batch: list) -> int:
+        slots = self.send_slots
+        views = slots.views
+        iovecs = slots.raw_iovecs
+        messages = slots.raw_messages
+        for i, (addr, header, payload) in enumerate(batch):
+            # una sola copia a los buffers de ctypes, sendmmsg no puede apuntar a bytes inmutables
+            header_size = len(header)
+            length = header_size + len(payload)
+            view = views[i]
+            view[:header_size] = header
+            view[header_size: length] = payload
+            _SIZE.pack_into(iovecs, i * _Slots.IOVEC_SIZE + _Slots.IOV_LEN_OFFSET, length)
+            _POINTER.pack_into(messages, i * _Slots.MESSAGE_SIZE + _Slots.MSG_NAME_OFFSET, self._address(addr))
+        return self._send_slots(sock, len(batch))
+
+    def _send_slots(self, sock: socket, count: int) -> int:
+        # manda los primeros count mensajes ya armados en send_slots
+        slots = self.send_slots
+        sent = 0
+        while sent < count:
+            result = _libc.sendmmsg(sock.fileno(), ctypes.byref(slots.messages[sent]), count - sent, 0)
+            if result >= 0:
+                sent += result
+                continue
+            error = ctypes.get_errno()
+            if error in (errno.EINTR, errno.ECONNREFUSED):
+                # ECONNREFUSED es el ICMP de un datagrama anterior (un cliente que ya cerro), este no salio
+                continue
+            if error not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                raise OSError(error, f"sendmmsg: {errno.errorcode.get(error, error)}")
+            # buffer lleno: con timeout esperamos como lo haria sendmsg, si es no bloqueante se pierden
+            if sock.gettimeout() == 0 or not self.wait_writable(sock, sock.gettimeout()):
+                logger.debug(f"{count - sent} datagrams DROPPED, socket buffer full")
+                break
+        return sent
+
+    def _send_loop(self, sock: socket, messages: list) -> int:
+        for sent, (addr, header, payload) in enumerate(messages):
+            try:
+                try:
+                    sock.sendmsg([header, payload], [], 0, addr)
+                except ConnectionRefusedError:
+                    # ICMP de un datagrama anterior, este no salio
+                    sock.sendmsg([header, payload], [], 0, addr)
+            except BlockingIOError:
+                logger.debug(f"{len(messages) - sent} datagrams DROPPED, socket buffer full")
+                return sent
+        return len(messages)
+
+    def _address(self, addr) -> int:
+        # direccion de memoria de un sockaddr_in armado una sola vez por destino,
+        # el sockaddr queda en addresses para que no lo libere el GC
+        entry = self.addresses.get(addr)
+        if entry is None:
+            sockaddr = _SockAddrIn()
+            sockaddr.sin_family = AF_INET
+            sockaddr.sin_port = htons(addr[1])
+            sockaddr.sin_addr[:] = inet_aton(addr[0])
+            entry = self.addresses[addr] = (sockaddr, ctypes.addressof(sockaddr))
+        return entry[1]
+
+    def forget(self, addr):
+        """
+        Olvida lo cacheado para addr, cuando se libera su conexion: en un socket
+        compartido (reactor, listener) si no, crece con cada cliente que paso.
+        """
+        try:
+            name = addr[1].to_bytes(2, "big") + inet_aton(addr[0])
+        except (OSError, OverflowError):
+            return
+        self.senders.pop(name, None)
+        # con el lock: ningun sendmmsg en curso apunta al sockaddr que liberamos
+        with self.send_lock:
+            self.addresses.pop(addr, None)
+
+    @staticmethod
+    def wait_readable(sock: socket, timeout: float) -> bool:
+        return _wait(sock, select.POLLIN if _poll else selectors.EVENT_READ, timeout)
+
+    @staticmethod
+    def wait_writable(sock: socket, timeout: float) -> bool:
+        return _wait(sock, select.POLLOUT if _poll else selectors.EVENT_WRITE, timeout)
+
+
+# select.select no acepta fds de 1024 en adelante (un servidor con muchas conexiones los
+# pasa enseguida): usamos poll, que no tiene limite y no abre un fd por llamada como epoll
+_poll = hasattr(select, "poll")
+
+
+def _wait(sock: socket, event: int, timeout: float) -> bool:
+    if _poll:
+        poller = select.poll()
+        poller.register(sock, event)
+        return bool(poller.poll(None if timeout is None else timeout * 1000))
+    with selectors.DefaultSelector() as selector:
+        selector.register(sock, event)
+        return bool(selector.select(timeout))
@@ -0,0 +1,73 @@
+import zlib
+from .constants import Compression
+
+try:
+    import lzma
+except ImportError:
+    # Python compilado sin liblzma: el servidor contesta sin compresion si se la piden
+    lzma = None
+
+ZLIB_LEVEL = 6
+LZMA_PRESET = 1 # con el preset por defecto (6) comprime mas lento de lo que transmitimos
+SAMPLE_SIZE = 64 * 1024
+MIN_RATIO = 0.9 # si la muestra no baja de esto el archivo ya viene comprimido (o cifrado)
+
+# primeros bytes de formatos que ya vienen comprimidos
+COMPRESSED_MAGIC = (
+    b"\x1f\x8b", # gzip
+    b"PK\x03\x04", # zip, docx, jar, apk...
+    b"\xfd7zXZ\x00", # xz
+    b"BZh", # bzip2
+    b"\x28\xb5\x2f\xfd", # zstd
+    b"7z\xbc\xaf\x27\x1c", # 7z
+    b"\x89PNG", # png
+    b"\xff\xd8\xff", # jpeg
+    b"GIF8", # gif
+    b"%PDF", # pdf
+)
+
+
+def available(compression: Compression) -> bool:
+    return compression != Compression.LZMA or lzma is not None
+
+
+def negotiate_compression(proposed: Compression) -> Compression:
+    """
+    Compresion que acepta el servidor para la que propuso el cliente en el SYN.
+    """
+    return proposed if available(proposed) else Compression.NONE
+
+
+def worth_compressing(view: memoryview, position: int = 0) -> bool:
+    """
+    Decide si vale la pena comprimir el archivo: no si por los primeros bytes es de
+    un formato comprimido o si una muestra desde position casi no se achica.
+    """
+    if bytes(view[:8]).startswith(COMPRESSED_MAGIC):
+        return False
+    sample = view[position: position + SAMPLE_SIZE]
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * MIN_RATIO
+
+
+def compressor(compression: Compression):
+    """
+    Compresor de streaming (compress/flush) para compression, None si es NONE.
+    """
+    if compression == Compression.ZLIB:
+        return zlib.compressobj(ZLIB_LEVEL)
+    if compression == Compression.LZMA:
+        return lzma.LZMACompressor(preset=LZMA_PRESET)
+    return None
+
+
+def decompressor(compression: Compression):
+    """
+    Descompresor de streaming (decompress/eof/unused_data) para compression, None si es NONE.
+    """
+    if compression == Compression.ZLIB:
+        return zlib.decompressobj()
+    if compression == Compression.LZMA:
+        return lzma.LZMADecompressor()
+    return None
@@ -0,0 +1,106 @@
+import logging
+from .constants import CongestionControl, ErrorRecoveryMode
+
+logger = logging.getLogger("socket")
+
+
+class WindowController:
+    """
+    Decide el tamanio de la ventana de congestion (cwnd) en bytes.
+    SenderState le avisa de cada ACK y de cada perdida.
+    """
+    def __init__(self, segment_size: int, max_size: int, initial_size: int):
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.cwnd = min(initial_size, max_size)
+
+    def on_ack(self, acked: int, rtt: float = None):
+        pass
+
+    def on_timeout(self):
+        pass
+
+    def on_loss(self):
+        # perdida detectada sin timeout (ACKs duplicados), por defecto igual que un timeout
+        self.on_timeout()
+
+    def _clamp(self):
+        self.cwnd = int(max(self.segment_size, min(self.cwnd, self.max_size)))
+
+
+class FixedWindow(WindowController):
+    """Ventana de tamanio fijo, el comportamiento original de Go-Back-N y Stop-and-Wait."""
+    def __init__(self, size: int):
+        super().__init__(size, size, size)
+
+
+class AIMDController(WindowController):
+    """
+    Slow start hasta ssthresh y despues aumento aditivo (un segmento por RTT),
+    ante una perdida se reduce a la mitad (Reno).
+    """
+    INITIAL_SEGMENTS = 2
+
+    def __init__(self, segment_size: int, max_size: int):
+        super().__init__(segment_size, max_size, self.INITIAL_SEGMENTS * segment_size)
+        self.ssthresh = max_size
+
+    def on_ack(self, acked: int, rtt: float = None):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+        else:
+            self.cwnd += self.segment_size * acked / self.cwnd
+        self._clamp()
+
+    def on_timeout(self):
+        self.ssthresh = max(self.cwnd / 2, self.INITIAL_SEGMENTS * self.segment_size)
+        self.cwnd = self.segment_size
+        logger.debug(f'Congestion window timeout, ssthresh: {self.ssthresh}')
+
+    def on_loss(self):
+        self.ssthresh = max(self.cwnd / 2, self.INITIAL_SEGMENTS * self.segment_size)
+        self.cwnd = self.ssthresh
+        self._clamp()
+
+
+class DelayBasedController(AIMDController):
+    """
+    Variante de Vegas: compara el throughput esperado (cwnd / RTT minimo) con el
+    real (cwnd / RTT actual) y ajusta la ventana antes de que haya perdidas.
+    alpha y beta son la cantidad de segmentos encolados en la red que se toleran.
+    """
+    ALPHA = 2
+    BETA = 4
+
+    def __init__(self, segment_size: int, max_size: int):
+        super().__init__(segment_size, max_size)
+        self.base_rtt = None
+
+    def on_ack(self, acked: int, rtt: float = None):
+        if not rtt:
+            return super().on_ack(acked, rtt)
+
+        self.base_rtt = rtt if self.base_rtt is None else min(self.base_rtt, rtt)
+        # segmentos que estan esperando en colas de la red
+        queued = (self.cwnd / self.segment_size) * (1 - self.base_rtt / rtt)
+        if self.cwnd < self.ssthresh:
+            if queued > self.BETA:
+                self.ssthresh = self.cwnd
+            else:
+                self.cwnd += acked
+        elif queued < self.ALPHA:
+            self.cwnd += self.segment_size * acked / self.cwnd
+        elif queued > self.BETA:
+            self.cwnd -= self.segment_size * acked / self.cwnd
+        self._clamp()
+
+
+def build_window_controller(mode: ErrorRecoveryMode, congestion: CongestionControl, segment_size: int, fixed_size: int, max_size: int) -> WindowController:
+    if mode == ErrorRecoveryMode.STOP_AND_WAIT:
+        # mandamos un solo paquete y esperamos ack
+        return FixedWindow(segment_size)
+    if congestion == CongestionControl.FIXED:
+        return FixedWindow(fixed_size)
+    if congestion == CongestionControl.DELAY_BASED:
+        return DelayBasedController(segment_size, max_size)
+    return AIMDController(segment_size, max_size)
@@ -5,19 +5,76 @@ DEFAULT_PORT = 6000
 
 
 FILE_NOT_FOUND_ERROR_CODE = -1
+FILE_SIZE_LENGTH = 8 # bytes del header de tamanio, alcanza para archivos de varios GB
+
+# cantidad de ventanas que se mandan por llamada a sendall (vistas del mapeo del
+# archivo, no ocupan memoria aparte). Al recibir alcanza con una ventana.
+TRANSFER_BUFFER_WINDOWS = 8
 
 
 class ErrorRecoveryMode(Enum):
     GO_BACK_N = 1
     STOP_AND_WAIT = 2
+    SELECTIVE_REPEAT = 3
 
 
 ERROR_RECOVERY_PROTOCOL_MAPPING = {
     "GO_BACK_N": ErrorRecoveryMode.GO_BACK_N,
-    "STOP_AND_WAIT": ErrorRecoveryMode.STOP_AND_WAIT
+    "STOP_AND_WAIT": ErrorRecoveryMode.STOP_AND_WAIT,
+    "SELECTIVE_REPEAT": ErrorRecoveryMode.SELECTIVE_REPEAT
+}
+
+
+class CongestionControl(Enum):
+    FIXED = 1
+    AIMD = 2
+    DELAY_BASED = 3
+
+
+CONGESTION_CONTROL_MAPPING = {
+    "FIXED": CongestionControl.FIXED,
+    "AIMD": CongestionControl.AIMD,
+    "DELAY_BASED": CongestionControl.DELAY_BASED
 }
 
 
+class AckMode(Enum):
+    IMMEDIATE = 1 # un ACK por segmento
+    DELAYED = 2 # un ACK cada DELAYED_ACK_SEGMENTS segmentos o a los DELAYED_ACK_TIMEOUT segundos
+
+
+ACK_MODE_MAPPING = {
+    "IMMEDIATE": AckMode.IMMEDIATE,
+    "DELAYED": AckMode.DELAYED
+}
+
+
+class Compression(Enum):
+    NONE = 1
+    ZLIB = 2
+    LZMA = 3 # comprime mas que ZLIB pero es bastante mas lento, conviene en enlaces lentos
+
+
+COMPRESSION_MAPPING = {
+    "NONE": Compression.NONE,
+    "ZLIB": Compression.ZLIB,
+    "LZMA": Compression.LZMA
+}
+
+DELAYED_ACK_SEGMENTS = 2
+DELAYED_ACK_TIMEOUT = 0.005 # tiene que ser bastante menor que el timeout minimo del emisor (20 ms)
+
+
 class ClientMode(Enum):
     UPLOAD = 1
     DOWNLOAD = 2
+    UPLOAD_RANGE = 3 # una parte del archivo, la transferencia va por varias conexiones en paralelo
+    DOWNLOAD_RANGE = 4
+
+
+RANGE_CLIENT_MODES = (ClientMode.UPLOAD_RANGE, ClientMode.DOWNLOAD_RANGE)
+STREAM_INFO_LENGTH = 8 # despues del nombre: numero de conexion y cantidad de conexiones (4 bytes c/u)
+MAX_STREAMS = 16
+RESUME_OFFSET_LENGTH = 8 # en los modos por rangos el receptor contesta cuantos bytes de la parte ya tiene
+PARTIAL_FILE_SUFFIX = ".part" # archivo a medio recibir, al lado van los checkpoints de cada parte
+DIGEST_LENGTH = 4 # con checksums negociados, despues del contenido va su CRC32
@@ -0,0 +1,117 @@
+import os
+import sys
+import logging
+from collections import OrderedDict
+from threading import Lock, Event
+
+logger = logging.getLogger("root")
+
+
+class FileCache:
+    """
+    Cache LRU del contenido de los archivos que sirve el servidor, con un presupuesto
+    en bytes. Cada entrada se valida con un solo os.stat contra el mtime y el tamanio
+    con que se leyo: si el archivo se reemplazo (una subida) se vuelve a leer.
+    Los archivos de mas de max_file_size no se guardan, se mandan desde un mmap.
+    Con segment_size ademas se guarda cada archivo ya cortado en memoryviews de ese
+    tamanio, que todas las descargas mandan tal cual (cuentan en el presupuesto).
+    Se usa desde los threads de todas las conexiones: si varias piden a la vez un
+    archivo que no esta, lo lee una sola y las demas esperan esa lectura.
+    """
+    SEGMENT_OVERHEAD = sys.getsizeof(memoryview(b''))
+
+    def __init__(self, max_bytes: int, max_file_size: int = None, segment_size: int = None):
+        self.max_bytes = max_bytes
+        # un archivo solo no puede desalojar a todos los demas
+        self.max_file_size = max_file_size if max_file_size is not None else max_bytes // 4
+        self.segment_size = segment_size
+        self.entries = OrderedDict() # path -> ((mtime_ns, size), contenido, segmentos), el primero es el menos usado
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loading = {} # path -> ((mtime_ns, size), Event), lecturas de disco en curso
+        self.lock = Lock()
+
+    def get(self, path: str) -> tuple:
+        """
+        (contenido, segmentos) de path, de la cache o leido de disco; segmentos es None
+        sin segment_size. Devuelve None si es muy grande para guardarlo.
+        Si el archivo no existe levanta FileNotFoundError.
+        """
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if stat.st_size > self.max_file_size:
+            with self.lock:
+                self.misses += 1
+            return None
+
+        while True:
+            with self.lock:
+                entry = self.entries.get(path)
+                if entry and entry[0] == key:
+                    self.entries.move_to_end(path)
+                    self.hits += 1
+                    return entry[1], entry[2]
+                loading = self.loading.get(path)
+                if loading is None:
+                    self.misses += 1
+                    loaded = self.loading[path] = (key, Event())
+                    break
+                if loading[0] != key:
+                    # se esta leyendo otra version del archivo, leemos la nuestra sin guardarla
+                    self.misses += 1
+                    loaded = None
+                    break
+            # otra conexion ya lo esta leyendo: esperamos esa lectura en lugar de repetirla,
+            # si no lo pudo guardar volvemos a probar
+            loading[1].wait()
+
+        try:
+            return self._load(path, key, stat.st_size, loaded is not None)
+        finally:
+            if loaded:
+                with self.lock:
+                    del self.loading[path]
+                loaded[1].set()
+
+    def _load(self, path: str, key: tuple, size: int, store: bool) -> tuple:
+        with open(path, "rb") as file:
+            content = file.read()
+        if len(content) != size or not store:
+            # cambio mientras lo leiamos (o hay otra version en lectura), lo mandamos pero no lo guardamos
+            return content, None
+
+        segments = None
+        if self.segment_size:
+            view = memoryview(content)
+            segments = [view[i: i + self.segment_size] for i in range(0, len(content), self.segment_size)]
+
+        with self.lock:
+            self._remove(path)
+            self.entries[path] = (key, content, segments)
+            self.bytes += self._entry_size(content, segments)
+            while self.bytes > self.max_bytes:
+                evicted, _ = next(iter(self.entries.items()))
+                self._remove(evicted)
+                self.evictions += 1
+                logger.debug(f"Cache: {evicted} desalojado")
+        return content, segments
+
+    def _remove(self, path: str):
+        entry = self.entries.pop(path, None)
+        if entry:
+            self.bytes -= self._entry_size(entry[1], entry[2])
+
+    def _entry_size(self, content: bytes, segments: list) -> int:
+        return len(content) + (len(segments) * self.SEGMENT_OVERHEAD if segments else 0)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
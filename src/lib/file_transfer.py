@@ -1,39 +1,564 @@
 import os
+import mmap
+import zlib
+import struct
 import logging
 from lib.socket_tp import SocketTP
-from lib.constants import FILE_NOT_FOUND_ERROR_CODE
+from lib.async_socket_tp import AsyncSocketTP
+from lib.file_cache import FileCache
+from lib.compression import compressor, decompressor, worth_compressing
+from lib.constants import FILE_NOT_FOUND_ERROR_CODE, FILE_SIZE_LENGTH, TRANSFER_BUFFER_WINDOWS, STREAM_INFO_LENGTH, MAX_STREAMS, RANGE_CLIENT_MODES, RESUME_OFFSET_LENGTH, PARTIAL_FILE_SUFFIX, DIGEST_LENGTH, ClientMode, Compression
 
 logger = logging.getLogger("root")
 
 
-def send_file(socket: SocketTP, src: str):
-    with open(src, "rb") as f:
-        data = f.read()
-    size_bytes = len(data).to_bytes(4, "big")
+def _chunk_size(socket: SocketTP, buffer_windows: int) -> int:
+    return socket.MAX_WINDOW * max(1, buffer_windows)
+
+
+def file_range(size: int, stream: int, streams: int) -> tuple:
+    """
+    (offset, largo) de la parte del archivo que lleva la conexion stream de streams.
+    Las dos puntas la calculan a partir del tamanio, no hace falta mandarla.
+    """
+    part = size // streams
+    offset = stream * part
+    if stream == streams - 1:
+        return offset, size - offset
+    return offset, part
+
+
+def build_request(client_mode: ClientMode, name: str, stream: int = 0, streams: int = 1) -> bytes:
+    """
+    Metadata inicial que manda el cliente: modo (4 bytes), largo del nombre (4 bytes),
+    el nombre y, en los modos por rangos, numero de conexion y cantidad de conexiones.
+    """
+    name_b = name.encode("utf-8")
+    request = client_mode.value.to_bytes(4, "big") + len(name_b).to_bytes(4, "big") + name_b
+    if client_mode in RANGE_CLIENT_MODES:
+        request += stream.to_bytes(4, "big") + streams.to_bytes(4, "big")
+    return request
+
+
+def parse_stream_info(data: bytes) -> tuple:
+    stream = int.from_bytes(data[:4], "big")
+    streams = int.from_bytes(data[4:STREAM_INFO_LENGTH], "big")
+    if not 0 <= stream < streams <= MAX_STREAMS:
+        raise ValueError(f"conexion {stream} de {streams} invalida")
+    return stream, streams
+
+
+class FileSender:
+    """
+    Manda un archivo de a pedazos, precedido por su tamanio (FILE_SIZE_LENGTH bytes).
+    Lo usan send_file y el servidor multiplexado.
+    Con streams > 1 manda solo la parte que le toca a la conexion stream, el header
+    sigue siendo el tamanio total.
+
+    El archivo se mapea en memoria: read() devuelve memoryviews sobre el mapeo, el
+    archivo nunca se lee entero al heap de Python y varias descargas del mismo archivo
+    comparten las paginas del page cache. Queda una copia en user space: al mandar,
+    BatchIO.send_segments copia cada segmento al buffer de sendmmsg (las retransmisiones
+    sueltas salen directo del mapeo). Con una cache, los archivos que entran en ella se
+    mandan desde memoria sin tocar el disco. Si src no existe levanta FileNotFoundError.
+
+    Si la conexion negocio una compresion, el header lleva despues del tamanio un
+    byte con la que se usa para este archivo: NONE si ya viene comprimido, y en ese
+    caso se manda tal cual. Con checksum, despues del contenido va el CRC32 de lo que
+    se mando, calculado a medida que se lee.
+    """
+    def __init__(self, src: str, stream: int = 0, streams: int = 1, cache: FileCache = None, compression: Compression = Compression.NONE,
+                 checksum: bool = False):
+        self.map = None
+        self.segments = None # el archivo ya cortado en segmentos de segment_size, si la cache los tiene
+        self.segment_size = cache.segment_size if cache else None
+        cached = cache.get(src) if cache else None
+        if cached is not None:
+            content, self.segments = cached
+            self.view = memoryview(content)
+        else:
+            self.view = self._map(src)
+        self.size = len(self.view)
+        self.position, self.remaining = file_range(self.size, stream, streams)
+        self.negotiated = compression
+        if compression != Compression.NONE and not worth_compressing(self.view, self.position):
+            logger.debug(f"{src} no se comprime, ya viene comprimido")
+            compression = Compression.NONE
+        self.compression = compression
+        self.compressor = compressor(compression)
+        self.compressed_bytes = 0
+        self.digest = 0 if checksum else None # CRC32 de lo leido, None si no hay que mandarlo (o ya se mando)
+
+    def _map(self, src: str) -> memoryview:
+        with open(src, "rb") as file:
+            if not os.fstat(file.fileno()).st_size:
+                # mmap no acepta archivos vacios
+                return memoryview(b'')
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.map)
+
+    def header(self) -> bytes:
+        header = self.size.to_bytes(FILE_SIZE_LENGTH, "big", signed=True)
+        if self.negotiated != Compression.NONE:
+            header += self.compression.value.to_bytes(1, "big")
+        return header
+
+    def resume(self, offset: int):
+        # el receptor ya tiene los primeros offset bytes de la parte, arrancamos despues
+        if not 0 <= offset <= self.remaining:
+            raise ValueError(f"offset {offset} fuera de la parte ({self.remaining} bytes)")
+        self.position += offset
+        self.remaining -= offset
+
+    def read(self, size: int) -> memoryview:
+        """
+        Proximos size bytes (o menos, al final de la parte), una vista del mapeo que el
+        socket encola sin copiar; vacio cuando no queda nada.
+        """
+        length = min(size, self.remaining)
+        if not length:
+            # puede volver a llamarse despues de cerrar (para el CRC32 del final)
+            self.close()
+            return memoryview(b'')
+        data = self.view[self.position: self.position + length]
+        self.position += length
+        self.remaining -= length
+        if self.digest is not None:
+            self.digest = zlib.crc32(data, self.digest)
+        return data
+
+    def read_segments(self, size: int) -> tuple:
+        """
+        Como read, pero devuelve (datos, segmentos): los segmentos cacheados que cubren
+        los datos, para SocketTP.send, o None si no hay o los datos no empiezan en un
+        borde de segmento (partes y reanudaciones que caen a mitad de uno).
+        Con compresion devuelve los datos ya comprimidos, sin segmentos. Con checksum,
+        despues del contenido devuelve una vez el CRC32 (DIGEST_LENGTH bytes).
+        """
+        data, segments = self._read_content(size)
+        if not data and self.digest is not None:
+            data, self.digest = self.digest.to_bytes(DIGEST_LENGTH, "big"), None
+        return data, segments
+
+    def _read_content(self, size: int) -> tuple:
+        if self.compression != Compression.NONE:
+            return self._read_compressed(size), None
+        start = self.position
+        data = self.read(size)
+        if not self.segments or not data:
+            return data, None
+        first, rest = divmod(start, self.segment_size)
+        if rest:
+            return data, None
+        return data, self.segments[first: first - (-len(data) // self.segment_size)]
+
+    def _read_compressed(self, size: int) -> bytes:
+        # el compresor puede guardarse todo un chunk, seguimos leyendo hasta que devuelva algo
+        while self.compressor:
+            data = self.read(size)
+            if data:
+                compressed = self.compressor.compress(data)
+            else:
+                compressed = self.compressor.flush()
+                self.compressor = None
+            if compressed:
+                self.compressed_bytes += len(compressed)
+                return compressed
+        return b''
+
+    def close(self):
+        self.segments = None
+        self.view.release()
+        if self.map:
+            try:
+                self.map.close()
+            except BufferError:
+                # el socket todavia tiene segmentos del mapeo (la transferencia se corto),
+                # se desmapea cuando los suelte
+                pass
+            self.map = None
+
+
+class FileReceiver:
+    """
+    Escribe a disco un archivo que llega de a pedazos: primero su tamanio
+    (FILE_SIZE_LENGTH bytes) y despues el contenido. El archivo se crea recien
+    cuando se sabe que el que lo manda lo tiene, y se escribe en <archivo>.part: el
+    archivo final se reemplaza recien al terminar, asi no se trunca un archivo que
+    otra conexion esta mandando desde un mapeo.
+    Si la conexion negocio una compresion, despues del tamanio llega un byte con la
+    que uso el emisor y el contenido se descomprime a medida que llega. Con checksum,
+    al final llega el CRC32 del contenido y el archivo se guarda solo si coincide con
+    el que se fue calculando al escribirlo.
+    """
+    # lo descomprimido se escribe de a este tamanio: una ventana comprimida puede
+    # expandirse a casi todo el archivo y no la queremos entera en memoria
+    DECOMPRESS_CHUNK = SocketTP.MAX_WINDOW
+
+    def __init__(self, file_path: str, compression: Compression = Compression.NONE, checksum: bool = False):
+        self.file_path = file_path
+        self.partial_path = file_path + PARTIAL_FILE_SUFFIX
+        self.size_bytes = bytearray()
+        self.size = None
+        self.remaining = None
+        self.file = None
+        self.negotiated = compression
+        # sin compresion negociada el header no trae el byte, si no la sabemos al leerlo
+        self.compression = Compression.NONE if compression == Compression.NONE else None
+        self.decompressor = None
+        self.digest = 0 if checksum else None
+        self.expected_digest = bytearray() if checksum else None
+
+    @property
+    def not_found(self) -> bool:
+        return self.size == FILE_NOT_FOUND_ERROR_CODE
+
+    @property
+    def header_pending(self) -> bool:
+        return self.size is None or (self.compression is None and not self.not_found)
+
+    @property
+    def content_done(self) -> bool:
+        # el stream comprimido termina con su propio cierre (y checksum), lo esperamos tambien
+        return self.remaining == 0 and (not self.decompressor or self.decompressor.eof)
+
+    @property
+    def digest_pending(self) -> int:
+        return DIGEST_LENGTH - len(self.expected_digest) if self.digest is not None else 0
+
+    @property
+    def done(self) -> bool:
+        if self.header_pending:
+            return False
+        return self.not_found or (self.content_done and not self.digest_pending)
+
+    @property
+    def pending(self) -> int:
+        # bytes sin comprimir que faltan recibir, contando el CRC32 del final
+        return self.remaining + self.digest_pending
+
+    def feed(self, data) -> int:
+        """
+        Procesa los datos recibidos y devuelve cuantos bytes usó,
+        lo que sobra ya no es parte del archivo.
+        """
+        view = memoryview(data).cast("B")
+        used = 0
+        if self.header_pending:
+            used = self._read_header(view)
+            if self.header_pending or self.not_found:
+                return used
+            self._start()
+
+        if not self.content_done:
+            if self.decompressor:
+                used += self._decompress(view[used:])
+            else:
+                length = min(self.remaining, len(view) - used)
+                self._write(view[used: used + length])
+                used += length
+        if self.content_done and self.digest_pending:
+            used += self._read_digest(view[used:])
+        if self.done and self.file:
+            self._finish()
+        return used
+
+    def _write(self, data):
+        if not data:
+            return
+        self.file.write(data)
+        self.remaining -= len(data)
+        if self.digest is not None:
+            self.digest = zlib.crc32(data, self.digest)
+        self._written()
+
+    def _read_digest(self, view: memoryview) -> int:
+        length = min(self.digest_pending, len(view))
+        self.expected_digest += view[:length]
+        if not self.digest_pending:
+            expected = int.from_bytes(self.expected_digest, "big")
+            if expected != self.digest:
+                self._discard()
+                raise ValueError(f"el checksum del archivo no coincide (esperado {expected:08x}, calculado {self.digest:08x})")
+        return length
+
+    def _discard(self):
+        # lo recibido no sirve, abort() borra el parcial
+        pass
+
+    def _read_header(self, view: memoryview) -> int:
+        used = 0
+        if self.size is None:
+            used = min(FILE_SIZE_LENGTH - len(self.size_bytes), len(view))
+            self.size_bytes += view[:used]
+            if len(self.size_bytes) < FILE_SIZE_LENGTH:
+                return used
+            self.size = int.from_bytes(self.size_bytes, "big", signed=True)
+        if self.compression is None and not self.not_found and used < len(view):
+            compression = Compression(view[used])
+            if compression not in (Compression.NONE, self.negotiated):
+                raise ValueError(f"compresion {compression.name} no negociada")
+            self.compression = compression
+            self.decompressor = decompressor(compression)
+            used += 1
+        return used
+
+    def _decompress(self, view: memoryview) -> int:
+        if self.decompressor.eof:
+            return 0
+        decompressor = self.decompressor
+        data = decompressor.decompress(view, self.DECOMPRESS_CHUNK)
+        while True:
+            if len(data) > self.remaining:
+                raise ValueError("el contenido descomprimido es mas grande que el archivo")
+            self._write(data)
+            if decompressor.eof:
+                break
+            # zlib devuelve lo que no llego a procesar en unconsumed_tail, lzma lo guarda
+            # adentro y avisa con needs_input si todavia tiene salida pendiente
+            tail = getattr(decompressor, "unconsumed_tail", b'')
+            if not tail and len(data) < self.DECOMPRESS_CHUNK and getattr(decompressor, "needs_input", True):
+                return len(view)
+            data = decompressor.decompress(tail, self.DECOMPRESS_CHUNK)
+        if self.remaining:
+            raise ValueError("el contenido comprimido termino antes que el archivo")
+        return len(view) - len(self.decompressor.unused_data)
+
+    def _start(self):
+        self.remaining = self.size
+        self.file = open(self.partial_path, "wb")
+
+    def _written(self):
+        pass
+
+    def _finish(self):
+        self.close()
+        os.replace(self.partial_path, self.file_path)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def abort(self):
+        self.close()
+        # no dejamos archivos a medio escribir
+        if self.size is not None and not self.not_found and os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
+
+
+class Checkpoint:
+    """
+    Cuanto se recibio de una parte de un archivo: tamanio total y bytes de la parte
+    ya escritos en el parcial. Un archivo chico por parte, asi cada conexion escribe
+    solo el suyo.
+    """
+    FORMAT = struct.Struct("!qq")
+
+    def __init__(self, partial_path: str, stream: int, streams: int):
+        self.path = f"{partial_path}.{stream}-{streams}"
+
+    def load(self) -> tuple:
+        try:
+            with open(self.path, "rb") as file:
+                return self.FORMAT.unpack(file.read(self.FORMAT.size))
+        except (OSError, struct.error):
+            return None, 0
+
+    def save(self, size: int, received: int):
+        # escribimos aparte y reemplazamos, un corte a la mitad no deja un checkpoint roto
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(self.FORMAT.pack(size, received))
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class RangeReceiver(FileReceiver):
+    """
+    FileReceiver reanudable para la parte stream de streams del archivo. Escribe en
+    <archivo>.part, en la posicion de la parte, y cada CHECKPOINT_BYTES guarda cuanto
+    lleva. Si la transferencia se corta el parcial queda y la proxima sigue desde offset.
+    Cuando estan todas las partes el parcial se renombra al archivo final.
+    """
+    CHECKPOINT_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, file_path: str, stream: int = 0, streams: int = 1, compression: Compression = Compression.NONE, checksum: bool = False):
+        super().__init__(file_path, compression, checksum)
+        self.stream = stream
+        self.streams = streams
+        self.checkpoint = Checkpoint(self.partial_path, stream, streams)
+        self.offset = 0 # bytes de la parte que ya estaban de una transferencia anterior
+        self.length = 0
+        self.saved = 0
+
+    @property
+    def received(self) -> int:
+        return self.length - self.remaining
+
+    def _start(self):
+        start, self.length = file_range(self.size, self.stream, self.streams)
+        size, received = self.checkpoint.load()
+        if size != self.size or not os.path.exists(self.partial_path):
+            # no hay parcial, o es de un archivo de otro tamanio
+            received = 0
+        self.offset = self.saved = received
+        self.remaining = self.length - received
+        # no truncamos, otras conexiones pueden estar escribiendo sus partes
+        fd = os.open(self.partial_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        os.ftruncate(fd, self.size)
+        self.file = os.fdopen(fd, "wb")
+        self.file.seek(start + received)
+        if received:
+            logger.info(f"Reanudando la parte {self.stream} desde el byte {received} de {self.length}")
+
+    def _written(self):
+        if self.received - self.saved >= self.CHECKPOINT_BYTES:
+            self._save()
+
+    def _save(self):
+        # el checkpoint nunca puede adelantarse a lo que ya esta en el archivo
+        self.file.flush()
+        self.checkpoint.save(self.size, self.received)
+        self.saved = self.received
+
+    def _finish(self):
+        self._save()
+        self.close()
+        self._merge()
+
+    def _merge(self):
+        for stream in range(self.streams):
+            size, received = Checkpoint(self.partial_path, stream, self.streams).load()
+            if size != self.size or received != file_range(self.size, stream, self.streams)[1]:
+                # faltan partes de otras conexiones, la ultima en terminar lo renombra
+                return
+        try:
+            os.replace(self.partial_path, self.file_path)
+        except FileNotFoundError:
+            # otra conexion termino al mismo tiempo y ya lo renombro
+            return
+        for stream in range(self.streams):
+            Checkpoint(self.partial_path, stream, self.streams).remove()
+
+    def _discard(self):
+        # el CRC32 cubre lo recibido en esta conexion: volvemos a pedir la parte desde donde arranco
+        self.remaining = self.length - self.offset
+
+    def abort(self):
+        # a diferencia de FileReceiver no borramos nada, lo recibido sirve para reanudar
+        if self.file:
+            self._save()
+        self.close()
+
+
+def send_file(socket: SocketTP, src: str, buffer_windows: int = TRANSFER_BUFFER_WINDOWS, stream: int = 0, streams: int = 1, resumable: bool = False, cache: FileCache = None):
+    """
+    Manda el archivo (o la parte stream de streams). Si es resumable, despues del
+    tamanio el receptor contesta cuantos bytes de la parte ya tiene y se manda el resto.
+    Si src no existe levanta FileNotFoundError antes de mandar nada.
+    """
+    sender = FileSender(src, stream, streams, cache, socket.compression, socket.checksums)
+    chunk_size = _chunk_size(socket, buffer_windows)
     try:
-        logger.debug(f"Enviando {len(data)} bytes...")
-        socket.sendall(size_bytes)
-        socket.sendall(data)
+        logger.debug(f"Enviando {sender.size} bytes, compresion {sender.compression.name}...")
+        socket.sendall(sender.header())
+        if resumable:
+            sender.resume(int.from_bytes(socket.recv(RESUME_OFFSET_LENGTH), "big"))
+        # de a un chunk, cada uno es una vista del mapeo: cada segmento se copia una
+        # sola vez, del page cache al buffer de sendmmsg
+        while True:
+            chunk, segments = sender.read_segments(chunk_size)
+            if not chunk:
+                break
+            socket.sendall(chunk, segments)
+        if sender.compression != Compression.NONE:
+            logger.debug(f"Comprimido con {sender.compression.name}: se mandaron {sender.compressed_bytes} bytes")
         logger.debug("Archivo enviado correctamente.")
     finally:
+        sender.close()
         logger.debug("Envío finalizado.")
 
 
-def recv_file(socket, dst: str, name: str):
-    try: 
-        size_bytes = socket.recv(4)
-        int_size = int.from_bytes(size_bytes, "big", signed=True)
+def recv_file(socket: SocketTP, dst: str, name: str, stream: int = 0, streams: int = 1, resumable: bool = False) -> bool:
+    """
+    Recibe el archivo y lo guarda en dst. Si es resumable recibe la parte stream de
+    streams con un RangeReceiver y le contesta al emisor desde donde seguir.
+    Devuelve False si no se pudo recibir entero. Si el emisor indica que el archivo
+    no existe levanta FileNotFoundError, no hay nada que reanudar.
+    """
+    file_path = os.path.join(dst, name) if os.path.isdir(dst) else dst
+    if resumable:
+        receiver = RangeReceiver(file_path, stream, streams, socket.compression, socket.checksums)
+    else:
+        receiver = FileReceiver(file_path, socket.compression, socket.checksums)
+    # el buffer de recepcion del socket nunca tiene mas de una ventana: un buffer mas
+    # grande no ahorra llamadas a recv_into y ocupa memoria por cada conexion
+    buffer = memoryview(bytearray(socket.MAX_WINDOW))
+    try:
+        receiver.feed(socket.recv(FILE_SIZE_LENGTH))
+        if receiver.not_found:
+            raise FileNotFoundError(f"el archivo {name} no existe")
+        if receiver.header_pending:
+            receiver.feed(socket.recv(1))
+        if resumable:
+            socket.sendall(receiver.offset.to_bytes(RESUME_OFFSET_LENGTH, "big"))
 
-        if int_size == FILE_NOT_FOUND_ERROR_CODE:
-            logger.error("El servidor indicó que el archivo no existe.")
-            return
+        # escribimos a disco a medida que llegan los datos, reusando el mismo buffer
+        while not receiver.done:
+            if receiver.decompressor and not receiver.content_done:
+                # comprimido no sabemos cuanto ocupa lo que falta, tomamos lo que vaya llegando
+                receiver.feed(socket.recv_chunk())
+                continue
+            received = socket.recv_into(buffer[:min(len(buffer), receiver.pending)])
+            receiver.feed(buffer[:received])
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        logger.error(f"Error recibiendo archivo: {e}")
+        receiver.abort()
+        return False
 
-        data = socket.recv(int_size)
+    logger.debug(f"Archivo recibido y guardado en {file_path}")
+    return True
+
+
+async def async_send_file(socket: AsyncSocketTP, src: str, buffer_windows: int = TRANSFER_BUFFER_WINDOWS):
+    sender = FileSender(src)
+    try:
+        logger.debug(f"Enviando {sender.size} bytes...")
+        await socket.send(sender.header())
+        # cada chunk es una vista del mapeo, el socket no la copia mientras espera los ACK
+        while chunk := sender.read(_chunk_size(socket, buffer_windows)):
+            await socket.send(chunk)
+        logger.debug("Archivo enviado correctamente.")
+    finally:
+        sender.close()
+        logger.debug("Envío finalizado.")
+
+
+async def async_recv_file(socket: AsyncSocketTP, dst: str, name: str):
+    file_path = os.path.join(dst, name) if os.path.isdir(dst) else dst
+    receiver = FileReceiver(file_path)
+    try:
+        async for chunk in socket:
+            receiver.feed(chunk)
+            if receiver.done:
+                break
     except Exception as e:
         logger.error(f"Error recibiendo archivo: {e}")
+        receiver.abort()
         return
-    
-    file_path = os.path.join(dst, name) if os.path.isdir(dst) else dst
-    with open(file_path, "wb") as f:
-        f.write(data)
-    logger.debug(f"Archivo recibido y guardado en {file_path}")
+
+    if receiver.not_found:
+        logger.error("El servidor indicó que el archivo no existe.")
+    elif not receiver.done:
+        logger.error("Error recibiendo archivo: CONNECTION CLOSED")
+        receiver.abort()
+    else:
+        logger.debug(f"Archivo recibido y guardado en {file_path}")
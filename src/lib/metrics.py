@@ -0,0 +1,150 @@
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from .timer_service import timer_service
+
+logger = logging.getLogger("root")
+
+# contadores de SocketTP.stats() que se suman entre conexiones: nombre -> ayuda para Prometheus
+COUNTERS = {
+    "segments_sent": "Data segments sent, retransmissions included.",
+    "segments_retransmitted": "Data segments retransmitted.",
+    "bytes_sent": "Payload bytes sent, retransmissions included.",
+    "bytes_acked": "Payload bytes acknowledged by the peer.",
+    "segments_received": "Data segments received.",
+    "segments_ignored": "Data segments received and discarded.",
+    "segments_buffered": "Data segments received out of order and buffered.",
+    "bytes_received": "Payload bytes delivered in order.",
+    "checksum_errors": "Segments dropped because of a checksum mismatch.",
+    "acks_sent": "ACKs sent.",
+    "acks_received": "ACKs received.",
+    "duplicate_acks": "Duplicate ACKs received.",
+    "timeouts": "Retransmission timeouts.",
+    "fast_retransmits": "Retransmissions triggered by duplicate ACKs.",
+}
+
+# valores del momento que solo tienen sentido para las conexiones abiertas
+GAUGES = {
+    "in_flight": "Bytes sent and not acknowledged.",
+    "cwnd": "Congestion window in bytes.",
+    "send_bytes_per_sec": "Acknowledged bytes per second.",
+    "recv_bytes_per_sec": "Bytes delivered in order per second.",
+}
+
+
+class ServerMetrics:
+    """
+    Estadisticas de todo el servidor: la suma de los contadores de las conexiones que
+    ya terminaron y de las abiertas, mas los valores del momento de las abiertas.
+    Las conexiones se registran con add al aceptarlas y se sacan con remove al cerrarlas,
+    desde cualquier thread.
+    """
+    PREFIX = "sockettp"
+
+    def __init__(self):
+        self.connections = set() # SocketTP abiertas
+        self.totals = dict.fromkeys(COUNTERS, 0) # de las conexiones que ya se cerraron
+        self.connections_total = 0
+        self.lock = Lock()
+        self.http_server = None
+        self.log_interval = None
+        self.log_timer = None
+
+    def add(self, socket):
+        with self.lock:
+            self.connections.add(socket)
+            self.connections_total += 1
+
+    def remove(self, socket):
+        # lo que hizo la conexion queda en los totales
+        stats = socket.stats()
+        with self.lock:
+            if socket not in self.connections:
+                return
+            self.connections.discard(socket)
+            for name in COUNTERS:
+                self.totals[name] += stats[name]
+
+    def stats(self) -> dict:
+        with self.lock:
+            connections = list(self.connections)
+            result = dict(self.totals)
+            result["connections_total"] = self.connections_total
+        result["connections_active"] = len(connections)
+        result.update(dict.fromkeys(GAUGES, 0))
+        rtts = []
+        for connection in connections:
+            stats = connection.stats()
+            for name in COUNTERS:
+                result[name] += stats[name]
+            for name in GAUGES:
+                result[name] += stats[name]
+            rtts.append(stats["rtt"])
+        result["rtt_mean"] = round(sum(rtts) / len(rtts), 6) if rtts else 0
+        return result
+
+    def prometheus(self) -> str:
+        """
+        stats() en el formato de texto de Prometheus (version 0.0.4).
+        """
+        stats = self.stats()
+        lines = []
+
+        def metric(name: str, kind: str, help: str, value):
+            lines.append(f"# HELP {self.PREFIX}_{name} {help}")
+            lines.append(f"# TYPE {self.PREFIX}_{name} {kind}")
+            lines.append(f"{self.PREFIX}_{name} {value}")
+
+        metric("connections_total", "counter", "Connections accepted.", stats["connections_total"])
+        metric("connections_active", "gauge", "Connections open.", stats["connections_active"])
+        for name, help in COUNTERS.items():
+            metric(f"{name}_total", "counter", help, stats[name])
+        for name, help in GAUGES.items():
+            metric(name, "gauge", f"{help} Sum over the open connections.", stats[name])
+        metric("rtt_mean_seconds", "gauge", "Mean smoothed RTT of the open connections.", stats["rtt_mean"])
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host: str, port: int):
+        """
+        Sirve prometheus() por HTTP en host:port (cualquier path) desde un thread aparte.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # un scrape cada pocos segundos no tiene que llenar el log
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), Handler)
+        Thread(target=self.http_server.serve_forever, name="metrics", daemon=True).start()
+        logger.info(f"Métricas en http://{host}:{self.http_server.server_address[1]}/metrics")
+
+    def log_every(self, interval: float):
+        """
+        Loguea stats() cada interval segundos hasta close.
+        """
+        self.log_interval = interval
+        self.log_timer = timer_service.schedule(interval, self._log)
+
+    def _log(self):
+        # corre en el thread del timer_service, stats() solo toma locks cortos
+        if self.log_interval is None:
+            return
+        logger.info(f"Estadísticas del servidor: {self.stats()}")
+        self.log_timer = timer_service.schedule(self.log_interval, self._log)
+
+    def close(self):
+        self.log_interval = None
+        timer_service.cancel(self.log_timer)
+        if self.http_server:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
@@ -0,0 +1,97 @@
+import itertools
+import struct
+from enum import IntEnum
+from time import monotonic_ns
+
+
+class TraceEvent(IntEnum):
+    SENT = 1 # segmento de datos enviado por primera vez
+    RETRANSMITTED = 2
+    ACK_RECEIVED = 3 # el ACK avanzo
+    DUPLICATE_ACK = 4
+    ACCEPTED = 5 # segmento de datos recibido en orden
+    BUFFERED = 6 # recibido fuera de orden y guardado (Selective Repeat)
+    IGNORED = 7
+    ACK_SENT = 8
+    TIMEOUT = 9
+    FAST_RETRANSMIT = 10
+    CHECKSUM_ERROR = 11
+
+
+class PacketTrace:
+    """
+    Traza binaria de los eventos por paquete, en un buffer circular de capacity
+    registros de tamanio fijo que se pisan cuando se llena: guardar un evento es un
+    solo pack_into, sin strings ni objetos nuevos. Con dump se escribe a un archivo
+    y con load se vuelve a leer (show-trace.py la muestra como texto).
+
+    Formato de cada registro (RECORD):
+      - 8 bytes: monotonic_ns del evento
+      - 1 byte: TraceEvent
+      - 2 bytes: puerto del otro extremo, para separar las conexiones
+      - 8 bytes: seq_number
+      - 4 bytes: bytes de datos del segmento
+      - 4 bytes: ventana (anunciada en los ACK, disponible en los envios)
+    """
+    RECORD = struct.Struct("!QBxHQII")
+    MAGIC = b"TPTRACE1"
+    FILE_HEADER = struct.Struct("!8sI") # MAGIC y cantidad de registros
+
+    def __init__(self, capacity: int = 1 << 18):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * self.RECORD.size)
+        # next() de itertools.count es atomico con el GIL: varios threads pueden registrar sin lock
+        self.counter = itertools.count()
+        self._pack_into = self.RECORD.pack_into
+
+    def record(self, event: TraceEvent, port: int, seq_number: int, length: int = 0, window: int = 0):
+        self._pack_into(self.buffer, next(self.counter) % self.capacity * self.RECORD.size,
+                        monotonic_ns(), event, port, seq_number, length, window)
+
+    def records(self) -> list:
+        """
+        Registros guardados, del mas viejo al mas nuevo, como tuplas de los campos de RECORD.
+        """
+        end = next(self.counter)
+        # el lugar que reservamos queda vacio, si no tendria un registro de la vuelta anterior
+        self.buffer[end % self.capacity * self.RECORD.size: (end % self.capacity + 1) * self.RECORD.size] = bytes(self.RECORD.size)
+        start = max(0, end - self.capacity + 1)
+        records = []
+        for index in range(start, end):
+            record = self.RECORD.unpack_from(self.buffer, index % self.capacity * self.RECORD.size)
+            # los que todavia se estan escribiendo en otro thread pueden estar vacios
+            if record[0]:
+                records.append(record)
+        records.sort()
+        return records
+
+    def dump(self, path: str) -> int:
+        records = self.records()
+        with open(path, "wb") as file:
+            file.write(self.FILE_HEADER.pack(self.MAGIC, len(records)))
+            for record in records:
+                file.write(self.RECORD.pack(*record))
+        return len(records)
+
+    @staticmethod
+    def load(path: str) -> list:
+        with open(path, "rb") as file:
+            data = file.read()
+        magic, count = PacketTrace.FILE_HEADER.unpack_from(data)
+        if magic != PacketTrace.MAGIC:
+            raise ValueError(f"{path} no es una traza de SocketTP")
+        return list(PacketTrace.RECORD.iter_unpack(data[PacketTrace.FILE_HEADER.size: PacketTrace.FILE_HEADER.size + count * PacketTrace.RECORD.size]))
+
+
+# traza que usan las SocketTP que se crean desde start_trace, None si no se traza
+_packet_trace = None
+
+
+def start_trace(capacity: int = 1 << 18) -> PacketTrace:
+    global _packet_trace
+    _packet_trace = PacketTrace(capacity)
+    return _packet_trace
+
+
+def current_trace() -> PacketTrace:
+    return _packet_trace
@@ -0,0 +1,149 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from lib.socket_tp import SocketTP
+from lib.ack_policy import AckPolicy
+from lib.constants import ErrorRecoveryMode, CongestionControl, ClientMode, Compression
+from lib.file_transfer import send_file, recv_file, build_request
+from lib.packet_trace import start_trace
+
+logger = logging.getLogger("root")
+
+
+def _connect(host: str, port: int, mode: ErrorRecoveryMode, congestion: CongestionControl, ack_policy: AckPolicy, compression: Compression, checksums: bool) -> SocketTP:
+    socket = SocketTP()
+    try:
+        socket.connect(host, port, mode, congestion, ack_policy, compression, checksums)
+    except Exception:
+        # si no, el thread de recepcion sigue vivo y el proceso no termina
+        socket.close()
+        raise
+    return socket
+
+
+def _upload_stream(stream, streams, resumable, host, port, src, name, mode, congestion, ack_policy, compression, checksums) -> dict:
+    with _connect(host, port, mode, congestion, ack_policy, compression, checksums) as socket:
+        if resumable:
+            socket.sendall(build_request(ClientMode.UPLOAD_RANGE, name, stream, streams))
+        else:
+            socket.sendall(build_request(ClientMode.UPLOAD, name))
+        send_file(socket, src, stream=stream, streams=streams, resumable=resumable)
+        return socket.stats()
+
+
+def _download_stream(stream, streams, resumable, host, port, file_path, name, mode, congestion, ack_policy, compression, checksums) -> tuple:
+    with _connect(host, port, mode, congestion, ack_policy, compression, checksums) as socket:
+        if resumable:
+            socket.sendall(build_request(ClientMode.DOWNLOAD_RANGE, name, stream, streams))
+        else:
+            socket.sendall(build_request(ClientMode.DOWNLOAD, name))
+        received = recv_file(socket, file_path, name, stream=stream, streams=streams, resumable=resumable)
+        return received, socket.stats()
+
+
+def _run_stream(function, trace: str, stream: int, streams: int, *args):
+    # la traza es global por proceso: cada worker arma la suya y la escribe en su propio archivo
+    packet_trace = start_trace() if trace else None
+    try:
+        return function(stream, streams, *args)
+    finally:
+        if packet_trace:
+            path = trace if streams == 1 else f"{trace}.{stream}"
+            logger.info(f"Traza de paquetes: {packet_trace.dump(path)} eventos en '{path}'")
+
+
+def _init_worker(levels: dict):
+    # un proceso nuevo arranca con la configuracion del archivo, sin el -v / -q del script
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+
+def _run(function, streams: int, trace: str, *args) -> list:
+    """
+    Corre function para cada conexion. Devuelve el resultado de cada una, o la
+    excepcion si fallo: una conexion que falla no corta a las demas.
+    Con trace, cada conexion escribe su traza en trace.<conexion> (en trace si es una sola).
+    """
+    if streams == 1:
+        try:
+            return [_run_stream(function, trace, 0, 1, *args)]
+        except Exception as e:
+            return [e]
+    # un proceso por conexion: cada una tiene su propio interprete, no compiten por el GIL.
+    # spawn y no fork: un hijo forkeado hereda el timer_service con su thread ya
+    # arrancado pero sin correr, y los timers de retransmision nunca vencen
+    levels = {name: logging.getLogger(name).level for name in ("root", "socket")}
+    with ProcessPoolExecutor(max_workers=streams, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(levels,)) as pool:
+        futures = [pool.submit(_run_stream, function, trace, stream, streams, *args) for stream in range(streams)]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def parallel_upload(host: str, port: int, src: str, name: str, streams: int, mode: ErrorRecoveryMode = ErrorRecoveryMode.GO_BACK_N,
+                    congestion: CongestionControl = CongestionControl.AIMD, ack_policy: AckPolicy = None, compression: Compression = Compression.NONE,
+                    checksums: bool = False, trace: str = None, resumable: bool = False) -> tuple:
+    """
+    Sube src partido en streams rangos, cada uno por su propia conexion. El servidor
+    escribe cada parte en su posicion del archivo y, si una subida anterior se corto,
+    solo se mandan los bytes que le faltan. Con una sola conexion se usa el pedido
+    UPLOAD de siempre, salvo que se pida resumable. Con compression cada conexion comprime su
+    parte, salvo que el archivo ya venga comprimido. Con checksums cada segmento lleva su
+    CRC32 y el servidor verifica el de cada parte. Con trace cada conexion guarda la
+    traza de sus paquetes. Devuelve (si se subio entero, estadisticas de cada conexion que termino).
+    """
+    logger.debug(f"Subiendo {os.path.getsize(src)} bytes en {streams} conexiones")
+    # los rangos en paralelo siempre van con el pedido por rangos, que se puede reanudar
+    resumable = resumable or streams > 1
+    uploaded = True
+    stats = []
+    for stream, result in enumerate(_run(_upload_stream, streams, trace, resumable, host, port, src, name, mode, congestion, ack_policy, compression, checksums)):
+        if isinstance(result, Exception):
+            logger.error(f"Error enviando la parte {stream}: {result}")
+            uploaded = False
+        else:
+            stats.append(result)
+    if not uploaded and resumable:
+        logger.error("No se pudo subir el archivo completo, volver a ejecutar la subida para reanudarla.")
+    return uploaded, stats
+
+
+def parallel_download(host: str, port: int, dst: str, name: str, streams: int, mode: ErrorRecoveryMode = ErrorRecoveryMode.GO_BACK_N,
+                      congestion: CongestionControl = CongestionControl.AIMD, ack_policy: AckPolicy = None, compression: Compression = Compression.NONE,
+                      checksums: bool = False, trace: str = None, resumable: bool = False) -> tuple:
+    """
+    Descarga name en streams rangos en paralelo, cada conexion escribe su parte en su
+    posicion del parcial de dst. Si alguna falla el parcial queda, volver a llamarla con
+    los mismos streams descarga solo lo que falta. Con una sola conexion se usa el
+    pedido DOWNLOAD de siempre, salvo que se pida resumable. Con trace cada conexion guarda la
+    traza de sus paquetes. Devuelve (si se descargo entero, estadisticas de cada conexion que termino).
+    """
+    file_path = os.path.join(dst, name) if os.path.isdir(dst) else dst
+    resumable = resumable or streams > 1
+    downloaded = True
+    not_found = False
+    stats = []
+    for stream, result in enumerate(_run(_download_stream, streams, trace, resumable, host, port, file_path, name, mode, congestion, ack_policy, compression, checksums)):
+        if isinstance(result, FileNotFoundError):
+            # lo contestan todas las conexiones, lo informamos una sola vez
+            not_found = True
+            downloaded = False
+            continue
+        if isinstance(result, Exception):
+            logger.error(f"Error recibiendo la parte {stream}: {result}")
+            downloaded = False
+            continue
+        received, stream_stats = result
+        downloaded = downloaded and received
+        stats.append(stream_stats)
+    if not_found:
+        logger.error("El servidor indicó que el archivo no existe.")
+    elif not downloaded and resumable:
+        logger.error("No se pudo descargar el archivo completo, volver a ejecutar la descarga para reanudarla.")
+    return downloaded, stats
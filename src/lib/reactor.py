@@ -0,0 +1,250 @@
+import logging
+import selectors
+from socket import socket, AF_INET, SOCK_DGRAM
+from threading import Thread, Lock
+from time import monotonic
+from .batch_io import BatchIO
+from .socket_tp import SocketTP
+from .compression import negotiate_compression
+from .timer_service import timer_service
+from .utils import Packet, FIN_FRAME, validate_type, parse_syn_payload, build_syn_ack
+
+logger = logging.getLogger("socket")
+
+
+class _Connection:
+    HANDSHAKE = 1
+    ESTABLISHED = 2
+    CLOSING = 3
+
+    def __init__(self, socket_tp: SocketTP):
+        self.socket_tp = socket_tp
+        self.state = _Connection.HANDSHAKE
+        self.started = monotonic()
+        self.last_activity = self.started
+        self.timer = None # SYN-ACK o FIN pendiente de reenviar
+        self.syn_ack = build_syn_ack(socket_tp.ack_policy, socket_tp.compression, socket_tp.checksums)
+        self.fin_acked = False
+        self.fin_attempts = 0
+
+
+class Reactor:
+    """
+    Servidor multiplexado: un solo socket UDP y un solo thread atienden a todos los
+    clientes. Los datagramas se despachan a la SocketTP de cada cliente segun su
+    direccion, y los timers (SYN-ACK, FIN, TIME WAIT, inactividad) van al timer_service.
+
+    on_connection(socket) se llama desde el thread del reactor al completarse el
+    handshake. Quien la atiende no debe bloquear: usa los callbacks on_data, on_acked,
+    on_fin y on_closed de la SocketTP, manda con send() y termina con close_connection().
+    """
+    MAX_DATAGRAM_SIZE = SocketTP.PACKET_DATA_SIZE + Packet.MAX_HEADER_SIZE
+
+    def __init__(self, host: str, port: int, on_connection):
+        validate_type("host", host, str)
+        validate_type("port", port, int)
+        self.socket = socket(AF_INET, SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        self.on_connection = on_connection
+        self.batch_io = BatchIO(self.MAX_DATAGRAM_SIZE)
+        self.outbox = [] # ACKs de todas las conexiones, se mandan juntos al terminar cada batch
+        self.connections = {} # addr -> _Connection
+        self.lock = Lock()
+        self.running = False
+        self.thread = Thread(target=self._run, name="reactor")
+        self.sweep_timer = None
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        self.sweep_timer = timer_service.schedule(SocketTP.SOCKET_TIMEOUT, self._sweep)
+
+    def close(self):
+        if not self.running:
+            return
+        self.running = False
+        timer_service.cancel(self.sweep_timer)
+        self.thread.join()
+        with self.lock:
+            connections = list(self.connections.values())
+            self.connections.clear()
+        for connection in connections:
+            self._release(connection)
+        self.selector.close()
+        self.socket.close()
+
+    def _run(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=SocketTP.SOCKET_TIMEOUT):
+                if not self._drain(key.fileobj):
+                    return
+
+    def _drain(self, sock: socket) -> bool:
+        # leemos todo lo que haya en el socket antes de volver a select, de a varios datagramas por syscall.
+        # Devuelve False si no se puede leer mas del socket
+        while True:
+            try:
+                datagrams = self.batch_io.recv(sock)
+            except OSError as e:
+                # los ICMP de clientes que ya no estan no llegan aca (BatchIO los ignora): el socket
+                # se cerro o no se puede leer mas, volver a intentar solo gira en vacio
+                if self.running:
+                    logger.error(f"Reactor - error receiving, stopped: {e}")
+                return False
+            if not datagrams:
+                return True
+            for data, addr in datagrams:
+                try:
+                    self._dispatch(addr, Packet.from_bytes(data))
+                except Exception as e:
+                    logger.error(f"{addr} - error processing packet: {e}")
+            self._flush_outbox()
+
+    def _flush_outbox(self):
+        if self.outbox:
+            self.batch_io.send(self.socket, self.outbox)
+            self.outbox.clear()
+
+    def _dispatch(self, addr, packet: Packet):
+        with self.lock:
+            connection = self.connections.get(addr)
+        if not connection:
+            if packet.syn and not packet.ack:
+                self._process_syn(addr, packet)
+            return
+
+        connection.last_activity = monotonic()
+        if connection.state == _Connection.HANDSHAKE:
+            if packet.syn:
+                # se perdio nuestro SYN-ACK
+                self.socket.sendto(connection.syn_ack, addr)
+                return
+            self._establish(connection)
+            if packet.ack and not packet.data and packet.seq_number == 0:
+                # ACK del handshake, no es para la conexion
+                return
+
+        if connection.state == _Connection.CLOSING:
+            self._process_closing(connection, packet)
+        else:
+            connection.socket_tp._process_packet(addr, packet)
+
+    def _process_syn(self, addr, packet: Packet):
+        try:
+            mode, congestion, ack_policy, compression, checksums = parse_syn_payload(packet.data)
+        except ValueError as e:
+            logger.error(f"{addr} invalid mode: {e} - IGNORED")
+            return
+
+        socket_tp = SocketTP(self.socket, self.batch_io)
+        socket_tp.reactor = self
+        socket_tp.outbox = self.outbox
+        socket_tp.dest_addr = addr
+        socket_tp._set_error_recovery_mode(mode, congestion)
+        socket_tp.ack_policy = ack_policy.negotiate(mode)
+        socket_tp.compression = negotiate_compression(compression)
+        socket_tp.checksums = checksums
+        connection = _Connection(socket_tp)
+        with self.lock:
+            self.connections[addr] = connection
+        if socket_tp.debug:
+            logger.debug(f"{addr} - SYN RECEIVED mode: {mode.name}, congestion: {congestion.name}, ack: {socket_tp.ack_policy}, compression: {socket_tp.compression.name}, checksums: {checksums}")
+        self._send_syn_ack(addr, connection)
+
+    def _send_syn_ack(self, addr, connection: _Connection):
+        if connection.state != _Connection.HANDSHAKE:
+            return
+        if monotonic() - connection.started > SocketTP.CONNECTION_TIMEOUT:
+            logger.debug(f"{addr} - handshake TIME OUT")
+            self._remove(connection)
+            return
+        self.socket.sendto(connection.syn_ack, addr)
+        connection.timer = timer_service.schedule(SocketTP.SOCKET_TIMEOUT, self._send_syn_ack, addr, connection)
+
+    def _establish(self, connection: _Connection):
+        connection.state = _Connection.ESTABLISHED
+        timer_service.cancel(connection.timer)
+        socket_tp = connection.socket_tp
+        socket_tp.established = monotonic()
+        logger.debug(f"Connection established successfully with {socket_tp.dest_addr} mode: {socket_tp.mode.name}")
+        self.on_connection(socket_tp)
+
+    def close_connection(self, socket_tp: SocketTP):
+        """
+        Cierra la conexion sin bloquear, igual que SocketTP.close: FIN hasta que lo
+        confirmen y TIME WAIT para los paquetes tardios.
+        """
+        with self.lock:
+            connection = self.connections.get(socket_tp.dest_addr)
+        if not connection or connection.state == _Connection.CLOSING:
+            return
+        connection.state = _Connection.CLOSING
+        socket_tp.end_connection = True
+        socket_tp.ended = monotonic()
+        socket_tp.state.close()
+        socket_tp.retransmission_queue.clear()
+        self._send_fin(connection)
+
+    def _send_fin(self, connection: _Connection):
+        socket_tp = connection.socket_tp
+        interval = max(socket_tp.state.estimated_round_trip_time * 2, 0.2)
+        done = connection.fin_acked and socket_tp.fin_received
+        if done or connection.fin_attempts >= SocketTP.CLOSING_LOOP_LIMIT:
+            # TIME WAIT: seguimos confirmando FINs tardios antes de olvidar la conexion
+            connection.timer = timer_service.schedule(interval * SocketTP.TIME_WAIT_FACTOR, self._remove, connection)
+            return
+        if not connection.fin_acked:
+            self.socket.sendto(FIN_FRAME, socket_tp.dest_addr)
+            logger.debug(f"{socket_tp.dest_addr} - FIN - SENT")
+        connection.fin_attempts += 1
+        connection.timer = timer_service.schedule(interval, self._send_fin, connection)
+
+    def _process_closing(self, connection: _Connection, packet: Packet):
+        socket_tp = connection.socket_tp
+        if packet.fin:
+            socket_tp._process_fin()
+        elif packet.ack:
+            connection.fin_acked = True
+            logger.debug(f"{socket_tp.dest_addr} - ACK - RECEIVED")
+        elif not packet.syn:
+            # datos que se retransmitieron porque se perdio nuestro ACK, los volvemos a confirmar
+            socket_tp._process_data(socket_tp.dest_addr, packet)
+
+    def _sweep(self):
+        # cerramos las conexiones que no recibieron nada en CONNECTION_TIMEOUT segundos
+        now = monotonic()
+        with self.lock:
+            expired = [connection for connection in self.connections.values()
+                       if connection.state == _Connection.ESTABLISHED
+                       and now - connection.last_activity > SocketTP.CONNECTION_TIMEOUT]
+        for connection in expired:
+            logger.debug(f"{connection.socket_tp.dest_addr} - connection TIME OUT")
+            self._remove(connection)
+        if self.running:
+            self.sweep_timer = timer_service.schedule(SocketTP.SOCKET_TIMEOUT, self._sweep)
+
+    def _remove(self, connection: _Connection):
+        with self.lock:
+            if self.connections.get(connection.socket_tp.dest_addr) is not connection:
+                return
+            del self.connections[connection.socket_tp.dest_addr]
+        self._release(connection)
+
+    def _release(self, connection: _Connection):
+        socket_tp = connection.socket_tp
+        timer_service.cancel(connection.timer)
+        socket_tp.end_connection = True
+        socket_tp.closed = True
+        socket_tp.ended = socket_tp.ended or monotonic()
+        socket_tp.state.close()
+        socket_tp.retransmission_queue.clear()
+        self.batch_io.forget(socket_tp.dest_addr)
+        if socket_tp.on_closed:
+            socket_tp.on_closed()
+
+    def connection_count(self) -> int:
+        with self.lock:
+            return len(self.connections)
@@ -0,0 +1,99 @@
+from threading import Condition
+
+
+class ReceiveBuffer:
+    """
+    Buffer circular de recepcion: un bytearray de capacity bytes con un cursor de
+    escritura y uno de lectura. El thread que recibe copia el payload de cada segmento
+    en orden con write y el lector lo saca con read_into / read en pedazos grandes,
+    sin un objeto ni un lock por segmento.
+
+    Un solo escritor y un solo lector: cada uno mueve solo su cursor y cada uno
+    copia en una zona que el otro no toca, asi que solo la espera usa la Condition.
+    El escritor avisa recien cuando el lector esta esperando y ya hay lo que pidio.
+    Lo libre (free) es la ventana que anuncia el receptor: si se llena, el emisor para.
+    El bytearray se reserva con la primera escritura, las conexiones que entregan los
+    datos con on_data (reactor) no lo usan.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.view = None
+        self.read_pos = 0 # bytes leidos desde el principio de la conexion
+        self.write_pos = 0 # bytes escritos desde el principio de la conexion
+        self.readable = Condition()
+        self.waiting = False # el lector esta esperando wanted bytes
+        self.wanted = 0
+        self.closed = False
+
+    @property
+    def size(self) -> int:
+        return self.write_pos - self.read_pos
+
+    @property
+    def free(self) -> int:
+        return self.capacity - (self.write_pos - self.read_pos)
+
+    def write(self, data) -> bool:
+        """
+        Copia data al final del buffer. Devuelve False, sin copiar nada, si no entra.
+        """
+        length = len(data)
+        if length > self.free:
+            return False
+        if self.view is None:
+            self.view = memoryview(bytearray(self.capacity))
+        start = self.write_pos % self.capacity
+        first = min(length, self.capacity - start)
+        self.view[start: start + first] = data[:first]
+        if first < length:
+            # da la vuelta, lo que sigue va al principio
+            self.view[:length - first] = data[first:]
+        # el cursor se mueve despues de copiar: el lector nunca ve datos a medio escribir
+        self.write_pos += length
+        if self.waiting and self.size >= self.wanted:
+            with self.readable:
+                self.readable.notify()
+        return True
+
+    def read_into(self, view: memoryview) -> int:
+        """
+        Copia en view lo que haya, hasta len(view) bytes, sin esperar. Devuelve la cantidad.
+        """
+        length = min(len(view), self.size)
+        if not length:
+            return 0
+        start = self.read_pos % self.capacity
+        first = min(length, self.capacity - start)
+        view[:first] = self.view[start: start + first]
+        if first < length:
+            view[first: length] = self.view[:length - first]
+        self.read_pos += length
+        return length
+
+    def read(self, max_size: int = None) -> bytearray:
+        """
+        Saca todo lo que haya (hasta max_size bytes) sin esperar, vacio si no hay nada.
+        """
+        size = self.size if max_size is None else min(max_size, self.size)
+        data = bytearray(size)
+        self.read_into(memoryview(data))
+        return data
+
+    def wait(self, wanted: int, timeout: float) -> bool:
+        """
+        Espera a que haya al menos wanted bytes o a que se cierre el buffer.
+        Devuelve False si paso timeout antes.
+        """
+        with self.readable:
+            self.wanted = wanted
+            self.waiting = True
+            try:
+                return self.readable.wait_for(lambda: self.size >= wanted or self.closed, timeout)
+            finally:
+                self.waiting = False
+
+    def close(self):
+        # despierta al lector, lo que quede se puede seguir leyendo
+        with self.readable:
+            self.closed = True
+            self.readable.notify_all()
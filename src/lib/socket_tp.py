@@ -1,11 +1,19 @@
-from socket import socket, AF_INET, SOCK_DGRAM
-from .constants import ErrorRecoveryMode
-from .utils import Packet, Window, Timer, Sequence, validate_type, build_syn_payload, parse_syn_payload
+from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF, SO_SNDBUF
+from .constants import ErrorRecoveryMode, CongestionControl, Compression
+from .congestion import FixedWindow, build_window_controller
+from .ack_policy import AckPolicy
+from .compression import negotiate_compression
+from .batch_io import BatchIO
+from .timer_service import timer_service
+from .packet_trace import TraceEvent, current_trace
+from .receive_buffer import ReceiveBuffer
+from .utils import Packet, ACK_FRAME, FIN_FRAME, SenderState, RetransmissionQueue, validate_type, build_syn_payload, parse_syn_payload, build_syn_ack, parse_syn_ack
 import queue
 import logging
-from threading import Thread, Condition
-from time import sleep
-from datetime import datetime, timedelta
+import struct
+from collections import deque
+from threading import Thread, Condition, Lock
+from time import sleep, monotonic
 
 
 logger = logging.getLogger("socket")
@@ -17,19 +25,67 @@ class SocketTP:
     CLOSING_LOOP_LIMIT = 5
     TIME_WAIT_FACTOR = 4 #puede ser mucho
     SOCKET_TIMEOUT = 1
-    GO_BACK_N_WINDOW = 5 * PACKET_DATA_SIZE
+    GO_BACK_N_WINDOW = 5 * PACKET_DATA_SIZE # ventana del control de congestion FIXED
+    MAX_WINDOW = 256 * PACKET_DATA_SIZE # buffer de recepcion, la ventana nunca supera este tamanio
+    DUPLICATE_ACK_THRESHOLD = 3 # ACKs repetidos que disparan el fast retransmit, 0 lo desactiva
+    # el kernel cobra cada datagrama por lo que ocupa en memoria (~2.3 KB en Linux por uno de 1.4 KB),
+    # no por los datos: con el buffer por defecto (~208 KB) una rafaga de una ventana no entra
+    DATAGRAM_BUFFER_COST = 2304
+    SOCKET_BUFFER_SIZE = MAX_WINDOW // PACKET_DATA_SIZE * DATAGRAM_BUFFER_COST
 
-    def __init__(self):
+    def __init__(self, sock: socket = None, batch_io: BatchIO = None):
         self.host = None
-        self.socket = socket(AF_INET, SOCK_DGRAM)
+        self.socket = sock or socket(AF_INET, SOCK_DGRAM)
+        self.receive_window = self.MAX_WINDOW # lo que entra en el buffer del socket, ver _size_socket_buffers
+        self._size_socket_buffers()
+        self.batch_io = batch_io or BatchIO(self.PACKET_DATA_SIZE + Packet.MAX_HEADER_SIZE)
+        self.outbox = None # si esta, los ACK se juntan aca y se mandan todos juntos al final del batch
         self.connection_queue = None
         self.dest_addr = None
         self.end_connection = False
-        self.window = Window(self.PACKET_DATA_SIZE)
-        self.timer = Timer()
-        self.sequence = Sequence()
-        self.packet_queue = queue.Queue()
-        self.timer_thread = Thread(target=self._process_timer)
+        self.state = SenderState(FixedWindow(self.PACKET_DATA_SIZE), self.MAX_WINDOW, self._on_timeout)
+        self.mode = None
+        self.congestion = None
+        self.retransmission_queue = RetransmissionQueue(self._on_segment_timeout, self.state.timeout_interval)
+        self.recovery_point = 0 # reducimos la ventana una sola vez por perdidas de la misma ventana
+        self.duplicate_acks = 0
+        self.out_of_order = {} # seq_number -> Packet, segmentos recibidos fuera de orden (Selective Repeat)
+        self.ack_policy = AckPolicy() # negociada en el handshake
+        self.compression = Compression.NONE # negociada en el handshake, la usan send_file y recv_file
+        self.checksums = False # negociado en el handshake: CRC32 en cada segmento de datos y al final de cada archivo
+        self.checksum_errors = 0
+        # se decide una vez por conexion: en el camino de cada paquete los f-strings
+        # de debug (y Packet.__str__) solo se arman si hace falta
+        self.debug = logger.isEnabledFor(logging.DEBUG)
+        self.trace = current_trace() # PacketTrace binaria de los eventos por paquete, si se pidio
+        self.ack_lock = Lock()
+        self.ack_pending = 0 # segmentos recibidos y todavia sin confirmar
+        self.ack_sack = 0 # ultimo segmento recibido, para el SACK del ACK demorado
+        self.ack_timer = None
+        self.segments_sent = 0 # segmentos de datos puestos en la red, retransmisiones incluidas
+        self.segments_retransmitted = 0
+        self.bytes_sent = 0
+        self.segments_received = 0
+        self.segments_ignored = 0 # fuera de la ventana de recepcion o de otra direccion
+        self.segments_buffered = 0 # llegaron fuera de orden y se guardaron (Selective Repeat)
+        self.acks_sent = 0
+        self.acks_received = 0
+        self.duplicate_acks_received = 0
+        self.timeouts = 0
+        self.fast_retransmits = 0
+        self.established = None # monotonic del fin del handshake, para los bytes por segundo
+        self.ended = None
+        # datos recibidos en orden que todavia no leyo recv, lo libre es la ventana que anunciamos
+        self.receive_buffer = ReceiveBuffer(self.MAX_WINDOW)
+        self.window_closed = False # el ultimo ACK anuncio menos de un segmento libre
+        self.on_data = None # si esta, recibe los datos en orden en lugar de receive_buffer
+        self.send_chunks = deque() # [seq_number inicial, memoryview, segmentos ya cortados o None] con datos a enviar o sin confirmar, con state.lock
+        self.send_end = 0 # seq_number siguiente al ultimo byte encolado para enviar
+        self.acked = Condition() # avisa a sendall cada vez que avanza el ack
+        self.on_acked = None # si esta, se llama cada vez que avanza el ack
+        self.on_fin = None # si esta, se llama al recibir el FIN del otro extremo
+        self.on_closed = None # si esta, se llama cuando el reactor libera la conexion
+        self.reactor = None # reactor que maneja la conexion en el servidor multiplexado
         self.process_incoming_thread = Thread(target=self._process_incoming)
         self.received_ack = 0
         self.connection_being_accepted = None
@@ -44,72 +100,352 @@ class SocketTP:
         self.close()
 
     def _process_syn(self, addr: str, packet: Packet):     
-        logger.debug(f'{addr} - {packet} - SYN RECEIVED')
+        if self.debug:
+            logger.debug(f'{addr} - {packet} - SYN RECEIVED')
         
         # SYN inicial sin ACK: cliente solicitando conexión
         if not packet.ack and addr != self.connection_being_accepted and self.connection_queue:
             try:
-                mode = parse_syn_payload(packet.data)
+                mode, congestion, ack_policy, compression, checksums = parse_syn_payload(packet.data)
             except ValueError as e:
                 logger.error(f"{addr} invalid mode: {e} - IGNORED")
                 return
 
-            logger.debug(f"Added {addr} mode: {mode.name}, to the connection queue")
-            self.connection_queue.put((addr, mode))
+            if self.debug:
+                logger.debug(f"Added {addr} mode: {mode.name}, congestion: {congestion.name}, ack: {ack_policy}, compression: {compression.name}, checksums: {checksums}, to the connection queue")
+            self.connection_queue.put((addr, mode, congestion, ack_policy, compression, checksums))
         elif packet.syn and packet.ack:
-            self.socket.sendto(Packet(ack=True).to_bytes(), addr)
+            self.ack_policy, self.compression, self.checksums = parse_syn_ack(packet.data)
+            self._send_frame(ACK_FRAME, addr)
             self.dest_addr = addr          
     
     def listen(self, maxsize: int = 0):
         validate_type("maxsize", maxsize, int)
         self.connection_queue = queue.Queue(maxsize=maxsize)
         self.process_incoming_thread.start()
-        self.timer_thread.start()
 
     def _process_ack(self, addr: str, packet: Packet):
-        logger.debug(f'{packet} - RECEIVED from {addr}')
-        if packet.seq_number > self.sequence.ack:
-            self.window.increase(packet.seq_number - self.sequence.ack)
-            self.sequence.ack = packet.seq_number
-            self.timer.update_estimated_round_trip_time()
-            self.timer.stop()
-
-    def _reset(self):
-        self.sequence.reset()
-        self.window.reset()
-        self.timer.stop()
-    
-    def _process_timer(self):
-        while not self.end_connection:
-            if self.timer.is_expired():
-                logger.debug('Time out: Packet Lost')
-                self._reset()
-            sleep(0.001)
+        if self.debug:
+            logger.debug(f'{packet} - RECEIVED from {addr}')
+        self.acks_received += 1
+        selective_repeat = self.mode == ErrorRecoveryMode.SELECTIVE_REPEAT
+        sample = None
+        if selective_repeat:
+            sack = packet.sack()
+            if sack is not None:
+                # el RTT se mide por segmento, solo sobre los que no se retransmitieron
+                sample = self.retransmission_queue.ack(sack)
+            self.retransmission_queue.ack_until(packet.seq_number)
+
+        state = self.state
+        advanced = False
+        fast_retransmit = False
+        probe = None
+        resized = None
+        sent = None
+        # todo el ACK (RTT, ventana, timer, segmentos confirmados y los siguientes envios) con el lock tomado una vez
+        with state.lock:
+            opened = packet.window > state.advertised
+            was_closed = state.advertised < self.PACKET_DATA_SIZE
+            state.advertised = packet.window
+            if sample is not None:
+                state.add_sample(sample)
+            if packet.seq_number > state.ack:
+                advanced = True
+                self.duplicate_acks = 0
+                if not selective_repeat:
+                    sample = state.end_sample(packet.seq_number)
+                old_size = state.available() if self.debug else 0
+                state.on_ack(packet.seq_number, sample)
+                state.stop_timer()
+                if self.debug:
+                    resized = (old_size, state.available())
+                while self.send_chunks and self.send_chunks[0][0] + len(self.send_chunks[0][1]) <= packet.seq_number:
+                    self.send_chunks.popleft()
+                # con lugar en la ventana mandamos los siguientes segmentos
+                sent = self._send_window()
+            elif opened and packet.seq_number == state.ack:
+                # el receptor libero lugar en su buffer (ver _window_update): no es un ACK duplicado.
+                # Lo que mandamos con la ventana cerrada (la sonda) lo descarto por falta de lugar,
+                # lo volvemos a mandar ya en lugar de esperar el timeout
+                if was_closed and state.send > state.ack:
+                    if selective_repeat:
+                        probe = state.ack
+                    else:
+                        state.rewind()
+                        state.stop_timer()
+                        state.cancel_sample()
+                sent = self._send_window()
+            elif (packet.seq_number == state.ack and state.send > packet.seq_number
+                    and packet.window >= self.PACKET_DATA_SIZE):
+                # el receptor sigue esperando el mismo byte: le llegaron segmentos posteriores a uno perdido
+                # (con la ventana cerrada descarta por falta de lugar, eso no es una perdida)
+                self.duplicate_acks += 1
+                self.duplicate_acks_received += 1
+                fast_retransmit = self.duplicate_acks == self.DUPLICATE_ACK_THRESHOLD
+
+        # se loguea afuera del lock, no lo demora para el timer ni para los otros threads
+        if resized:
+            logger.debug(f'Window size, from {resized[0]} to {resized[1]} - INCREASE')
+        self._log_sent(sent)
+        if advanced:
+            if self.trace:
+                self.trace.record(TraceEvent.ACK_RECEIVED, addr[1], packet.seq_number, 0, packet.window)
+            with self.acked:
+                self.acked.notify_all()
+            if self.on_acked:
+                self.on_acked()
+        elif self.duplicate_acks:
+            if self.trace:
+                self.trace.record(TraceEvent.DUPLICATE_ACK, addr[1], packet.seq_number, 0, packet.window)
+            if fast_retransmit:
+                self._fast_retransmit()
+        if probe is not None:
+            payload = self.retransmission_queue.retransmit(probe)
+            if payload is not None:
+                self._send_segment(probe, payload)
+
+    def _fast_retransmit(self):
+        # retransmitimos sin esperar el timeout, la perdida cuesta un RTT en lugar de un RTO
+        if self.end_connection:
+            return
+        state = self.state
+        ack = state.ack
+        if self.debug:
+            logger.debug(f'{self.duplicate_acks} duplicate ACKs: Packet {ack} Lost')
+        if self.trace:
+            self.trace.record(TraceEvent.FAST_RETRANSMIT, self.dest_addr[1], ack)
+        if self.mode == ErrorRecoveryMode.SELECTIVE_REPEAT:
+            payload = self.retransmission_queue.retransmit(ack)
+            if payload is None:
+                return
+            self.fast_retransmits += 1
+            with state.lock:
+                if ack >= self.recovery_point:
+                    state.controller.on_loss()
+                    self.recovery_point = state.send
+            self._send_segment(ack, payload)
+            return
+
+        with state.lock:
+            if ack < self.recovery_point:
+                # seguimos recuperando la perdida anterior, los duplicados son de lo que ya estaba en vuelo
+                return
+            self.fast_retransmits += 1
+            # Go-Back-N: el receptor descarto todo lo posterior, volvemos a mandar desde el ack
+            self.recovery_point = state.send
+            state.reset(timeout=False)
+            state.stop_timer()
+            state.cancel_sample()
+            sent = self._send_window()
+        self._log_sent(sent)
+
+    def _on_timeout(self):
+        # timer de Go-Back-N, corre en el thread del timer_service
+        if self.end_connection or self.mode == ErrorRecoveryMode.SELECTIVE_REPEAT:
+            return
+        logger.debug('Time out: Packet Lost')
+        self.timeouts += 1
+        state = self.state
+        if self.trace:
+            self.trace.record(TraceEvent.TIMEOUT, self.dest_addr[1], state.ack)
+        with state.lock:
+            state.on_timeout()
+            state.reset()
+            state.stop_timer()
+            sent = self._send_window()
+        self._log_sent(sent)
+
+    def _on_segment_timeout(self, seq_number: int, payload: memoryview):
+        # timer de un segmento en Selective Repeat, retransmitimos solo ese
+        if self.end_connection:
+            return
+        if self.debug:
+            logger.debug(f'Time out: Packet {seq_number} Lost')
+        self.timeouts += 1
+        if self.trace:
+            self.trace.record(TraceEvent.TIMEOUT, self.dest_addr[1], seq_number, len(payload))
+        state = self.state
+        with state.lock:
+            if seq_number >= self.recovery_point:
+                # una sola vez por ventana, si no una rafaga de perdidas multiplica el backoff
+                state.controller.on_timeout()
+                state.on_timeout()
+                self.recovery_point = state.send
+        self._send_segment(seq_number, payload)
+
+    def _process_data(self, addr: str, packet: Packet):
+        selective_repeat = self.mode == ErrorRecoveryMode.SELECTIVE_REPEAT
+        self.segments_received += 1
+        # solo se puede demorar el ACK de un segmento en orden que no completa un hueco
+        delay = False
+        stored = True
+        # si no entra en el buffer de recepcion se descarta como si se hubiera perdido:
+        # el ACK anuncia la ventana llena y el emisor lo vuelve a mandar
+        if packet.seq_number == self.received_ack and addr == self.dest_addr and self._deliver(packet):
+            if self.debug:
+                logger.debug(f'{addr} - {packet} - ACCEPTED')
+            if self.trace:
+                self.trace.record(TraceEvent.ACCEPTED, addr[1], packet.seq_number, len(packet.data))
+            self.received_ack = self.received_ack + len(packet.data)
+            delay = not self.out_of_order
+            # entregamos los segmentos que habian llegado antes de tiempo y ahora quedan en orden
+            while self.received_ack in self.out_of_order and self._deliver(self.out_of_order[self.received_ack]):
+                buffered = self.out_of_order.pop(self.received_ack)
+                self.received_ack = self.received_ack + len(buffered.data)
+        elif (selective_repeat and addr == self.dest_addr
+                and self.received_ack < packet.seq_number < self.received_ack + self._advertised_window()):
+            if self.debug:
+                logger.debug(f'{addr} - {packet} - BUFFERED expected: {self.received_ack}')
+            if self.trace:
+                self.trace.record(TraceEvent.BUFFERED, addr[1], packet.seq_number, len(packet.data))
+            self.out_of_order[packet.seq_number] = packet
+            self.segments_buffered += 1
+        else:
+            if self.debug:
+                logger.debug(f'{addr} - {packet} - IGNORED expected: {self.received_ack}')
+            if self.trace:
+                self.trace.record(TraceEvent.IGNORED, addr[1], packet.seq_number, len(packet.data))
+            self.segments_ignored += 1
+            # lo que no guardamos no se confirma en el SACK, el emisor lo tiene que volver a mandar
+            stored = packet.seq_number < self.received_ack
+
+        with self.ack_lock:
+            self.ack_pending += 1
+            if stored:
+                self.ack_sack = packet.seq_number
+            if delay and self.ack_policy.delayed and self.ack_pending < self.ack_policy.segments:
+                if not self.ack_timer:
+                    self.ack_timer = timer_service.schedule(self.ack_policy.timeout, self._on_ack_timeout, addr)
+                return
+            frame = self._ack_frame()
+        if self.trace:
+            self.trace.record(TraceEvent.ACK_SENT, addr[1], self.received_ack)
+        self._send_frame(frame, addr)
+
+    def _ack_frame(self) -> bytes:
+        # ACK acumulativo de todo lo recibido hasta ahora, se llama con ack_lock tomado
+        timer_service.cancel(self.ack_timer)
+        self.ack_timer = None
+        self.ack_pending = 0
+        self.acks_sent += 1
+        window = self._advertised_window()
+        self.window_closed = window < self.PACKET_DATA_SIZE
+        if self.mode == ErrorRecoveryMode.SELECTIVE_REPEAT:
+            return Packet.sack_frame(self.received_ack, self.ack_sack, window)
+        return Packet.ack_frame(self.received_ack, window)
+
+    def _on_ack_timeout(self, addr):
+        # vencio el ACK demorado, corre en el thread del timer_service
+        with self.ack_lock:
+            self.ack_timer = None
+            if not self.ack_pending or self.closed:
+                return
+            frame = self._ack_frame()
+        if self.trace:
+            self.trace.record(TraceEvent.ACK_SENT, addr[1], self.received_ack)
+        self.socket.sendto(frame, addr)
+
+    def _deliver(self, packet: Packet) -> bool:
+        # False si no hay lugar para los datos en el buffer de recepcion
+        if self.on_data:
+            self.on_data(packet.data)
+            return True
+        return self.receive_buffer.write(packet.data)
+
+    def _advertised_window(self) -> int:
+        # lugar libre en el buffer de recepcion (datos que todavia no leyo recv),
+        # sin pasar lo que el socket puede guardar de una rafaga
+        return min(self.receive_buffer.free, self.receive_window)
+
+    def _size_socket_buffers(self):
+        """
+        Pide buffers de socket donde entre una ventana entera: sendmmsg manda la ventana de
+        una rafaga y lo que no entra en el buffer del receptor el kernel lo descarta.
+        Si el sistema da menos (net.core.rmem_max), anunciamos solo la ventana que entra.
+        """
+        try:
+            self.socket.setsockopt(SOL_SOCKET, SO_SNDBUF, self.SOCKET_BUFFER_SIZE)
+            self.socket.setsockopt(SOL_SOCKET, SO_RCVBUF, self.SOCKET_BUFFER_SIZE)
+            granted = self.socket.getsockopt(SOL_SOCKET, SO_RCVBUF)
+        except OSError as e:
+            logger.debug(f"Could not size the socket buffers: {e}")
+            return
+        fits = granted // self.DATAGRAM_BUFFER_COST * self.PACKET_DATA_SIZE
+        self.receive_window = max(self.PACKET_DATA_SIZE, min(self.MAX_WINDOW, fits))
+
+    def _window_update(self):
+        """
+        Lo llama el lector despues de sacar datos del buffer de recepcion. Si el ultimo
+        ACK anuncio la ventana cerrada, el emisor solo manda un segmento de sonda por
+        timeout: apenas se libera un cuarto del buffer le mandamos un ACK con la ventana nueva.
+        """
+        if not self.window_closed or self.receive_buffer.free < self.receive_buffer.capacity // 4:
+            return
+        with self.ack_lock:
+            if not self.window_closed or self.closed:
+                return
+            frame = self._ack_frame()
+        if self.trace:
+            self.trace.record(TraceEvent.ACK_SENT, self.dest_addr[1], self.received_ack)
+        self.socket.sendto(frame, self.dest_addr)
         
     def _process_incoming(self):
         self.socket.settimeout(self.SOCKET_TIMEOUT)
 
         while not self.end_connection:
+            # esperamos el primer datagrama y despues leemos todos los que haya con una sola syscall
             try:
-                data, addr = self.socket.recvfrom(self.PACKET_DATA_SIZE + Packet.HEADER_SIZE) # el tamanio maximo de datos mas los flags
-                packet = Packet.from_bytes(data)
-                if packet.syn:
-                    self._process_syn(addr, packet)
-                elif packet.fin:
-                    self._process_fin()
-                elif packet.ack and addr == self.dest_addr:
-                    self._process_ack(addr, packet)
-                else:
-                    if packet.seq_number == self.received_ack and addr == self.dest_addr:
-                        logger.debug(f'{addr} - {packet} - ACCEPTED')
-                        self.received_ack = self.received_ack + len(packet.data)
-                        self.packet_queue.put(packet)
-                    else:
-                        logger.debug(f'{addr} - {packet} - IGNORED expected: {self.received_ack}')
+                if not self.batch_io.wait_readable(self.socket, self.SOCKET_TIMEOUT):
+                    continue
+                datagrams = self.batch_io.recv(self.socket)
+            except OSError as e:
+                # el socket se cerro o no se puede leer mas: volver a intentar solo gira en vacio
+                if not self.end_connection:
+                    logger.error(f"{self.dest_addr} - error receiving: {e}")
+                break
 
-                    self.socket.sendto(Packet(ack=True, seq_number=self.received_ack).to_bytes(), addr)
-            except Exception:
-                pass
+            self.outbox = []
+            for data, addr in datagrams:
+                try:
+                    packet = Packet.from_bytes(data)
+                except struct.error:
+                    # datagrama mas corto que el header, no es nuestro
+                    continue
+                try:
+                    self._process_packet(addr, packet)
+                except Exception as e:
+                    logger.error(f"{addr} - error processing packet: {e}")
+            self._flush_outbox()
+
+    def _send_frame(self, frame: bytes, addr):
+        if self.outbox is not None:
+            self.outbox.append((addr, frame, b''))
+        else:
+            self.socket.sendto(frame, addr)
+
+    def _flush_outbox(self):
+        outbox, self.outbox = self.outbox, None
+        if outbox:
+            self.batch_io.send(self.socket, outbox)
+
+    def _process_packet(self, addr: str, packet: Packet):
+        if packet.checksum is not None and not packet.valid():
+            # llego corrupto: lo descartamos como si se hubiera perdido, el emisor lo retransmite
+            self.checksum_errors += 1
+            if self.debug:
+                logger.debug(f'{addr} - {packet} - CHECKSUM ERROR')
+            if self.trace:
+                self.trace.record(TraceEvent.CHECKSUM_ERROR, addr[1], packet.seq_number, len(packet.data))
+            return
+        if packet.syn:
+            self._process_syn(addr, packet)
+        elif packet.fin:
+            self._process_fin()
+        elif packet.ack and addr == self.dest_addr:
+            self._process_ack(addr, packet)
+        else:
+            self._process_data(addr, packet)
 
     def bind(self, host: str, port: int):
         validate_type("host", host, str)
@@ -120,10 +456,14 @@ class SocketTP:
     def get_incomming_connection(self):
         addr = None
         mode = None
+        congestion = None
+        ack_policy = None
+        compression = None
+        checksums = False
         
         while not self.end_connection and not addr:
             try:
-                addr, mode = self.connection_queue.get(timeout=2)
+                addr, mode, congestion, ack_policy, compression, checksums = self.connection_queue.get(timeout=2)
             except:
                 # intentamos tomar una conexion entrante,
                 # si en 2 segundos no aparecio ninguna chequeamos si se cerro el socket,
@@ -134,13 +474,10 @@ class SocketTP:
         if self.end_connection:
             raise Exception("Socket Closed")
         
-        return addr, mode
+        return addr, mode, congestion, ack_policy.negotiate(mode), negotiate_compression(compression), checksums
 
     def accept(self) -> 'SocketTP':
-        addr = None
-        mode = None
-        
-        addr, mode = self.get_incomming_connection()
+        addr, mode, congestion, ack_policy, compression, checksums = self.get_incomming_connection()
         
         self.connection_being_accepted = addr
         
@@ -148,18 +485,19 @@ class SocketTP:
         socket_connection.bind((self.host, 0))
         socket_connection.settimeout(self.SOCKET_TIMEOUT)
         
-        time_limit = datetime.now() + timedelta(seconds=self.CONNECTION_TIMEOUT)
+        time_limit = monotonic() + self.CONNECTION_TIMEOUT
         while self.connection_being_accepted:
-            if datetime.now() > time_limit:
+            if monotonic() > time_limit:
                 # si hay timeout buscamos otra conexion entrante
-                addr, mode = self.get_incomming_connection()
+                addr, mode, congestion, ack_policy, compression, checksums = self.get_incomming_connection()
                 self.connection_being_accepted = addr
-                time_limit = datetime.now() + timedelta(seconds=self.CONNECTION_TIMEOUT)
+                time_limit = monotonic() + self.CONNECTION_TIMEOUT
             try:
-                socket_connection.sendto(Packet(syn=True, ack=True).to_bytes(), addr)
+                socket_connection.sendto(build_syn_ack(ack_policy, compression, checksums), addr)
                 data, recv_addr = socket_connection.recvfrom(self.PACKET_DATA_SIZE)
                 packet = Packet.from_bytes(data)
-                logger.debug(f'{addr} - {packet}')
+                if self.debug:
+                    logger.debug(f'{addr} - {packet}')
                 if recv_addr == addr and packet.ack:
                     self.connection_being_accepted = None
             except:
@@ -167,129 +505,316 @@ class SocketTP:
                 # seguimos esperando hasta el timeout antes de descartarla y buscar otra
                 pass
         
+        # el cliente sigue en el socket nuevo, el listener ya no lo va a ver
+        self.batch_io.forget(addr)
         new_socket = SocketTP()
 
+        new_socket.socket.close()
         new_socket.socket = socket_connection
+        new_socket._size_socket_buffers()
         new_socket.dest_addr = addr
-        new_socket._set_error_recovery_mode(mode)
+        new_socket._set_error_recovery_mode(mode, congestion)
+        new_socket.ack_policy = ack_policy
+        new_socket.compression = compression
+        new_socket.checksums = checksums
+        new_socket.established = monotonic()
         new_socket.process_incoming_thread.start()
-        new_socket.timer_thread.start()
 
-        logger.debug(f"Connection established successfully with {addr} mode: {mode.name}")
+        logger.debug(f"Connection established successfully with {addr} mode: {mode.name}, ack: {ack_policy}, compression: {compression.name}, checksums: {checksums}")
 
         return new_socket
 
-    def connect(self, host: str, port: int, mode: ErrorRecoveryMode = ErrorRecoveryMode.GO_BACK_N):
+    def connect(self, host: str, port: int, mode: ErrorRecoveryMode = ErrorRecoveryMode.GO_BACK_N, congestion: CongestionControl = CongestionControl.AIMD, ack_policy: AckPolicy = None,
+                compression: Compression = Compression.NONE, checksums: bool = False):
         validate_type("host", host, str)
         validate_type("port", port, int)
         validate_type("mode", mode, ErrorRecoveryMode)
+        validate_type("congestion", congestion, CongestionControl)
+        ack_policy = ack_policy or AckPolicy()
+        validate_type("ack_policy", ack_policy, AckPolicy)
+        validate_type("compression", compression, Compression)
+        validate_type("checksums", checksums, bool)
+        # si aca no hay lzma ni la pedimos, el servidor contesta la que se usa
+        compression = negotiate_compression(compression)
     
         logger.debug(f"Attempting to establish a connection with {host}:{port}")
         
+        self._set_error_recovery_mode(mode, congestion)
         self.process_incoming_thread.start()
-        self.timer_thread.start()
         
-        time_limit = datetime.now() + timedelta(seconds=self.CONNECTION_TIMEOUT)
+        time_limit = monotonic() + self.CONNECTION_TIMEOUT
         while not self.dest_addr:
-            if datetime.now() > time_limit:
+            if monotonic() > time_limit:
                 raise Exception("TIME OUT")
 
             self.socket.sendto(
-                Packet(syn=True, data=build_syn_payload(mode)).to_bytes(),
+                Packet(syn=True, data=build_syn_payload(mode, congestion, ack_policy, compression, checksums)).to_bytes(),
                 (host, port)
             )
             sleep(self.SOCKET_TIMEOUT)
-        
-        self._set_error_recovery_mode(mode)
-
-        logger.debug(f"Connection established successfully with {host}:{port}")
-
-    def sendall(self, data: bytes):
-        validate_type("data", data, bytes)
-        offset = self.sequence.send
-        sequence = self.sequence.send
-        fin = False
-        time_limit = datetime.now() + timedelta(seconds=self.CONNECTION_TIMEOUT)
-        last_ack = None
-        while not fin and not self.end_connection:
-            if datetime.now() > time_limit:
-                raise Exception("TIME OUT")
-            start = sequence - offset
-            end = start + min(self.PACKET_DATA_SIZE, self.window.size, len(data[start:]))
-            if data[start: end]:
-                if not self.timer.is_set():
-                    self.timer.set()
-
-                packet = Packet(data=data[start: end], seq_number=sequence)
-                self.socket.sendto(packet.to_bytes(), self.dest_addr)
-                
-                logger.debug(f'{self.dest_addr} - {packet} - SENT')
-                
-                self.window.decrease(len(data[start: end]))
+        self.established = monotonic()
+
+        logger.debug(f"Connection established successfully with {host}:{port} ack: {self.ack_policy}, compression: {self.compression.name}, checksums: {self.checksums}")
+
+    def _send_segment(self, seq_number: int, payload: memoryview):
+        # header y payload van por separado (scatter/gather), el payload no se copia en user space
+        try:
+            if self.checksums:
+                header = Packet.CHECKSUM_DATA_HEADER.pack(*Packet.checksum_fields(seq_number, payload))
             else:
-                if not self.timer.is_set():
-                    self.timer.set()
-                with self.window.empty_window: # esperamos hasta q tengamos lugar en la ventana
-                    self.window.empty_window.wait(timeout=self.timer.estimated_round_trip_time)
-            
-            with self.sequence.lock:
-                if sequence > self.sequence._send:
-                    sequence = self.sequence._send
-                else:
-                    self.sequence._send = offset + end 
-                    sequence = offset + end
-                if last_ack != self.sequence._ack:
-                    # Si no cambio el ack por CONNECTION_TIMEOUT segundos asumimos q murio el receiver
-                    time_limit = datetime.now() + timedelta(seconds=self.CONNECTION_TIMEOUT)
-                    last_ack = self.sequence._ack
-                fin = len(data) == self.sequence._ack - offset
+                header = Packet.header(seq_number=seq_number)
+            self.socket.sendmsg([header, payload], [], 0, self.dest_addr)
+            # solo se llama para retransmitir un segmento (Selective Repeat)
+            self.segments_sent += 1
+            self.segments_retransmitted += 1
+            self.bytes_sent += len(payload)
+            if self.trace:
+                self.trace.record(TraceEvent.RETRANSMITTED, self.dest_addr[1], seq_number, len(payload))
+        except BlockingIOError:
+            # socket no bloqueante (reactor, asyncio) con el buffer lleno: es una perdida mas, la recupera el timer
+            if self.debug:
+                logger.debug(f'{self.dest_addr} - Packet(seq_number={seq_number}) - DROPPED, socket buffer full')
+
+    def _segment_at(self, seq_number: int) -> memoryview:
+        # los segmentos nunca cruzan de un chunk al siguiente, igual que antes entre llamadas a sendall
+        for start, view, segments in self.send_chunks:
+            if start <= seq_number < start + len(view):
+                offset = seq_number - start
+                if segments:
+                    index, rest = divmod(offset, self.PACKET_DATA_SIZE)
+                    # despues de un retroceso a mitad de segmento (o al final del chunk) se corta como siempre
+                    if not rest and index < len(segments) and offset + len(segments[index]) <= len(view):
+                        return segments[index]
+                return view[offset: offset + self.PACKET_DATA_SIZE]
+        return None
+
+    def _pump(self):
+        """
+        Manda todos los segmentos pendientes que entran en la ventana. Se llama al encolar
+        datos y despues de un timeout, desde el thread que corresponda; al llegar un ACK
+        se manda desde _process_ack con el lock ya tomado.
+        """
+        with self.state.lock:
+            sent = self._send_window()
+        self._log_sent(sent)
+
+    def _send_window(self) -> list:
+        # se llama con state.lock tomado, que tambien protege send_chunks. Con debug devuelve
+        # (seq_number, largo, ventana) de cada segmento que mando, para loguearlos sin el lock
+        state = self.state
+        selective_repeat = self.mode == ErrorRecoveryMode.SELECTIVE_REPEAT
+        checksums = self.checksums
+        debug = self.debug
+        trace = self.trace
+        batch = []
+        sent = [] if debug else None
+        while not self.end_connection:
+            sequence = state.send
+            segment = self._segment_at(sequence)
+            # no mandamos segmentos mas chicos de lo necesario, esperamos a tener lugar para uno entero
+            if segment is None or state.available() < len(segment):
+                break
+
+            if not selective_repeat and state.deadline is None:
+                state.set_timer()
+
+            # registramos el segmento antes de mandarlo, el ACK puede llegar antes de que sendmmsg retorne
+            retransmitted = sequence < state.send_high
+            if selective_repeat:
+                self.retransmission_queue.add(sequence, segment, state.timeout_interval())
+            elif not retransmitted:
+                # Karn: el RTT solo se mide sobre segmentos que salen por primera vez
+                state.start_sample(sequence + len(segment))
+            state.on_sent(sequence, len(segment))
+            if retransmitted:
+                self.segments_retransmitted += 1
+            self.segments_sent += 1
+            self.bytes_sent += len(segment)
+            batch.append((Packet.checksum_fields(sequence, segment) if checksums else (sequence,), segment))
+            if debug:
+                sent.append((sequence, len(segment), state.available()))
+            if trace:
+                trace.record(TraceEvent.RETRANSMITTED if retransmitted else TraceEvent.SENT, self.dest_addr[1], sequence, len(segment), state.available())
+
+        # todo lo que entro en la ventana sale en un solo sendmmsg, con los headers escritos en su lugar
+        if batch:
+            header = Packet.CHECKSUM_DATA_HEADER if checksums else Packet.DATA_HEADER
+            self.batch_io.send_segments(self.socket, self.dest_addr, header, batch)
+
+        # mientras haya segmentos sin confirmar el timer tiene que estar corriendo
+        if not selective_repeat and state.send > state.ack and state.deadline is None:
+            state.set_timer()
+        return sent
+
+    def _log_sent(self, sent: list):
+        # lo que devolvio _send_window, ya sin el lock
+        if not sent:
+            return
+        for sequence, length, window in sent:
+            logger.debug(f'{self.dest_addr} - Packet(seq_number={sequence}, datasize={length}) - SENT, window: {window}')
+
+    def send(self, data: bytes, segments: list = None) -> int:
+        """
+        Encola data para enviar y vuelve sin esperar los ACK. data no se copia,
+        no se puede modificar hasta que unacked_bytes() indique que se confirmo.
+        segments es opcional: data ya cortada en memoryviews de PACKET_DATA_SIZE desde
+        su principio (la cache del servidor los arma una vez por archivo), asi no se
+        vuelve a cortar en cada envio.
+        Devuelve el seq_number siguiente al ultimo byte encolado.
+        """
+        validate_type("data", data, (bytes, bytearray, memoryview))
+        view = memoryview(data).cast("B")
+        if view:
+            with self.state.lock:
+                self.send_chunks.append((self.send_end, view, segments))
+                self.send_end += len(view)
+        self._pump()
+        return self.send_end
+
+    def unacked_bytes(self) -> int:
+        return self.send_end - self.state.ack
+
+    def sendall(self, data: bytes, segments: list = None):
+        end = self.send(data, segments)
+        time_limit = monotonic() + self.CONNECTION_TIMEOUT
+        last_ack = self.state.ack
+        while last_ack < end and not self.end_connection:
+            if monotonic() > time_limit:
+                raise Exception("TIME OUT")
+            with self.acked:
+                # _process_ack avisa con acked tomado: si el ack avanzo antes de esperar lo vemos aca
+                if self.state.ack == last_ack:
+                    self.acked.wait(timeout=self.SOCKET_TIMEOUT)
+            if last_ack != self.state.ack:
+                # Si no cambio el ack por CONNECTION_TIMEOUT segundos asumimos q murio el receiver
+                time_limit = monotonic() + self.CONNECTION_TIMEOUT
+                last_ack = self.state.ack
     
     def recv(self, size: int) -> bytes:
         validate_type("size", size, int)
-        buffer = b''
-        started = datetime.now()
-        while not self.end_connection:
-            try:
-                packet = self.packet_queue.get(timeout=self.CONNECTION_TIMEOUT)
-            except queue.Empty:
+        buffer = bytearray(size)
+        self.recv_into(buffer)
+        return bytes(buffer)
+
+    def recv_chunk(self) -> memoryview:
+        """
+        Devuelve todos los datos recibidos en orden que todavia no se leyeron, esperando
+        a que llegue alguno. Para cuando no se sabe cuantos bytes esperar.
+        """
+        receive_buffer = self.receive_buffer
+        while not receive_buffer.size:
+            if self.end_connection:
+                raise Exception("CONNECTION CLOSED")
+            if not receive_buffer.wait(1, self.CONNECTION_TIMEOUT):
                 raise Exception("TIME OUT")
-            
-            buffer += packet.data
-            if len(buffer) == size:
-                logger.debug(f"Downloaded in {(datetime.now() - started).seconds / 60} minutes")
-                return buffer
-        raise Exception("CONNECTION CLOSED")   
-
-    def _set_error_recovery_mode(self, mode: ErrorRecoveryMode):
-        new_window_size = self.GO_BACK_N_WINDOW
-
-        if mode == ErrorRecoveryMode.STOP_AND_WAIT:
-            # mandamos un solo paquete y esperamos ack
-            new_window_size = self.PACKET_DATA_SIZE 
-        
-        self.window.reset(new_window_size)
+        chunk = receive_buffer.read()
+        self._window_update()
+        return memoryview(chunk)
+
+    def recv_into(self, buffer) -> int:
+        """
+        Llena buffer (bytearray, memoryview, etc.) con los proximos len(buffer) bytes
+        recibidos. Los saca del buffer de recepcion de a pedazos grandes: espera a que
+        haya lo que falta (o medio buffer) en lugar de despertarse por cada segmento.
+        Devuelve la cantidad de bytes escritos.
+        """
+        view = memoryview(buffer).cast("B")
+        size = len(view)
+        started = monotonic()
+        receive_buffer = self.receive_buffer
+
+        filled = 0
+        while filled < size:
+            length = receive_buffer.read_into(view[filled:])
+            if length:
+                filled += length
+                self._window_update()
+                continue
+            if self.end_connection:
+                raise Exception("CONNECTION CLOSED")
+            wanted = min(size - filled, receive_buffer.capacity // 2)
+            if not receive_buffer.wait(wanted, self.CONNECTION_TIMEOUT) and not receive_buffer.size:
+                raise Exception("TIME OUT")
+        if self.debug:
+            logger.debug(f"Downloaded in {(monotonic() - started) / 60} minutes")
+        return filled
+
+    def stats(self) -> dict:
+        """
+        Contadores de la conexion desde el handshake. Los de envio y recepcion son de
+        esta punta: en una descarga el servidor manda y el cliente recibe. Los bytes por
+        segundo son los confirmados por el otro extremo (envio) y los entregados en
+        orden (recepcion) sobre la duracion de la conexion.
+        """
+        cwnd, advertised, in_flight = self.state.snapshot()
+        duration = (self.ended or monotonic()) - self.established if self.established else 0
+        bytes_acked = self.state.ack
+        return {
+            "mode": self.mode.name if self.mode else None,
+            "ack_policy": str(self.ack_policy),
+            "compression": self.compression.name,
+            "duration": round(duration, 6),
+            "segments_sent": self.segments_sent,
+            "segments_retransmitted": self.segments_retransmitted,
+            "bytes_sent": self.bytes_sent,
+            "bytes_acked": bytes_acked,
+            "segments_received": self.segments_received,
+            "segments_ignored": self.segments_ignored,
+            "segments_buffered": self.segments_buffered,
+            "bytes_received": self.received_ack,
+            "checksum_errors": self.checksum_errors,
+            "acks_sent": self.acks_sent,
+            "acks_received": self.acks_received,
+            "duplicate_acks": self.duplicate_acks_received,
+            "timeouts": self.timeouts,
+            "fast_retransmits": self.fast_retransmits,
+            "rtt": round(self.state.estimated_round_trip_time, 6),
+            "rttvar": round(self.state.dev_round_trip_time, 6),
+            "rto": round(self.state.timeout_interval(), 6),
+            "cwnd": cwnd,
+            "advertised_window": advertised,
+            "in_flight": in_flight,
+            # parte de la ventana usable (la menor entre congestion y receptor) que esta en vuelo
+            "window_occupancy": round(in_flight / max(min(cwnd, advertised), self.PACKET_DATA_SIZE), 4),
+            "send_bytes_per_sec": round(bytes_acked / duration) if duration else 0,
+            "recv_bytes_per_sec": round(self.received_ack / duration) if duration else 0,
+        }
+
+    def _set_error_recovery_mode(self, mode: ErrorRecoveryMode, congestion: CongestionControl = CongestionControl.AIMD):
+        self.mode = mode
+        self.congestion = congestion
+        controller = build_window_controller(mode, congestion, self.PACKET_DATA_SIZE, self.GO_BACK_N_WINDOW, self.MAX_WINDOW)
+        with self.state.lock:
+            self.state.set_controller(controller)
 
 
     def close(self):
+        if self.reactor:
+            # el socket es compartido, el cierre lo hace el reactor sin bloquear
+            self.reactor.close_connection(self)
+            return
+
         sleep(1) # en caso q falte el ack de algo
         
         if self.closed:
             return    
         self.closed = True
         self.end_connection = True
+        self.ended = monotonic()
+        self.receive_buffer.close()
         self.process_incoming_thread.join()
-        self.timer_thread.join()  
+        self.state.close()
+        self.retransmission_queue.clear()
         if self.dest_addr:
-            t = max(self.timer.estimated_round_trip_time * 2 , 0.2)
-            time_delta = timedelta(seconds = t)
+            t = max(self.state.estimated_round_trip_time * 2, 0.2)
             self.socket.settimeout(t)
-            time_limit = datetime.now()
+            time_limit = monotonic()
             fin_acked = False
             for _ in range(self.CLOSING_LOOP_LIMIT):
-                if not fin_acked and datetime.now() > time_limit:
-                    self.socket.sendto(Packet(fin=True).to_bytes(), self.dest_addr)
+                if not fin_acked and monotonic() > time_limit:
+                    self.socket.sendto(FIN_FRAME, self.dest_addr)
                     logger.debug(f"{self.dest_addr} - FIN - SENT")  
-                    time_limit = datetime.now() + time_delta
+                    time_limit = monotonic() + t
                 try:
                     data, _ = self.socket.recvfrom(self.PACKET_DATA_SIZE)
                     packet = Packet.from_bytes(data)
@@ -304,10 +829,8 @@ class SocketTP:
                     continue
             
             self.socket.settimeout(0.02)
-            time_wait = t * self.TIME_WAIT_FACTOR
-            time_delta = timedelta(seconds=time_wait)
-            time_limit = datetime.now() + time_delta
-            while time_limit > datetime.now(): #TIME WAIT para packetes tardios
+            time_limit = monotonic() + t * self.TIME_WAIT_FACTOR
+            while time_limit > monotonic(): #TIME WAIT para packetes tardios
                 try:
                     data, _ = self.socket.recvfrom(self.PACKET_DATA_SIZE)
                     packet = Packet.from_bytes(data)
@@ -320,6 +843,8 @@ class SocketTP:
     def _process_fin(self):
         self.fin_received = True
         logger.debug(f"{self.dest_addr} - FIN - RECEIVED") 
-        self.socket.sendto(Packet(ack=True).to_bytes(), self.dest_addr)
+        self._send_frame(ACK_FRAME, self.dest_addr)
         logger.debug(f"{self.dest_addr} - ACK - SENT")
+        if self.on_fin:
+            self.on_fin()
 
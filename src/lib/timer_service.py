@@ -0,0 +1,87 @@
+import heapq
+import itertools
+import logging
+from threading import Thread, Condition
+from time import monotonic
+
+logger = logging.getLogger("socket")
+
+
+class TimerHandle:
+    __slots__ = ("deadline", "callback", "args", "cancelled")
+
+    def __init__(self, deadline: float, callback, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerService:
+    """
+    Un solo thread para los timers de todos los sockets. Los vencimientos se guardan
+    en un heap y el thread duerme hasta el proximo, no hace polling.
+    Los callbacks corren en el thread del servicio, tienen que ser cortos.
+    """
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count() # desempata timers con el mismo vencimiento
+        self._cancelled = 0
+        self._condition = Condition()
+        self._thread = None
+
+    def schedule(self, delay: float, callback, *args) -> TimerHandle:
+        handle = TimerHandle(monotonic() + delay, callback, args)
+        with self._condition:
+            if not self._thread:
+                self._thread = Thread(target=self._run, name="timer-service", daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (handle.deadline, next(self._counter), handle))
+            # solo despertamos al thread si este timer vence antes que el que estaba esperando
+            if self._heap[0][2] is handle:
+                self._condition.notify()
+        return handle
+
+    def cancel(self, handle: TimerHandle):
+        if not handle or handle.cancelled:
+            return
+        with self._condition:
+            handle.cancelled = True
+            self._cancelled += 1
+            # los cancelados se sacan del heap de forma perezosa, si son mayoria lo reconstruimos
+            if self._cancelled > len(self._heap) // 2:
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def pending(self) -> int:
+        with self._condition:
+            return len(self._heap) - self._cancelled
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    deadline, _, handle = self._heap[0]
+                    if handle.cancelled:
+                        heapq.heappop(self._heap)
+                        self._cancelled -= 1
+                        continue
+                    delay = deadline - monotonic()
+                    if delay > 0:
+                        self._condition.wait(delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    # marcado como cancelado para que cancel() despues de vencer no haga nada
+                    handle.cancelled = True
+                    break
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                logger.error(f"Timer callback failed: {e}")
+
+
+timer_service = TimerService()
@@ -1,7 +1,13 @@
+import struct
+import zlib
+from collections import OrderedDict
 from typing import Any
-from threading import Lock, Condition
-from datetime import datetime, timedelta
-from .constants import ErrorRecoveryMode
+from threading import Lock
+from time import monotonic_ns
+from .constants import ErrorRecoveryMode, CongestionControl, Compression
+from .ack_policy import AckPolicy
+from .timer_service import timer_service
+from .congestion import WindowController
 from typing import Any, Tuple
 import logging
 
@@ -13,157 +19,400 @@ def validate_type(name: str, value: Any, type_to_validate: type):
         raise ValueError(f"{name} should be of type {type_to_validate}")
 
 
-def build_syn_payload(mode: ErrorRecoveryMode) -> bytes:
+def build_syn_payload(mode: ErrorRecoveryMode, congestion: CongestionControl = CongestionControl.AIMD, ack_policy: AckPolicy = None,
+                      compression: Compression = Compression.NONE, checksums: bool = False) -> bytes:
     """
     Formato:
       - 4 bytes: mode (big-endian uint32)
+      - 4 bytes: congestion control (big-endian uint32)
+      - 4 bytes: politica de ACK propuesta (AckPolicy.FORMAT)
+      - 1 byte: compresion propuesta para las transferencias
+      - 1 byte: 1 si los segmentos de datos y los archivos llevan checksum
     """
-    return mode.value.to_bytes(4, "big")
+    return (mode.value.to_bytes(4, "big") + congestion.value.to_bytes(4, "big") + (ack_policy or AckPolicy()).to_bytes()
+            + compression.value.to_bytes(1, "big") + bytes([checksums]))
 
 
-def parse_syn_payload(data: bytes) -> Tuple[ErrorRecoveryMode]:
+def parse_syn_payload(data: bytes) -> Tuple[ErrorRecoveryMode, CongestionControl, AckPolicy, Compression, bool]:
     """
     Parsea el payload del SYN.
     Formato:
       - 4 bytes: mode (big-endian uint32)
+      - 4 bytes: congestion control (big-endian uint32), opcional, AIMD si no esta
+      - 4 bytes: politica de ACK, opcional, un ACK por segmento si no esta
+      - 1 byte: compresion, opcional, sin compresion si no esta
+      - 1 byte: checksums, opcional, sin checksums si no esta
     """
     if len(data) < 4:
         raise ValueError("syn payload too short")
     
     mode_val = int.from_bytes(data[:4], "big")
-    return ErrorRecoveryMode(mode_val)
+    congestion = CongestionControl.AIMD
+    if len(data) >= 8:
+        congestion = CongestionControl(int.from_bytes(data[4:8], "big"))
+    ack_policy = AckPolicy()
+    if len(data) >= 8 + AckPolicy.FORMAT.size:
+        ack_policy = AckPolicy.from_bytes(data[8:])
+    compression = Compression.NONE
+    options = 8 + AckPolicy.FORMAT.size
+    if len(data) > options:
+        compression = Compression(data[options])
+    checksums = len(data) > options + 1 and bool(data[options + 1])
+    return ErrorRecoveryMode(mode_val), congestion, ack_policy, compression, checksums
+
+
+def build_syn_ack(ack_policy: AckPolicy, compression: Compression = Compression.NONE, checksums: bool = False) -> bytes:
+    # el SYN-ACK lleva la politica de ACK, la compresion y los checksums que acepto el servidor
+    data = ack_policy.to_bytes() + compression.value.to_bytes(1, "big") + bytes([checksums])
+    return Packet(syn=True, ack=True, data=data).to_bytes()
+
+
+def parse_syn_ack(data: bytes) -> Tuple[AckPolicy, Compression, bool]:
+    # un servidor que no negocia la politica de ACK contesta sin payload: un ACK por segmento,
+    # y uno que no negocia la compresion o los checksums no manda esos bytes
+    options = AckPolicy.FORMAT.size
+    ack_policy = AckPolicy.from_bytes(data) if len(data) >= options else AckPolicy()
+    compression = Compression(data[options]) if len(data) > options else Compression.NONE
+    checksums = len(data) > options + 1 and bool(data[options + 1])
+    return ack_policy, compression, checksums
 
 
 class Packet:
-    HEADER_SIZE = 7
+    """
+    Formato del header:
+      - 8 bytes: seq_number (big-endian uint64)
+      - 1 byte: flags (bit 0 ACK, bit 1 SYN, bit 2 FIN, bit 3 CHECKSUM)
+      - 4 bytes: window (big-endian uint32), en los ACK los bytes libres del receptor
+      - 4 bytes: solo con CHECKSUM, CRC32 del seq_number y el payload (big-endian uint32)
 
-    def __init__(self, data: bytes = b'', seq_number: int = 0, ack: bool = False, syn: bool = False, fin: bool = False):
+    En Selective Repeat los ACK llevan como payload el seq_number
+    del segmento que se esta confirmando (SACK, big-endian uint64).
+    """
+    __slots__ = ("data", "seq_number", "flags", "window", "checksum")
+
+    ACK = 0x01
+    SYN = 0x02
+    FIN = 0x04
+    CHECKSUM = 0x08
+    HEADER = struct.Struct("!QBI")
+    HEADER_SIZE = HEADER.size
+    DATA_HEADER = struct.Struct("!Q5x") # segmento de datos: solo el seq_number, flags y window en 0
+    CHECKSUM_DATA_HEADER = struct.Struct("!QB4xI") # segmento de datos con CHECKSUM: seq_number, flags y el CRC32
+    CHECKSUM_FIELD = struct.Struct("!I")
+    MAX_HEADER_SIZE = HEADER_SIZE + CHECKSUM_FIELD.size # para dimensionar los buffers de recepcion
+    SACK = struct.Struct("!Q")
+
+    def __init__(self, data: bytes = b'', seq_number: int = 0, ack: bool = False, syn: bool = False, fin: bool = False, window: int = 0):
         self.data = data
         self.seq_number = seq_number
-        self.ack = ack
-        self.syn = syn
-        self.fin = fin
-    
+        self.flags = (Packet.ACK if ack else 0) | (Packet.SYN if syn else 0) | (Packet.FIN if fin else 0)
+        self.window = window
+        self.checksum = None
+
+    @property
+    def ack(self) -> bool:
+        return bool(self.flags & Packet.ACK)
+
+    @property
+    def syn(self) -> bool:
+        return bool(self.flags & Packet.SYN)
+
+    @property
+    def fin(self) -> bool:
+        return bool(self.flags & Packet.FIN)
+
+    @staticmethod
+    def header(seq_number: int = 0, ack: bool = False, syn: bool = False, fin: bool = False, window: int = 0) -> bytes:
+        return Packet.HEADER.pack(seq_number, (Packet.ACK if ack else 0) | (Packet.SYN if syn else 0) | (Packet.FIN if fin else 0), window)
+
+    @staticmethod
+    def ack_frame(seq_number: int, window: int = 0) -> bytes:
+        # ACK sin payload, evita crear un Packet por cada segmento recibido
+        return Packet.HEADER.pack(seq_number, Packet.ACK, window)
+
+    @staticmethod
+    def sack_frame(seq_number: int, sack: int, window: int = 0) -> bytes:
+        # ACK acumulativo hasta seq_number que ademas confirma el segmento sack
+        return Packet.HEADER.pack(seq_number, Packet.ACK, window) + Packet.SACK.pack(sack)
+
+    @staticmethod
+    def checksum_of(seq_number: int, payload) -> int:
+        # el seq_number entra en el CRC: un header corrupto pondria datos buenos en otro lugar
+        return zlib.crc32(payload, zlib.crc32(Packet.SACK.pack(seq_number)))
+
+    @staticmethod
+    def checksum_fields(seq_number: int, payload) -> tuple:
+        # campos de CHECKSUM_DATA_HEADER para BatchIO.send_segments
+        return seq_number, Packet.CHECKSUM, Packet.checksum_of(seq_number, payload)
+
+    def valid(self) -> bool:
+        return self.checksum is None or self.checksum == Packet.checksum_of(self.seq_number, self.data)
+
+    def sack(self) -> int:
+        if len(self.data) < Packet.SACK.size:
+            return None
+        return Packet.SACK.unpack_from(self.data)[0]
+
     def to_bytes(self) -> bytes:
-        return self.seq_number.to_bytes(4, "big") + self.ack.to_bytes(1, "big") + self.syn.to_bytes(1, "big") + self.fin.to_bytes(1, "big") + self.data
+        return Packet.HEADER.pack(self.seq_number, self.flags, self.window) + self.data
     
     @staticmethod
     def from_bytes(data: bytes) -> 'Packet':
-        seq_number = int.from_bytes(data[:4], "big")
-        ack = bool(data[4])
-        syn = bool(data[5])
-        fin = bool(data[6])
-        data = data[7:]
-        return Packet(data=data, seq_number=seq_number, ack=ack, syn=syn, fin=fin)
+        packet = Packet.__new__(Packet)
+        packet.seq_number, packet.flags, packet.window = Packet.HEADER.unpack_from(data)
+        if packet.flags & Packet.CHECKSUM:
+            packet.checksum, = Packet.CHECKSUM_FIELD.unpack_from(data, Packet.HEADER_SIZE)
+            packet.data = memoryview(data)[Packet.HEADER_SIZE + Packet.CHECKSUM_FIELD.size:]
+        else:
+            packet.checksum = None
+            packet.data = memoryview(data)[Packet.HEADER_SIZE:]
+        return packet
     
     def __str__(self) -> str:
-        return f"Packet(seq_number={self.seq_number}, ack={self.ack}, syn={self.syn}, fin={self.fin}, datasize={len(self.data)})"
+        return f"Packet(seq_number={self.seq_number}, ack={self.ack}, syn={self.syn}, fin={self.fin}, window={self.window}, datasize={len(self.data)})"
+
+
+# frames de control sin payload, se codifican una sola vez
+ACK_FRAME = Packet(ack=True).to_bytes()
+FIN_FRAME = Packet(fin=True).to_bytes()
 
 
-class Sequence:
-    def __init__(self, send: int = 0, ack: int = 0):
-        self._send = send
-        self._ack = ack
+class SenderState:
+    """
+    Todo el estado del emisor de una conexion bajo un solo lock:
+    - secuencia: proximo byte a mandar (send), todo lo anterior a ack esta confirmado,
+    - ventana: el minimo entre la de congestion que decide el controller y la que
+      anuncia el receptor, menos los bytes en vuelo,
+    - timer de retransmision y estimacion del RTT (RFC 6298).
+
+    Los metodos asumen que quien llama tiene tomado lock (with state.lock:), salvo
+    los que dicen lo contrario: el envio de una ventana y el procesamiento de un ACK
+    toman el lock una sola vez, en lugar de uno por cada lectura o cambio. Los
+    numeros (ack, estimated_round_trip_time, etc.) se pueden leer sin el lock.
+
+    Se mide el RTT de un segmento por vez (el primero que se manda mientras no hay
+    otro midiendose) con time.monotonic_ns. Si hay una retransmision antes de su ACK
+    la medicion se descarta (algoritmo de Karn): no se sabe a cual de los envios responde.
+    El vencimiento del timer lo agenda el timer_service, on_expired se llama desde su
+    thread sin el lock tomado.
+    """
+    MIN_TIMEOUT = 0.02 # por debajo de esto cualquier demora del scheduler es un timeout falso
+    MAX_TIMEOUT = 60
+    MAX_BACKOFF = 64
+
+    def __init__(self, controller: WindowController, advertised: int, on_expired=None):
         self.lock = Lock()
+        self.send = 0
+        self.ack = 0
+        self.send_high = 0 # seq_number siguiente al mayor byte enviado, lo anterior ya es retransmision
+        self.controller = controller
+        self.in_flight = 0
+        self.advertised = advertised
+        self.deadline = None # monotonic_ns del vencimiento del timer
+        self.estimated_round_trip_time = 0.5
+        self.dev_round_trip_time = 0.125
+        self.measured = False # la primera muestra reemplaza a los valores iniciales
+        self.backoff = 1 # se duplica en cada timeout hasta tener una muestra nueva
+        self.timed_seq = None # ACK que cierra la medicion en curso
+        self.timed_start = None
+        self.alpha = 0.125
+        self.beta = 0.25
+        self.on_expired = on_expired
+        self._handle = None
+        self._generation = 0 # descarta vencimientos de un set anterior
 
-    @property
-    def send(self):
-        with self.lock:
-            return self._send
-    
-    @property
-    def ack(self):
-        with self.lock:
-            return self._ack
+    def available(self) -> int:
+        # siempre dejamos al menos un segmento en vuelo, sirve de sonda si el receptor anuncia ventana 0
+        limit = max(min(self.controller.cwnd, self.advertised), self.controller.segment_size)
+        return max(0, limit - self.in_flight)
 
-    @send.setter
-    def send(self, send: int):
-        with self.lock:
-            self._send = send
-    
-    @ack.setter
-    def ack(self, ack: int):
+    def on_sent(self, seq_number: int, size: int):
+        self.in_flight += size
+        self.send = seq_number + size
+        if self.send > self.send_high:
+            self.send_high = self.send
+
+    def on_ack(self, ack: int, rtt: float = None) -> int:
+        """
+        Avanza el ack y libera la ventana. Devuelve los bytes confirmados.
+        """
+        acked = ack - self.ack
+        self.ack = ack
+        # el ACK de algo mandado antes de un reset puede quedar adelante de send, seguimos desde ahi
+        if self.send < ack:
+            self.send = ack
+        self.in_flight = max(0, self.in_flight - acked)
+        self.controller.on_ack(acked, rtt)
+        return acked
+
+    def rewind(self):
+        # Go-Back-N: se vuelve a enviar desde el ack todo lo que estaba en vuelo
+        self.send = self.ack
+        self.in_flight = 0
+
+    def reset(self, timeout: bool = True):
+        # por timeout o por ACKs duplicados (fast retransmit, la ventana se reduce menos)
+        self.rewind()
+        if timeout:
+            self.controller.on_timeout()
+        else:
+            self.controller.on_loss()
+
+    def set_controller(self, controller: WindowController):
+        self.controller = controller
+        self.in_flight = 0
+
+    def snapshot(self) -> tuple:
+        """
+        (ventana de congestion, ventana anunciada, bytes en vuelo), toma el lock.
+        """
         with self.lock:
-            self._ack = ack
-    
-    def reset(self):
+            return self.controller.cwnd, self.advertised, self.in_flight
+
+    def timer_is_set(self) -> bool:
+        return self.deadline is not None
+
+    def set_timer(self):
+        timeout = self.timeout_interval()
+        self.deadline = monotonic_ns() + int(timeout * 1e9)
+        self._generation += 1
+        timer_service.cancel(self._handle)
+        if self.on_expired:
+            self._handle = timer_service.schedule(timeout, self._expire, self._generation)
+
+    def stop_timer(self):
+        self.deadline = None
+        self._generation += 1
+        timer_service.cancel(self._handle)
+        self._handle = None
+
+    def close(self):
+        """
+        Para el timer al cerrar la conexion, toma el lock.
+        """
         with self.lock:
-            self._send = self._ack
-    
-    def are_equal(self):
+            self.stop_timer()
+
+    def _expire(self, generation: int):
         with self.lock:
-            return self._send == self._ack
+            if generation != self._generation:
+                return
+            self.deadline = None
+            self._handle = None
+        self.on_expired()
+
+    def start_sample(self, ack_seq: int):
+        # empezamos a medir el segmento que se confirma con ack_seq, si no habia otro
+        if self.timed_seq is None:
+            self.timed_seq = ack_seq
+            self.timed_start = monotonic_ns()
+
+    def end_sample(self, ack: int) -> float:
+        """
+        Cierra la medicion si ack confirma el segmento medido. Devuelve el RTT en segundos o None.
+        """
+        if self.timed_seq is None or ack < self.timed_seq:
+            return None
+        sample = (monotonic_ns() - self.timed_start) / 1e9
+        self.timed_seq = None
+        self.add_sample(sample)
+        return sample
+
+    def cancel_sample(self):
+        # hubo una retransmision, el proximo ACK puede ser de cualquiera de los envios
+        self.timed_seq = None
+
+    def add_sample(self, sample: float):
+        if not self.measured:
+            self.measured = True
+            self.estimated_round_trip_time = sample
+            self.dev_round_trip_time = sample / 2
+        else:
+            self.dev_round_trip_time = (1 - self.beta) * self.dev_round_trip_time + self.beta * abs(sample - self.estimated_round_trip_time)
+            self.estimated_round_trip_time = (1 - self.alpha) * self.estimated_round_trip_time + self.alpha * sample
+        # con una muestra valida la red volvio a responder, dejamos el backoff
+        self.backoff = 1
 
+    def on_timeout(self):
+        # backoff exponencial: cada timeout seguido duplica el intervalo
+        self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+        self.timed_seq = None
 
-class Window:
-    def __init__(self, size: int):
-        self._size = size
-        self._actual_size = size
+    def timeout_interval(self) -> float:
+        # solo lee, se puede llamar sin el lock (RetransmissionQueue)
+        timeout = max(self.MIN_TIMEOUT, self.estimated_round_trip_time + 4 * self.dev_round_trip_time)
+        return min(self.MAX_TIMEOUT, timeout * self.backoff)
+
+
+class RetransmissionQueue:
+    """
+    Segmentos enviados y todavia no confirmados, cada uno con su propio timer en el timer_service.
+    Se usa en Selective Repeat para retransmitir solo los segmentos perdidos:
+    cuando vence un timer se llama on_expired(seq_number, payload) y se vuelve a agendar.
+    """
+    def __init__(self, on_expired, timeout_interval):
+        self._segments = OrderedDict() # seq_number -> [payload, timer, momento del envio, fue retransmitido], en orden de envio
+        self.on_expired = on_expired
+        self.timeout_interval = timeout_interval
         self.lock = Lock()
-        self.empty_window = Condition()
 
-    def decrease(self, size: int):
-        with self.lock:
-            old_size = self._actual_size
-            self._actual_size -= size
-            logger.debug(f'Window size, from {old_size} to {self._actual_size} - DECREASE')    
-    
-    def increase(self, size: int):
+    def add(self, seq_number: int, payload: memoryview, timeout: float):
         with self.lock:
-            old_size = self._actual_size
-            self._actual_size += size
-            logger.debug(f'Window size, from {old_size} to {self._actual_size} - INCREASE')
-        with self.empty_window:
-            self.empty_window.notify()      
-    
-    @property
-    def size(self)->int:
-        with self.lock:
-            return self._actual_size
-    
-    def reset(self, window_size: int = None):
+            handle = timer_service.schedule(timeout, self._expire, seq_number)
+            self._segments[seq_number] = [payload, handle, monotonic_ns(), False]
+
+    def ack(self, seq_number: int) -> float:
+        """
+        Confirma un segmento. Devuelve el RTT medido, o None si el segmento
+        ya estaba confirmado o fue retransmitido (algoritmo de Karn).
+        """
         with self.lock:
-            if window_size:
-                self._size = window_size
-            old_size = self._actual_size
-            self._actual_size = self._size
-            logger.debug(f'Window size, from {old_size} to {self._actual_size} - RESET')  
-            with self.empty_window:
-                self.empty_window.notify()
-
-
-class Timer:
-    def __init__(self):
-        self.start_time = None
-        self.limit_time = None
-        self.estimated_round_trip_time = 0.5
-        self.dev_round_trip_time = 0.125
-        self.lock = Lock()
-        self.alpha = 0.125
-        self.beta = 0.25
+            segment = self._segments.pop(seq_number, None)
+            if segment:
+                timer_service.cancel(segment[1])
+        if not segment or segment[3]:
+            return None
+        return (monotonic_ns() - segment[2]) / 1e9
 
-    def stop(self):
+    def ack_until(self, seq_number: int):
         with self.lock:
-            self.limit_time = None
-            self.start_time = None
+            # los segmentos se agregan en orden, los confirmados quedan al principio
+            while self._segments:
+                first = next(iter(self._segments))
+                if first >= seq_number:
+                    break
+                timer_service.cancel(self._segments.pop(first)[1])
 
-    def is_expired(self) -> bool:
+    def retransmit(self, seq_number: int) -> memoryview:
+        """
+        Marca un segmento como retransmitido antes de que venza su timer (fast retransmit)
+        y reinicia el timer. Devuelve el payload, o None si ya estaba confirmado.
+        """
         with self.lock:
-            return self.limit_time and datetime.now() > self.limit_time
-    
-    def is_set(self) -> bool:
+            segment = self._segments.get(seq_number)
+            if not segment:
+                return None
+            timer_service.cancel(segment[1])
+            segment[1] = timer_service.schedule(self.timeout_interval(), self._expire, seq_number)
+            segment[3] = True
+            return segment[0]
+
+    def _expire(self, seq_number: int):
         with self.lock:
-            return bool(self.limit_time)
-    
-    def update_estimated_round_trip_time(self):
+            segment = self._segments.get(seq_number)
+            if not segment:
+                return
+            segment[3] = True
+            payload = segment[0]
+        # on_expired puede aplicar el backoff, el timer nuevo se agenda despues
+        self.on_expired(seq_number, payload)
         with self.lock:
-            now = datetime.now()
-            if self.start_time:
-                sample = (now - self.start_time).total_seconds()
-                self.estimated_round_trip_time = (1 - self.alpha) * self.estimated_round_trip_time + self.alpha * sample
-                self.dev_round_trip_time = (1 - self.beta) * self.dev_round_trip_time + self.beta * abs(sample - self.estimated_round_trip_time)      
-    
-    def set(self):
+            segment = self._segments.get(seq_number)
+            if segment:
+                segment[1] = timer_service.schedule(self.timeout_interval(), self._expire, seq_number)
+
+    def clear(self):
         with self.lock:
-            self.start_time = datetime.now()
-            self.limit_time = self.start_time + timedelta(seconds=max(0.02, self.estimated_round_trip_time + 4 * self.dev_round_trip_time))
+            for segment in self._segments.values():
+                timer_service.cancel(segment[1])
+            self._segments.clear()
@@ -2,6 +2,7 @@ import os
 import socket
 import sys
 import logging
+from lib.constants import MAX_STREAMS
 
 logger = logging.getLogger("root")
 
@@ -102,6 +103,11 @@ def validate_destination_dir(dest_path):
     return True
 
 
+def validate_streams(streams):
+    """Valida la cantidad de conexiones en paralelo (1-MAX_STREAMS)."""
+    return 1 <= streams <= MAX_STREAMS
+
+
 def _base_validations(args):
     """Validaciones base: host y port."""
     errors = []
@@ -111,6 +117,9 @@ def _base_validations(args):
     
     if not validate_port(args.port):
         errors.append(f"Puerto inválido: {args.port}. Debe estar entre 1 y 65535.")
+
+    if hasattr(args, 'streams') and not validate_streams(args.streams):
+        errors.append(f"Cantidad de conexiones inválida: {args.streams}. Debe estar entre 1 y {MAX_STREAMS}.")
     
     return errors
 
@@ -129,6 +138,12 @@ def server_validations(args):
         else:
             errors.append(f"Directorio de almacenamiento inválido: '{args.storage}'.")
     
+    if getattr(args, 'metrics_port', None) is not None and not validate_port(args.metrics_port):
+        errors.append(f"Puerto de métricas inválido: {args.metrics_port}. Debe estar entre 1 y 65535.")
+
+    if getattr(args, 'stats_interval', 0) < 0:
+        errors.append(f"Intervalo de estadísticas inválido: {args.stats_interval}. No puede ser negativo.")
+
     if errors:
         logger.error("Errores de validación del servidor:")
         for error in errors:
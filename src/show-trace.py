@@ -0,0 +1,25 @@
+import argparse
+from lib.packet_trace import PacketTrace, TraceEvent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints a binary packet trace written with --trace.')
+    parser.add_argument('file', type=str, help='trace file')
+    parser.add_argument('-p', '--port', type=int, help='only the events of the connection with this peer port')
+    parser.add_argument('-e', '--event', type=str, nargs='+', choices=[event.name for event in TraceEvent], help='only these events')
+    args = parser.parse_args()
+
+    records = PacketTrace.load(args.file)
+    events = {TraceEvent[name] for name in args.event} if args.event else None
+    start = records[0][0] if records else 0
+    print(f"{'ms':>12} {'port':>6} {'event':<16} {'seq_number':>12} {'length':>7} {'window':>8}")
+    for timestamp, event, port, seq_number, length, window in records:
+        if args.port is not None and port != args.port:
+            continue
+        if events and event not in events:
+            continue
+        print(f"{(timestamp - start) / 1e6:12.3f} {port:6} {TraceEvent(event).name:<16} {seq_number:12} {length:7} {window:8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,14 @@ import argparse
 import logging
 import logging.config
 from threading import Thread
-from lib.constants import DEFAULT_HOST, DEFAULT_PORT, ClientMode, FILE_NOT_FOUND_ERROR_CODE
+from lib.constants import DEFAULT_HOST, DEFAULT_PORT, ClientMode, FILE_NOT_FOUND_ERROR_CODE, FILE_SIZE_LENGTH, RANGE_CLIENT_MODES, STREAM_INFO_LENGTH, RESUME_OFFSET_LENGTH
 from lib.validations import server_validations
 from lib.socket_tp import SocketTP
-from lib.file_transfer import send_file, recv_file
+from lib.reactor import Reactor
+from lib.file_cache import FileCache
+from lib.metrics import ServerMetrics
+from lib.packet_trace import start_trace
+from lib.file_transfer import send_file, recv_file, parse_stream_info, FileSender, FileReceiver, RangeReceiver
 import select
 
 logging.config.fileConfig("./lib/logging.conf")
@@ -36,7 +40,7 @@ def wait_for_close(socket):
     logger.info("Servidor cerrado.")
     
 
-def handle_client(socket: SocketTP, storage_dir: str):
+def handle_client(socket: SocketTP, storage_dir: str, cache: FileCache = None):
     try:
         client_mode_b = socket.recv(4)
         client_mode = ClientMode(int.from_bytes(client_mode_b, "big"))
@@ -46,32 +50,253 @@ def handle_client(socket: SocketTP, storage_dir: str):
         name_b = socket.recv(name_len)
         filename = name_b.decode("utf-8")
 
+        stream, streams = 0, 1
+        # los pedidos por rangos se pueden reanudar, el receptor dice desde donde seguir
+        resumable = client_mode in RANGE_CLIENT_MODES
+        if resumable:
+            stream, streams = parse_stream_info(socket.recv(STREAM_INFO_LENGTH))
 
     except Exception as e:
         logger.error(f"Error leyendo metadata inicial del cliente: {e}")
         socket.close()
         return
 
-    if client_mode == ClientMode.DOWNLOAD:
+    if client_mode in (ClientMode.DOWNLOAD, ClientMode.DOWNLOAD_RANGE):
         filepath = os.path.join(storage_dir, filename)
-        if not os.path.exists(filepath):
-            socket.sendall((FILE_NOT_FOUND_ERROR_CODE).to_bytes(4, "big", signed=True))
-            logger.error(f"Archivo {filepath} no existe, no se puede enviar.")
-            socket.close()
-            return
         try:
-            send_file(socket, filepath)
-        finally:
+            # si no existe lo sabemos al abrirlo (o por el stat de la cache), sin otro chequeo antes
+            send_file(socket, filepath, stream=stream, streams=streams, resumable=resumable, cache=cache)
             logger.info("Fin de la descarga, cerrando socket.")
+        except FileNotFoundError:
+            socket.sendall((FILE_NOT_FOUND_ERROR_CODE).to_bytes(FILE_SIZE_LENGTH, "big", signed=True))
+            logger.error(f"Archivo {filepath} no existe, no se puede enviar.")
+        finally:
+            logger.info(f"Estadísticas: {socket.stats()}")
+            if cache:
+                logger.info(f"Cache: {cache.stats()}")
             socket.close()
-    elif client_mode == ClientMode.UPLOAD:
+    elif client_mode in (ClientMode.UPLOAD, ClientMode.UPLOAD_RANGE):
         try:
-            recv_file(socket, storage_dir, filename)
+            recv_file(socket, storage_dir, filename, stream=stream, streams=streams, resumable=resumable)
         finally:
             logger.info("Fin de la subida, cerrando socket.")
+            logger.info(f"Estadísticas: {socket.stats()}")
             socket.close()
 
 
+def serve_client(socket: SocketTP, storage_dir: str, cache: FileCache, metrics: ServerMetrics):
+    metrics.add(socket)
+    try:
+        handle_client(socket, storage_dir, cache)
+    finally:
+        metrics.remove(socket)
+
+
+class ClientSession:
+    """
+    Atiende a un cliente en el servidor multiplexado (--reactor). Hace lo mismo que
+    handle_client, pero sin bloquear: todo pasa en los callbacks del reactor.
+    """
+    METADATA_HEADER_SIZE = 8 # modo (4 bytes) y largo del nombre (4 bytes), despues el nombre
+
+    def __init__(self, socket: SocketTP, storage_dir: str, cache: FileCache = None, metrics: ServerMetrics = None):
+        self.socket = socket
+        self.storage_dir = storage_dir
+        self.cache = cache
+        self.metrics = metrics
+        self.metadata = bytearray()
+        self.client_mode = None
+        self.filename = None
+        self.stream = 0
+        self.streams = 1
+        self.resume_offset = None # en las descargas por rangos, lo que el cliente ya tiene de la parte
+        self.sender = None
+        self.receiver = None
+        self.finished = False
+        # como mucho dos ventanas leidas de disco esperando confirmacion
+        self.chunk_size = socket.MAX_WINDOW
+        socket.on_data = self.on_data
+        socket.on_acked = self.on_acked
+        socket.on_fin = self.on_fin
+        socket.on_closed = self.on_closed
+        if metrics:
+            metrics.add(socket)
+
+    @property
+    def downloading(self) -> bool:
+        return self.client_mode in (ClientMode.DOWNLOAD, ClientMode.DOWNLOAD_RANGE)
+
+    @property
+    def resumable(self) -> bool:
+        return self.client_mode in RANGE_CLIENT_MODES
+
+    def on_data(self, data):
+        if self.finished:
+            return
+        view = memoryview(data)
+        if self.filename is None:
+            try:
+                view = view[self._read_metadata(view):]
+                if self.filename is None:
+                    return
+                self._start()
+            except Exception as e:
+                logger.error(f"Error leyendo metadata inicial del cliente: {e}")
+                self._finish()
+                return
+
+        if self.resume_offset is not None and view:
+            try:
+                self._read_resume_offset(view)
+            except Exception as e:
+                logger.error(f"Error reanudando la descarga: {e}")
+                self._finish()
+            return
+
+        if self.receiver and view:
+            try:
+                header_pending = self.receiver.header_pending
+                self.receiver.feed(view)
+                if header_pending and self.resumable and not self.receiver.header_pending:
+                    # le decimos al cliente desde donde seguir, recien ahi manda los datos
+                    self.socket.send(self.receiver.offset.to_bytes(RESUME_OFFSET_LENGTH, "big"))
+            except Exception as e:
+                logger.error(f"Error recibiendo archivo: {e}")
+                self.receiver.abort()
+                self._finish()
+                return
+            if self.receiver.done:
+                logger.info("Fin de la subida, cerrando socket.")
+                self._finish()
+
+    def _read_metadata(self, view: memoryview) -> int:
+        used = 0
+        while self.filename is None and used < len(view):
+            target = self.METADATA_HEADER_SIZE
+            if len(self.metadata) >= self.METADATA_HEADER_SIZE:
+                self.client_mode = ClientMode(int.from_bytes(self.metadata[:4], "big"))
+                target += int.from_bytes(self.metadata[4:8], "big")
+                if self.client_mode in RANGE_CLIENT_MODES:
+                    target += STREAM_INFO_LENGTH
+            length = min(target - len(self.metadata), len(view) - used)
+            self.metadata += view[used: used + length]
+            used += length
+            if len(self.metadata) == target and target > self.METADATA_HEADER_SIZE:
+                name_end = self.METADATA_HEADER_SIZE + int.from_bytes(self.metadata[4:8], "big")
+                self.filename = self.metadata[self.METADATA_HEADER_SIZE: name_end].decode("utf-8")
+                if self.client_mode in RANGE_CLIENT_MODES:
+                    self.stream, self.streams = parse_stream_info(self.metadata[name_end:])
+        return used
+
+    def _read_resume_offset(self, view: memoryview):
+        length = min(RESUME_OFFSET_LENGTH - len(self.resume_offset), len(view))
+        self.resume_offset += view[:length]
+        if len(self.resume_offset) == RESUME_OFFSET_LENGTH:
+            self.sender.resume(int.from_bytes(self.resume_offset, "big"))
+            self.resume_offset = None
+            self._fill()
+
+    def _start(self):
+        if self.downloading:
+            filepath = os.path.join(self.storage_dir, self.filename)
+            try:
+                self.sender = FileSender(filepath, self.stream, self.streams, self.cache, self.socket.compression, self.socket.checksums)
+            except FileNotFoundError:
+                logger.error(f"Archivo {filepath} no existe, no se puede enviar.")
+                self.socket.send((FILE_NOT_FOUND_ERROR_CODE).to_bytes(FILE_SIZE_LENGTH, "big", signed=True))
+                return
+            self.socket.send(self.sender.header())
+            if self.resumable:
+                # no mandamos datos hasta saber cuanto tiene el cliente
+                self.resume_offset = bytearray()
+                return
+            self._fill()
+        elif self.client_mode == ClientMode.UPLOAD_RANGE:
+            self.receiver = RangeReceiver(os.path.join(self.storage_dir, self.filename), self.stream, self.streams, self.socket.compression, self.socket.checksums)
+        elif self.client_mode == ClientMode.UPLOAD:
+            self.receiver = FileReceiver(os.path.join(self.storage_dir, self.filename), self.socket.compression, self.socket.checksums)
+
+    def _fill(self):
+        # leemos el siguiente chunk recien cuando se confirmo el anterior
+        while self.sender and self.resume_offset is None and self.socket.unacked_bytes() < self.chunk_size:
+            chunk, segments = self.sender.read_segments(self.chunk_size)
+            if not chunk:
+                self.sender = None
+                break
+            self.socket.send(chunk, segments)
+
+    def on_acked(self):
+        if self.finished or not self.downloading:
+            return
+        self._fill()
+        if not self.sender and self.socket.unacked_bytes() == 0:
+            logger.info("Fin de la descarga, cerrando socket.")
+            self._finish()
+
+    def on_fin(self):
+        if self.finished:
+            return
+        if self.downloading and not self.sender:
+            # el cliente ya tiene todo, puede cerrar antes de que nos llegue el ultimo ACK
+            logger.info("Fin de la descarga, cerrando socket.")
+        else:
+            logger.error("El cliente cerró la conexión antes de terminar la transferencia.")
+            self._abort()
+        self._finish()
+
+    def on_closed(self):
+        if self.metrics:
+            self.metrics.remove(self.socket)
+        if not self.finished:
+            logger.error("Se perdió la conexión con el cliente.")
+            self._abort()
+            self.finished = True
+
+    def _abort(self):
+        if self.receiver:
+            self.receiver.abort()
+        if self.sender:
+            self.sender.close()
+            self.sender = None
+
+    def _finish(self):
+        self.finished = True
+        logger.info(f"Estadísticas: {self.socket.stats()}")
+        if self.cache and self.downloading:
+            logger.info(f"Cache: {self.cache.stats()}")
+        self.socket.close()
+
+
+def run_reactor(args, cache: FileCache, metrics: ServerMetrics):
+    reactor = Reactor(args.host, args.port, lambda socket: ClientSession(socket, args.storage, cache, metrics))
+    reactor.start()
+    # un solo thread atiende todas las conexiones, este solo espera la tecla para cerrar
+    close_thread = Thread(target=wait_for_close, args=(reactor,))
+    close_thread.start()
+    close_thread.join()
+    reactor.thread.join()
+
+
+def run_threaded(args, cache: FileCache, metrics: ServerMetrics):
+    s = SocketTP()
+    s.bind(args.host, args.port)
+    s.listen()
+    threads = []
+    close_thread = Thread(target=wait_for_close, args=(s,))
+    close_thread.start()
+    try:
+        while new_socket := s.accept():
+            thread = Thread(target=serve_client, args=(new_socket, args.storage, cache, metrics))
+            thread.start()
+            threads.append(thread)
+    except Exception:
+        logger.info("Cerrando servidor")
+
+    close_thread.join()
+    for thread in threads:
+        thread.join()
+
+
 def main():
     parser = argparse.ArgumentParser(description='Starts the server for file transfers.')
     parser.add_argument('-v', '--verbose', action='store_true', help='increase output verbosity')
@@ -79,6 +304,12 @@ def main():
     parser.add_argument('-H', '--host', type=str, default=DEFAULT_HOST, help='service IP address')
     parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT, help='service port')
     parser.add_argument('-s', '--storage', type=str, required=True, help='storage directory path')
+    parser.add_argument('--reactor', action='store_true', help='serve every client from a single thread and port')
+    parser.add_argument('--cache-size', type=int, default=0, help='MB of memory for the most downloaded files, 0 (the default) disables the cache')
+    parser.add_argument('--presegment', action='store_true', help='keep cached files already split into segments ready to send')
+    parser.add_argument('--stats-interval', type=float, default=0, help='seconds between logs of the server wide statistics, 0 disables them')
+    parser.add_argument('--metrics-port', type=int, help='serve the server wide statistics as Prometheus text on this local port')
+    parser.add_argument('--trace', type=str, help='write a binary trace of the last packet events to this file on exit (see show-trace.py)')
 
     args = parser.parse_args()
     server_validations(args)
@@ -91,23 +322,29 @@ def main():
     
     logger.info(f"Iniciando el servidor en {args.host}:{args.port} con el directorio de almacenamiento en '{args.storage}'")
     
-    s = SocketTP()
-    s.bind(args.host, args.port)
-    s.listen()
-    threads = []
-    close_thread = Thread(target=wait_for_close, args=(s,))
-    close_thread.start()
+    cache = None
+    if args.cache_size > 0:
+        segment_size = SocketTP.PACKET_DATA_SIZE if args.presegment else None
+        cache = FileCache(args.cache_size * 1024 * 1024, segment_size=segment_size)
+
+    trace = start_trace() if args.trace else None
+    metrics = ServerMetrics()
+    if args.stats_interval > 0:
+        metrics.log_every(args.stats_interval)
+    if args.metrics_port:
+        metrics.serve("127.0.0.1", args.metrics_port)
+
     try:
-        while new_socket := s.accept():
-            thread = Thread(target=handle_client, args=(new_socket, args.storage))
-            thread.start()
-            threads.append(thread)
-    except Exception:
-        logger.info("Cerrando servidor")
+        if args.reactor:
+            run_reactor(args, cache, metrics)
+        else:
+            run_threaded(args, cache, metrics)
+    finally:
+        logger.info(f"Estadísticas del servidor: {metrics.stats()}")
+        metrics.close()
+        if trace:
+            logger.info(f"Traza de paquetes: {trace.dump(args.trace)} eventos en '{args.trace}'")
+
 
-    close_thread.join()
-    for thread in threads:
-        thread.join()
-    
 if __name__ == '__main__':
     main()
@@ -0,0 +1,46 @@
+"""
+Subidas a traves de un proxy que descarta la primera transmision de uno de cada
+DROP_EVERY segmentos de datos, con y sin fast retransmit.
+
+Uso (desde src/): python3 -m pytest tests  o  python3 -m unittest discover tests
+"""
+import os
+import unittest
+from lib.constants import ErrorRecoveryMode
+from lib.socket_tp import SocketTP
+from benchmarks.fast_retransmit import upload
+
+SIZE = 500_000
+DROP_EVERY = 25
+
+
+class FastRetransmitTest(unittest.TestCase):
+    def setUp(self):
+        self.data = os.urandom(SIZE)
+        self.threshold = SocketTP.DUPLICATE_ACK_THRESHOLD
+
+    def tearDown(self):
+        SocketTP.DUPLICATE_ACK_THRESHOLD = self.threshold
+
+    def check_recovery(self, mode: ErrorRecoveryMode):
+        _, lost_without, stats_without, received = upload(mode, self.data, DROP_EVERY, 0)
+        self.assertEqual(received, self.data)
+        self.assertGreater(lost_without, 0)
+        self.assertEqual(stats_without["fast_retransmits"], 0)
+
+        _, lost_with, stats_with, received = upload(mode, self.data, DROP_EVERY, self.threshold)
+        self.assertEqual(received, self.data)
+        # el proxy descarta los mismos segmentos en las dos corridas
+        self.assertEqual(lost_with, lost_without)
+        self.assertGreater(stats_with["fast_retransmits"], 0)
+        self.assertLess(stats_with["timeouts"], stats_without["timeouts"])
+
+    def test_go_back_n(self):
+        self.check_recovery(ErrorRecoveryMode.GO_BACK_N)
+
+    def test_selective_repeat(self):
+        self.check_recovery(ErrorRecoveryMode.SELECTIVE_REPEAT)
+
+
+if __name__ == '__main__':
+    unittest.main()